@@ -0,0 +1,448 @@
+import os
+import uuid
+import random
+import asyncio
+import threading
+import contextvars
+from contextlib import asynccontextmanager
+from typing import TYPE_CHECKING, AsyncIterable, Awaitable, Callable, Iterable, Optional, Union
+
+from metrics import get_run_metrics
+
+if TYPE_CHECKING:
+    from tqdm import tqdm
+
+
+class RetryPolicy:
+    """
+    页面失败后的重试策略：指数退避、随机抖动和最大尝试次数
+
+    只有带有retryable=True属性的异常（例如限流、服务端错误、网络超时）才会重试，
+    其他异常视为致命错误，直接记录为失败。
+    """
+
+    def __init__(self, max_attempts: int = 5, base_delay: float = 1.0, max_delay: float = 60.0, jitter: float = 0.5):
+        """
+        Args:
+            max_attempts: 每个任务最多尝试的次数（包括第一次）
+            base_delay: 第一次重试前的基础等待秒数，之后每次翻倍
+            max_delay: 单次等待的最大秒数
+            jitter: 随机抖动比例，0表示不抖动，1表示在[0, 退避时间]内均匀随机
+        """
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.jitter = min(max(jitter, 0.0), 1.0)
+
+    @classmethod
+    def from_env(cls) -> "RetryPolicy":
+        """
+        从环境变量RETRY_MAX_ATTEMPTS、RETRY_BASE_DELAY、RETRY_MAX_DELAY、RETRY_JITTER读取重试策略
+        """
+        return cls(
+            max_attempts=int(os.environ.get("RETRY_MAX_ATTEMPTS", 5)),
+            base_delay=float(os.environ.get("RETRY_BASE_DELAY", 1.0)),
+            max_delay=float(os.environ.get("RETRY_MAX_DELAY", 60.0)),
+            jitter=float(os.environ.get("RETRY_JITTER", 0.5)),
+        )
+
+    def should_retry(self, error: Exception, attempt: int) -> bool:
+        """
+        判断第attempt次尝试失败后是否应该重试
+        """
+        return getattr(error, "retryable", False) and attempt < self.max_attempts
+
+    def delay(self, error: Exception, attempt: int) -> float:
+        """
+        计算第attempt次尝试失败后的等待秒数，服务端给出的Retry-After优先
+        """
+        backoff = min(self.max_delay, self.base_delay * (2 ** (attempt - 1)))
+        backoff *= 1.0 - self.jitter * random.random()
+        retry_after = getattr(error, "retry_after", None)
+        if retry_after:
+            backoff = max(backoff, min(retry_after, self.max_delay))
+        return backoff
+
+
+class _Slot:
+    """
+    调度器中一个任务占用的并发名额，记录当前是否持有，避免重复释放
+    """
+
+    def __init__(self, semaphore: asyncio.Semaphore):
+        self.semaphore = semaphore
+        self.held = True
+
+    def release(self):
+        if self.held:
+            self.held = False
+            self.semaphore.release()
+
+    async def acquire(self):
+        if not self.held:
+            await self.semaphore.acquire()
+            self.held = True
+
+
+# 当前任务占用的并发名额，供released_slot在等待期间让出
+_current_slot = contextvars.ContextVar("current_slot", default=None)
+
+
+@asynccontextmanager
+async def released_slot():
+    """
+    在调度器的任务中等待其他任务的结果时暂时让出并发名额，等待结束后重新占用
+
+    被等待的任务可能正在退避重试，需要重新获得名额才能继续；持有名额等待它会造成死锁。
+    不在调度器的任务中调用时不做任何事。
+    """
+    slot = _current_slot.get()
+    if slot is None:
+        yield
+        return
+    slot.release()
+    try:
+        yield
+    finally:
+        await slot.acquire()
+
+
+class RequestScheduler:
+    """
+    基于信号量的异步请求调度器
+
+    同一时刻最多有max_concurrency个任务在执行。任务从迭代器中按需取出，
+    只有在获得并发名额后才会创建协程，因此数千个页面也不会一次性占用内存或线程。
+    等待重试期间（以及在released_slot中等待其他任务时）会让出并发名额，出错的任务不会占着名额空转。
+    """
+
+    def __init__(self, max_concurrency: int, retry_policy: Optional[RetryPolicy] = None):
+        if max_concurrency < 1:
+            raise ValueError("max_concurrency必须大于0")
+        self.max_concurrency = max_concurrency
+        self.retry_policy = retry_policy or RetryPolicy.from_env()
+        self.retry_count = 0
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def map(self,
+                  tasks: Union[Iterable, AsyncIterable],
+                  handler: Callable[[object], Awaitable],
+                  on_error: Optional[Callable[[object, Exception, float], None]] = None,
+                  on_failure: Optional[Callable[[object, Exception, int], None]] = None,
+                  progress: Optional["tqdm"] = None) -> list:
+        """
+        并发执行所有任务，按重试策略重试可恢复的错误
+
+        Args:
+            tasks: 任务迭代器或异步迭代器（异步迭代器可以在产出任务前等待，用于实现背压）
+            handler: 处理单个任务的协程函数
+            on_error: 任务出错且即将重试时的回调，参数为任务、异常和等待秒数
+            on_failure: 任务最终失败时的回调，参数为任务、最后一次的异常和尝试次数
+            progress: 可选的tqdm进度条，每完成（或最终失败）一个任务前进一步
+
+        Returns:
+            成功任务的处理结果列表（按完成顺序）
+        """
+        results = []
+        running = set()
+
+        async def run_one(task, slot):
+            _current_slot.set(slot)
+            attempt = 0
+            while True:
+                attempt += 1
+                try:
+                    result = await handler(task)
+                except Exception as e:
+                    if not self.retry_policy.should_retry(e, attempt):
+                        if on_failure is not None:
+                            on_failure(task, e, attempt)
+                        break
+                    delay = self.retry_policy.delay(e, attempt)
+                    self.retry_count += 1
+                    if on_error is not None:
+                        on_error(task, e, delay)
+                    # 退避期间让出并发名额
+                    slot.release()
+                    try:
+                        await asyncio.sleep(delay)
+                    finally:
+                        await slot.acquire()
+                else:
+                    results.append(result)
+                    break
+            if progress is not None:
+                progress.update(1)
+
+        def on_done(future, slot):
+            running.discard(future)
+            # 任务结束时归还名额；任务在开始执行前被取消时也会归还
+            slot.release()
+
+        async def submit(task):
+            await self._semaphore.acquire()
+            slot = _Slot(self._semaphore)
+            future = asyncio.create_task(run_one(task, slot))
+            running.add(future)
+            future.add_done_callback(lambda future: on_done(future, slot))
+
+        try:
+            if hasattr(tasks, "__aiter__"):
+                async for task in tasks:
+                    await submit(task)
+            else:
+                for task in tasks:
+                    await submit(task)
+            if running:
+                await asyncio.gather(*running)
+        except BaseException:
+            for future in running:
+                future.cancel()
+            raise
+
+        return results
+
+
+class DocumentJob:
+    """
+    一个待转换的文档：若干页面任务、逐页处理协程，以及全部页面结束后的收尾操作
+
+    多个文档的页面任务可以交给同一个调度器交错执行，每个文档在最后一页结束
+    （成功或重试耗尽后失败）时立即收尾。
+    """
+
+    def __init__(self,
+                 name: str,
+                 tasks: list,
+                 handler: Callable[[object], Awaitable],
+                 finalize: Callable[[list, list], None],
+                 on_error: Optional[Callable[[object, Exception, float], None]] = None,
+                 on_failure: Optional[Callable[[object, Exception, int], None]] = None,
+                 admit: Optional[Callable[[object], Awaitable]] = None,
+                 page_number: Optional[Callable[[object], int]] = None):
+        """
+        Args:
+            name: 文档名称，用于输出提示
+            tasks: 页面任务列表
+            handler: 处理单个页面任务的协程函数
+            finalize: 全部页面结束后调用，参数为成功页面的处理结果（按完成顺序）
+                和失败页面列表（任务、异常、尝试次数）
+            on_error: 页面任务出错且即将重试时的回调，参数为任务、异常和等待秒数
+            on_failure: 页面任务最终失败时的回调，参数为任务、异常和尝试次数
+            admit: 分配页面任务前等待的协程函数，返回前不会把该任务交给调度器（用于背压）
+            page_number: 返回页面任务从0开始的页码，用于运行统计；为None时按任务在列表中的位置编号
+        """
+        self.name = name
+        self.tasks = tasks
+        self.handler = handler
+        self.finalize = finalize
+        self.on_error = on_error
+        self.on_failure = on_failure
+        self.admit = admit
+        self.page_number = page_number
+        # 运行统计中区分同名文档的任务ID（JobManager改为后台任务的ID）
+        self.run_id = uuid.uuid4().hex[:8]
+        self.results = []
+        self.failures = []
+        self.finished = False
+
+    @property
+    def total(self) -> int:
+        return len(self.tasks)
+
+    def _check_done(self):
+        if len(self.results) + len(self.failures) == self.total:
+            self.complete()
+
+    def add_result(self, result):
+        """
+        记录一个页面的处理结果，最后一页结束时执行收尾操作
+        """
+        self.results.append(result)
+        self._check_done()
+
+    def add_failure(self, task, error: Exception, attempts: int):
+        """
+        记录一个重试耗尽（或遇到致命错误）的页面，最后一页结束时执行收尾操作
+        """
+        self.failures.append((task, error, attempts))
+        if self.on_failure is not None:
+            self.on_failure(task, error, attempts)
+        self._check_done()
+
+    def complete(self):
+        """
+        执行收尾操作（只执行一次），收尾出错时打印错误而不影响其他文档
+        """
+        if self.finished:
+            return
+        self.finished = True
+        try:
+            self.finalize(self.results, self.failures)
+        except Exception as e:
+            print(f"保存文档 '{self.name}' 时出错: {str(e)}")
+
+
+async def run_jobs(jobs: Iterable[DocumentJob], scheduler: RequestScheduler, progress: Optional["tqdm"] = None):
+    """
+    将所有文档的页面放入同一个工作队列，由一个调度器统一限制并发
+
+    文档按需打开：只有当调度器准备好处理某个文档的页面时才会从jobs迭代器中取出该文档，
+    因此jobs可以是惰性生成器。文档提供admit时，每个页面任务在分配前先等待admit完成；
+    背压只作用于该文档本身：已打开的文档都在等待admit时（例如某页正在退避重试，重排窗口已满），
+    打开下一个文档填补空闲的并发名额，而不是让整个队列停下来。各文档按打开顺序优先分配页面。
+    每个页面的每次尝试、重试和最终失败都计入运行统计（metrics.get_run_metrics）。
+
+    Args:
+        jobs: DocumentJob迭代器，其中的None会被跳过
+        scheduler: 所有文档共享的请求调度器
+        progress: 可选的tqdm进度条，总数随文档打开逐步增加
+    """
+    metrics = get_run_metrics()
+    documents = iter(jobs)
+
+    def open_next():
+        for job in documents:
+            if job is None:
+                continue
+            if progress is not None:
+                progress.total = (progress.total or 0) + job.total
+                progress.refresh()
+            if job.total == 0:
+                job.complete()
+                continue
+            return [job, enumerate(job.tasks), None]
+        return None
+
+    async def next_unit(job, tasks):
+        """
+        取出文档的下一个页面任务并等待admit，页面都已分配时返回None
+        """
+        for index, task in tasks:
+            if job.admit is not None:
+                await job.admit(task)
+            page = (job.page_number(task) if job.page_number is not None else index) + 1
+            return job, task, page
+        return None
+
+    async def units():
+        # 已打开且还有页面未分配的文档：[文档, 页面迭代器, 正在准备的下一个页面]
+        active = []
+        exhausted = False
+        try:
+            while True:
+                for entry in active:
+                    if entry[2] is None:
+                        entry[2] = asyncio.ensure_future(next_unit(entry[0], entry[1]))
+                # 让不需要等待的admit先完成
+                await asyncio.sleep(0)
+                ready = next((entry for entry in active if entry[2].done()), None)
+                if ready is None:
+                    if not exhausted:
+                        entry = open_next()
+                        if entry is not None:
+                            active.append(entry)
+                            continue
+                        exhausted = True
+                    if not active:
+                        return
+                    await asyncio.wait([entry[2] for entry in active], return_when=asyncio.FIRST_COMPLETED)
+                    continue
+                unit = ready[2].result()
+                ready[2] = None
+                if unit is None:
+                    active.remove(ready)
+                    continue
+                yield unit
+        finally:
+            for entry in active:
+                if entry[2] is not None:
+                    entry[2].cancel()
+
+    async def handle(unit):
+        job, task, page = unit
+        with metrics.page(job.name, page, job.run_id):
+            result = await job.handler(task)
+        job.add_result(result)
+
+    def on_error(unit, e, delay):
+        job, task, page = unit
+        metrics.record_retry(job.name, page, delay, job.run_id)
+        if job.on_error is not None:
+            job.on_error(task, e, delay)
+
+    def on_failure(unit, e, attempts):
+        job, task, page = unit
+        metrics.record_failure(job.name, page, job.run_id)
+        job.add_failure(task, e, attempts)
+
+    await scheduler.map(units(), handle, on_error=on_error, on_failure=on_failure, progress=progress)
+
+
+def run_sync(coro):
+    """
+    在新的事件循环中运行协程，供同步接口调用，结束前关闭异步HTTP客户端
+
+    Args:
+        coro: 要运行的协程
+
+    Returns:
+        协程的返回值
+    """
+    from vision_api import close_async_clients
+
+    async def runner():
+        try:
+            return await coro
+        finally:
+            await close_async_clients()
+
+    return asyncio.run(runner())
+
+
+_shared_loop = None
+_shared_loop_lock = threading.Lock()
+
+
+def get_shared_loop() -> asyncio.AbstractEventLoop:
+    """
+    获取进程内共享的后台事件循环（第一次调用时在守护线程中启动）
+
+    逐页调用的同步接口都在这个事件循环中运行，异步HTTP客户端按事件循环缓存，
+    因此各线程的调用共用同一个客户端和keep-alive连接，不会每次调用都重新建立连接。
+    """
+    global _shared_loop
+    with _shared_loop_lock:
+        if _shared_loop is None:
+            _shared_loop = asyncio.new_event_loop()
+            threading.Thread(target=_shared_loop.run_forever, name="shared-loop", daemon=True).start()
+        return _shared_loop
+
+
+def run_shared(coro):
+    """
+    在共享的后台事件循环中运行协程并等待结果，供逐页调用的同步接口使用
+
+    可以在任意线程（包括正在运行其他事件循环的线程）中调用，HTTP客户端在多次调用之间保持打开；
+    调用方被中断（例如KeyboardInterrupt）时取消协程。
+
+    Args:
+        coro: 要运行的协程
+
+    Returns:
+        协程的返回值
+    """
+    loop = get_shared_loop()
+    try:
+        running = asyncio.get_running_loop()
+    except RuntimeError:
+        running = None
+    if running is loop:
+        coro.close()
+        raise RuntimeError("不能在共享事件循环中同步等待，请直接await异步版本")
+    future = asyncio.run_coroutine_threadsafe(coro, loop)
+    try:
+        return future.result()
+    except BaseException:
+        future.cancel()
+        raise
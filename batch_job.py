@@ -0,0 +1,359 @@
+import os
+import json
+import hashlib
+import tempfile
+
+import imghdr
+from dotenv import load_dotenv
+
+from vision_api import (build_request_body, encode_image, request_fingerprint, post_chat_completion_async,
+                        RetryableAPIError, FatalAPIError, RepeatedOutputError)
+from repetition import find_repetition
+from async_engine import RequestScheduler, run_sync
+from page_cache import get_page_cache
+from checkpoint import CheckpointJournal, file_fingerprint
+from render_pool import prepare_loaded_page
+from page_filter import get_duplicate_index, hash_distance
+from pdf_to_markdown import prepare_slide, read_image_bytes, failed_page_placeholder, write_failure_report
+
+# 加载环境变量
+load_dotenv()
+
+# 批处理请求行中的接口路径（智谱批处理接口的格式）
+BATCH_URL = "/v4/chat/completions"
+# 图片文件扩展名列表
+IMAGE_EXTENSIONS = [".jpg", ".jpeg", ".png", ".bmp", ".gif", ".tiff"]
+
+
+def manifest_path_for(batch_path: str) -> str:
+    """
+    批处理请求文件对应的清单文件路径，例如 batch.jsonl -> batch.manifest.json
+    """
+    return os.path.splitext(batch_path)[0] + ".manifest.json"
+
+
+def _fingerprint_text() -> str:
+    return hashlib.sha256(json.dumps(request_fingerprint(), sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+def open_document_pages(file_path: str, hybrid: bool = False):
+    """
+    打开文档，返回页数和依次加载并渲染每一页的生成器
+
+    Args:
+        file_path: PDF、PPT/PPTX或图片文件路径
+        hybrid: 是否启用混合模式，纯文本页面在本地转换
+
+    Returns:
+        (页数, 页面生成器) 元组；生成器依次产出 (页码, 路由说明, 本地生成的Markdown, 图像字节, 渲染参数)，
+        后四项的含义同render_pool.prepare_loaded_page
+    """
+    file_ext = os.path.splitext(file_path)[1].lower()
+    if file_ext == ".pdf":
+        import fitz  # PyMuPDF
+
+        document = fitz.open(file_path)
+
+        def pdf_pages():
+            try:
+                for page_num in range(document.page_count):
+                    yield (page_num, *prepare_loaded_page(document.load_page(page_num), hybrid))
+            finally:
+                document.close()
+        return document.page_count, pdf_pages()
+
+    if file_ext in (".ppt", ".pptx"):
+        from pptx import Presentation
+        from ppt_render import DeckRenderer, hidden_slide_flags
+
+        presentation = Presentation(file_path)
+
+        def slide_pages():
+            # 整个演示文稿只导出一次，导出结果在生成器结束时清理
+            with tempfile.TemporaryDirectory() as temp_dir:
+                deck = DeckRenderer(file_path, temp_dir, hidden_slide_flags(presentation))
+                try:
+                    for slide_num, slide in enumerate(presentation.slides):
+                        route, markdown, image, info = prepare_slide({
+                            'slide_num': slide_num, 'slide': slide, 'deck': deck, 'hybrid': hybrid
+                        })
+                        yield slide_num, route, markdown, None if image is None else read_image_bytes(image), info
+                finally:
+                    deck.close()
+        return len(presentation.slides), slide_pages()
+
+    if file_ext in IMAGE_EXTENSIONS or imghdr.what(file_path):
+        return 1, iter([(0, "视觉模型", None, read_image_bytes(file_path), None)])
+    raise ValueError(f"不支持的文件类型 '{file_ext}'")
+
+
+def export_batch(file_paths, batch_path: str, output_dir: str|None = None, hybrid: bool = False) -> str:
+    """
+    渲染所有文件的全部页面，写出批处理请求文件（JSONL）和清单文件
+
+    每个需要视觉模型的页面写出一行请求，custom_id由源文件指纹和页码组成，
+    同一文件重复导出时保持不变。本地转换的页面、空白页和页面缓存命中的页面直接记入清单；
+    图像完全相同的页面（包括不同文件之间）和开启近似重复时的近似重复页面共用一个请求。
+
+    Args:
+        file_paths: 文件路径列表
+        batch_path: 批处理请求文件路径
+        output_dir: Markdown输出目录，如果为None则输出到与输入文件相同的目录
+        hybrid: 是否启用混合模式（仅对PDF和PPT文件有效）
+
+    Returns:
+        清单文件路径
+    """
+    cache = get_page_cache()
+    duplicates = get_duplicate_index()
+    documents = []
+    requests_by_key = {}
+    counts = {"requests": 0, "local": 0, "cached": 0, "reused": 0, "blank": 0}
+
+    with open(batch_path, "w", encoding="utf-8") as batch_file:
+        for file_path in file_paths:
+            if not os.path.exists(file_path):
+                print(f"错误：文件 '{file_path}' 不存在")
+                continue
+            if output_dir:
+                output_path = os.path.join(output_dir, os.path.splitext(os.path.basename(file_path))[0] + ".md")
+            else:
+                output_path = os.path.splitext(file_path)[0] + ".md"
+
+            fingerprint = file_fingerprint(file_path)
+            pages = {}
+            recent = []
+            try:
+                total, document_pages = open_document_pages(file_path, hybrid)
+                for page_num, route, markdown, image, info in document_pages:
+                    if markdown is not None:
+                        pages[str(page_num)] = {"content": f"\n\n{markdown}\n\n", "route": route}
+                        counts["blank" if markdown == "" else "local"] += 1
+                        continue
+
+                    # 开启近似重复时引用与前面某页近似的结果；完全相同的页面按缓存键共用请求
+                    phash = info.get("phash") if info else None
+                    if duplicates is not None and duplicates.threshold > 0 and phash is not None:
+                        match = next((num for other, num in reversed(recent) if hash_distance(phash, other) <= duplicates.threshold), None)
+                        recent = (recent + [(phash, page_num)])[-duplicates.window:]
+                        if match is not None:
+                            pages[str(page_num)] = {"same_as": match, "route": f"近似重复（复用第 {match + 1} 页）"}
+                            counts["reused"] += 1
+                            continue
+
+                    cache_key = cache.make_key(image)
+                    cached_text = cache.get(cache_key) if cache.enabled else None
+                    if cached_text is not None:
+                        pages[str(page_num)] = {"content": f"\n\n{cached_text}\n\n", "route": route}
+                        counts["cached"] += 1
+                        continue
+
+                    # 图像完全相同的页面只请求一次
+                    custom_id = requests_by_key.get(cache_key)
+                    if custom_id is None:
+                        custom_id = f"{fingerprint[:16]}-{page_num:05d}"
+                        requests_by_key[cache_key] = custom_id
+                        batch_file.write(json.dumps({
+                            "custom_id": custom_id,
+                            "method": "POST",
+                            "url": BATCH_URL,
+                            "body": build_request_body(encode_image(image)),
+                        }, ensure_ascii=False) + "\n")
+                        counts["requests"] += 1
+                    else:
+                        counts["reused"] += 1
+                    pages[str(page_num)] = {"custom_id": custom_id, "cache_key": cache_key, "route": route}
+            except Exception as e:
+                print(f"渲染文件 '{file_path}' 时出错: {str(e)}")
+                continue
+
+            documents.append({
+                "source": file_path,
+                "output": output_path,
+                "fingerprint": fingerprint,
+                "total": total,
+                "pages": pages,
+            })
+            print(f"已渲染 {total} 页: {file_path}")
+
+    manifest_path = manifest_path_for(batch_path)
+    with open(manifest_path, "w", encoding="utf-8") as manifest_file:
+        json.dump({
+            "batch": os.path.abspath(batch_path),
+            "request_fingerprint": _fingerprint_text(),
+            "documents": documents,
+        }, manifest_file, ensure_ascii=False, indent=2)
+
+    print(f"批处理请求已写入: {batch_path}（{counts['requests']} 个请求）")
+    print(f"本地转换 {counts['local']} 页，空白页 {counts['blank']} 页，缓存命中 {counts['cached']} 页，"
+          f"与其他页面共用请求 {counts['reused']} 页；清单已写入: {manifest_path}")
+    return manifest_path
+
+
+def read_batch_results(results_path: str) -> dict:
+    """
+    读取批处理结果文件（JSONL）
+
+    每行包含custom_id和response（status_code与body），body与chat-completions接口的响应相同；
+    失败的请求可以只有error字段。无法解析的行被忽略。
+
+    Args:
+        results_path: 批处理结果文件路径（或错误文件路径）
+
+    Returns:
+        custom_id到模型输出文本或VisionAPIError异常（包括输出退化为连续重复的RepeatedOutputError）的映射
+    """
+    results = {}
+    with open(results_path, "r", encoding="utf-8") as results_file:
+        for line in results_file:
+            try:
+                record = json.loads(line)
+                custom_id = record["custom_id"]
+            except (ValueError, KeyError, TypeError):
+                continue
+            response = record.get("response") or {}
+            status_code = response.get("status_code")
+            body = response.get("body") or {}
+            try:
+                if status_code not in (None, 200) or record.get("error"):
+                    raise KeyError("error")
+                content = body["choices"][0]["message"]["content"]
+                # 退化为连续重复的输出视为失败，之后用--resume重新处理
+                repetition = find_repetition(content)
+                results[custom_id] = content if repetition is None else RepeatedOutputError(repetition)
+            except (KeyError, IndexError, TypeError):
+                error = record.get("error") or body.get("error") or body
+                message = f"批处理请求失败: {json.dumps(error, ensure_ascii=False)}"
+                if status_code is not None and status_code not in (408, 429) and status_code < 500:
+                    results.setdefault(custom_id, FatalAPIError(message, status_code))
+                else:
+                    results.setdefault(custom_id, RetryableAPIError(message, status_code))
+    return results
+
+
+def ingest_batch(manifest_path: str, results_paths) -> int:
+    """
+    读取批处理结果，按清单组装每个文档的Markdown文件
+
+    成功的页面写入页面缓存；有页面失败（或结果中缺少该页）时，失败页面在原位置留下注释、
+    写入失败页面报告，已成功的页面写入检查点日志，之后可以用--resume在线补齐失败页面。
+
+    Args:
+        manifest_path: export_batch写出的清单文件路径
+        results_paths: 批处理结果文件路径列表（可以包含错误文件）
+
+    Returns:
+        失败页面总数
+    """
+    with open(manifest_path, "r", encoding="utf-8") as manifest_file:
+        manifest = json.load(manifest_file)
+    if manifest.get("request_fingerprint") != _fingerprint_text():
+        print("警告：清单导出后模型请求参数已变化，结果不会写入页面缓存")
+    store_cache = manifest.get("request_fingerprint") == _fingerprint_text()
+
+    results = {}
+    for results_path in results_paths:
+        for custom_id, result in read_batch_results(results_path).items():
+            # 同一请求既有成功结果又有错误记录时以成功结果为准
+            if isinstance(results.get(custom_id), str):
+                continue
+            results[custom_id] = result
+
+    cache = get_page_cache()
+    total_failures = 0
+    for document in manifest["documents"]:
+        output_path = document["output"]
+        pages = document["pages"]
+        contents = {}
+        failures = []
+        for page_num in range(document["total"]):
+            entry = pages.get(str(page_num))
+            if entry is None:
+                failures.append((page_num, RetryableAPIError("导出时该页渲染失败")))
+                continue
+            while "same_as" in entry:
+                entry = pages.get(str(entry["same_as"]), {})
+            if "content" in entry:
+                contents[page_num] = (entry["content"], entry.get("route"))
+                continue
+            result = results.get(entry.get("custom_id"))
+            if isinstance(result, str):
+                contents[page_num] = (f"\n\n{result}\n\n", entry.get("route"))
+                if store_cache and cache.enabled:
+                    cache.put(entry["cache_key"], result)
+            else:
+                failures.append((page_num, result or RetryableAPIError("批处理结果中缺少该页")))
+
+        output_dir = os.path.dirname(output_path)
+        if output_dir:
+            os.makedirs(output_dir, exist_ok=True)
+        failed = {page_num: error for page_num, error in failures}
+        with open(output_path, "w", encoding="utf-8") as md_file:
+            for page_num in range(document["total"]):
+                if page_num in failed:
+                    md_file.write(failed_page_placeholder(page_num, failed[page_num]))
+                else:
+                    md_file.write(contents[page_num][0])
+        write_failure_report(output_path, [(page_num + 1, error, 1) for page_num, error in failures])
+
+        # 部分页面失败时把成功的页面写入检查点日志，--resume只需在线处理失败页面
+        source = document["source"]
+        if failures and os.path.exists(source) and file_fingerprint(source) == document["fingerprint"]:
+            journal = CheckpointJournal(output_path, source)
+            journal.open(False)
+            for page_num, (content, route) in contents.items():
+                journal.record(page_num, content, route)
+            journal.close()
+            print(f"{len(failures)} 页失败，可使用 --resume 重新处理这些页面: {source}")
+        total_failures += len(failures)
+        print(f"转换完成！Markdown文件已保存到: {output_path}")
+    return total_failures
+
+
+async def run_batch_locally_async(batch_path: str, results_path: str, api_key: str|None = None, max_workers: int|None = None):
+    """
+    批处理接口的本地替身：逐行发送批处理请求文件中的请求，按批处理结果格式写出结果文件
+
+    可以指向本地替身服务器（ZHIPUAI_BASE_URL）做端到端测试，也可以在无法使用批处理接口时
+    直接用在线接口完成一批请求。
+
+    Args:
+        batch_path: 批处理请求文件路径
+        results_path: 结果文件路径
+        api_key: OpenAI API密钥
+        max_workers: 最大并发请求数，如果为None则从环境变量获取
+    """
+    if max_workers is None:
+        max_workers = int(os.environ.get("MAX_WORKERS", 5))
+    with open(batch_path, "r", encoding="utf-8") as batch_file:
+        requests = [json.loads(line) for line in batch_file if line.strip()]
+
+    with open(results_path, "w", encoding="utf-8") as results_file:
+        async def handler(request):
+            body = await post_chat_completion_async(request["body"], api_key)
+            results_file.write(json.dumps({
+                "custom_id": request["custom_id"],
+                "response": {"status_code": 200, "body": body},
+            }, ensure_ascii=False) + "\n")
+
+        def on_failure(request, error, attempts):
+            results_file.write(json.dumps({
+                "custom_id": request["custom_id"],
+                "response": {"status_code": getattr(error, "status_code", None), "body": {"error": {"message": str(error)}}},
+            }, ensure_ascii=False) + "\n")
+
+        scheduler = RequestScheduler(max_workers)
+        await scheduler.map(
+            requests,
+            handler,
+            on_error=lambda request, e, delay: print(f"{str(e)}，{delay:.1f}秒后重试请求 {request['custom_id']}"),
+            on_failure=on_failure
+        )
+    print(f"已完成 {len(requests)} 个请求，结果已写入: {results_path}")
+
+
+def run_batch_locally(batch_path: str, results_path: str, api_key: str|None = None, max_workers: int|None = None):
+    """
+    run_batch_locally_async的同步封装
+    """
+    run_sync(run_batch_locally_async(batch_path, results_path, api_key, max_workers))
@@ -0,0 +1,62 @@
+"""
+对比同步接口每次调用新建事件循环和HTTP客户端与共享后台事件循环中的长连接客户端的单页开销
+
+用法:
+    python benchmarks/bench_client_pool.py [-n 页数] [-w 并发线程数]
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+import concurrent.futures
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image
+
+import vision_api
+from async_engine import run_sync
+from stub_server import StubVisionServer
+
+
+def run_pages(process, image_path: str, pages: int, workers: int) -> float:
+    """
+    在多个线程中并发处理指定数量的页面，返回总耗时（秒）
+    """
+    start = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(lambda _: process(image_path, "bench.key"), range(pages)))
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="同步接口HTTP客户端复用基准测试")
+    parser.add_argument("-n", "--pages", type=int, default=200, help="模拟的页面数量")
+    parser.add_argument("-w", "--workers", type=int, default=5, help="并发线程数")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp_dir, StubVisionServer() as server:
+        os.environ["ZHIPUAI_BASE_URL"] = server.base_url
+        image_path = os.path.join(temp_dir, "page.png")
+        Image.new("RGB", (595, 842), color="white").save(image_path)
+
+        scenarios = {}
+
+        # 改动前：每次调用新建事件循环和客户端，调用结束时关闭
+        server.reset_counters()
+        per_call = lambda image, api_key: run_sync(vision_api.process_pdf_page_async(image, api_key))
+        scenarios["每次调用新建客户端"] = (run_pages(per_call, image_path, args.pages, args.workers), server.connections)
+
+        # 改动后：所有线程共用后台事件循环中的客户端和keep-alive连接
+        server.reset_counters()
+        scenarios["共享长连接客户端"] = (run_pages(vision_api.process_pdf_page, image_path, args.pages, args.workers), server.connections)
+
+    print(f"页面数: {args.pages}，并发线程数: {args.workers}")
+    for name, (elapsed, connections) in scenarios.items():
+        per_page_ms = elapsed / args.pages * 1000
+        print(f"{name}: 总耗时 {elapsed:.3f}s，单页 {per_page_ms:.2f}ms，TCP连接数 {connections}")
+
+
+if __name__ == "__main__":
+    main()
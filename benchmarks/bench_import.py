@@ -0,0 +1,138 @@
+"""
+测量各入口模块的导入耗时（python -X importtime），检查是否超出预算、是否提前导入了较慢的可选依赖
+
+每个入口在新的解释器中导入多次取中位数。超出预算或提前导入了禁止的依赖时以非零状态退出，可以用于持续集成。
+另外在替身服务器上转换一张图片，检查单张图片的转换不会导入PyMuPDF和python-pptx。
+
+用法:
+    python benchmarks/bench_import.py [-r 次数] [--budget-scale 倍数]
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import statistics
+import subprocess
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, ROOT_DIR)
+
+# 较慢的可选依赖，只应在第一次处理对应类型的文件或使用对应功能时导入
+HEAVY_MODULES = ("fitz", "pymupdf", "pptx", "tqdm", "PIL.Image", "gradio")
+
+# 各入口模块的导入耗时预算（毫秒，不含解释器自身的启动时间）和导入时不应加载的依赖
+BUDGETS = {
+    "pdf_to_markdown": {"budget_ms": 250, "forbidden": HEAVY_MODULES},
+    "vision_api": {"budget_ms": 200, "forbidden": HEAVY_MODULES},
+    "batch_job": {"budget_ms": 250, "forbidden": HEAVY_MODULES},
+    "job_manager": {"budget_ms": 100, "forbidden": HEAVY_MODULES + ("httpx",)},
+}
+# 转换单张图片时不应加载的依赖
+IMAGE_FORBIDDEN = ("fitz", "pymupdf", "pptx")
+
+
+def parse_importtime(stderr: str) -> dict:
+    """
+    解析-X importtime的输出，返回 {模块名: 累计耗时微秒}
+    """
+    modules = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        modules[name.strip()] = int(cumulative)
+    return modules
+
+
+def measure_import(module: str) -> tuple[float, list]:
+    """
+    在新的解释器中导入模块，返回 (累计导入耗时毫秒, 已加载的较慢依赖)
+    """
+    code = f"import sys, {module}; print(','.join(name for name in {HEAVY_MODULES + ('httpx',)!r} if name in sys.modules))"
+    completed = subprocess.run([sys.executable, "-X", "importtime", "-c", code], cwd=ROOT_DIR,
+                               capture_output=True, text=True, env=dict(os.environ, PYTHONWARNINGS="ignore"))
+    if completed.returncode != 0:
+        raise RuntimeError(f"导入 {module} 失败:\n{completed.stderr[-2000:]}")
+    modules = parse_importtime(completed.stderr)
+    loaded = [name for name in completed.stdout.strip().split(",") if name]
+    return modules[module] / 1000, loaded
+
+
+def check_image_conversion() -> list:
+    """
+    用替身服务器转换一张图片，返回转换过程中加载的不应加载的依赖
+    """
+    from stub_server import StubVisionServer
+
+    with tempfile.TemporaryDirectory() as temp_dir, StubVisionServer() as server:
+        image_path = os.path.join(temp_dir, "page.png")
+        # 手写一个最小的PNG文件头，避免本进程为生成图片而导入PIL
+        with open(image_path, "wb") as image_file:
+            image_file.write(bytes.fromhex(
+                "89504e470d0a1a0a0000000d4948445200000001000000010802000000907753de"
+                "0000000c4944415408d763f8ffff3f0005fe02fea7d66a880000000049454e44ae426082"))
+        code = (
+            "import sys, pdf_to_markdown\n"
+            f"pdf_to_markdown.process_file({image_path!r}, {os.path.join(temp_dir, 'page.md')!r})\n"
+            f"print('LOADED:' + ','.join(name for name in {IMAGE_FORBIDDEN!r} if name in sys.modules))"
+        )
+        env = dict(os.environ, ZHIPUAI_BASE_URL=server.base_url, OPENAI_API_KEY="bench.key",
+                   PAGE_CACHE_DIR=os.path.join(temp_dir, "cache"), PYTHONWARNINGS="ignore")
+        completed = subprocess.run([sys.executable, "-c", code], cwd=ROOT_DIR, capture_output=True, text=True, env=env)
+        if completed.returncode != 0:
+            raise RuntimeError(f"转换图片失败:\n{completed.stderr[-2000:]}")
+        line = [line for line in completed.stdout.splitlines() if line.startswith("LOADED:")][-1]
+        return [name for name in line[len("LOADED:"):].split(",") if name]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="入口模块导入耗时基准测试")
+    parser.add_argument("-r", "--rounds", type=int, default=5, help="每个模块的导入次数，取中位数")
+    parser.add_argument("--budget-scale", type=float, default=1.0, help="预算倍数，用于较慢的机器")
+    parser.add_argument("--output", help="把结果保存为JSON文件")
+    args = parser.parse_args()
+
+    results = {}
+    failures = []
+    print(f"{'模块':<18}{'中位数(ms)':>12}{'最小(ms)':>10}{'预算(ms)':>10}  提前导入的依赖")
+    for module, budget in BUDGETS.items():
+        samples = []
+        loaded = []
+        for _ in range(args.rounds):
+            milliseconds, loaded = measure_import(module)
+            samples.append(milliseconds)
+        median = statistics.median(samples)
+        budget_ms = budget["budget_ms"] * args.budget_scale
+        forbidden = [name for name in loaded if name in budget["forbidden"]]
+        results[module] = {"median_ms": round(median, 2), "min_ms": round(min(samples), 2),
+                           "budget_ms": budget_ms, "loaded": loaded}
+        print(f"{module:<18}{median:>12.1f}{min(samples):>10.1f}{budget_ms:>10.0f}  {', '.join(loaded) or '无'}")
+        if median > budget_ms:
+            failures.append(f"{module} 导入耗时 {median:.1f}ms 超出预算 {budget_ms:.0f}ms")
+        if forbidden:
+            failures.append(f"{module} 导入时加载了 {', '.join(forbidden)}")
+
+    loaded = check_image_conversion()
+    results["image_conversion"] = {"loaded": loaded}
+    print(f"\n转换单张图片时加载的较慢依赖: {', '.join(loaded) or '无'}")
+    if loaded:
+        failures.append(f"转换单张图片时加载了 {', '.join(loaded)}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output_file:
+            json.dump({"timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"), "python": sys.version.split()[0],
+                       "results": results}, output_file, ensure_ascii=False, indent=2)
+
+    if failures:
+        print("\n导入耗时回归:")
+        for failure in failures:
+            print(f"  - {failure}")
+        sys.exit(1)
+    print("\n全部入口都在预算之内")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,254 @@
+"""
+端到端流水线基准测试：用本地替身服务器和合成文档测量各入口函数的吞吐、页面延迟、峰值内存和CPU时间
+
+每个场景在独立的子进程中运行，峰值RSS和CPU时间互不影响。结果保存为JSON，可与之前的结果对比。
+
+用法:
+    python benchmarks/bench_pipeline.py [--pages 页数] [--latency 延迟分布] [--error-rate 错误率]
+                                        [--output 结果.json] [--compare 基线.json]
+"""
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import tempfile
+import subprocess
+import contextlib
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+try:
+    import resource
+except ImportError:
+    # Windows上没有resource模块，不统计峰值内存和CPU时间
+    resource = None
+
+# 场景名称与被测函数
+SCENARIOS = {
+    "pdf": "convert_pdf_to_markdown",
+    "ppt": "convert_ppt_to_markdown",
+    "images": "process_images",
+    "files": "process_files",
+}
+# 对比时展示的指标：名称、说明、数值越大越好
+COMPARED_METRICS = [
+    ("pages_per_second", "页/秒", True),
+    ("page_p50", "页面p50(秒)", False),
+    ("page_p99", "页面p99(秒)", False),
+    ("peak_rss_mb", "峰值RSS(MB)", False),
+    ("cpu_seconds", "CPU时间(秒)", False),
+]
+
+
+def peak_rss_mb(who) -> float:
+    """
+    读取峰值RSS（Linux上ru_maxrss的单位为KB，macOS上为字节）
+    """
+    maxrss = resource.getrusage(who).ru_maxrss
+    divisor = 1024 * 1024 if sys.platform == "darwin" else 1024
+    return round(maxrss / divisor, 2)
+
+
+def cpu_seconds() -> float:
+    """
+    本进程及已结束的子进程（渲染进程池、LibreOffice）的用户态和内核态CPU时间之和
+    """
+    total = 0.0
+    for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN):
+        usage = resource.getrusage(who)
+        total += usage.ru_utime + usage.ru_stime
+    return total
+
+
+def run_scenario(scenario: str, corpus: dict, output_dir: str, max_workers: int) -> dict:
+    """
+    在当前进程中运行一个场景并返回测量结果（由子进程调用）
+
+    Args:
+        scenario: 场景名称，见SCENARIOS
+        corpus: corpus.build_corpus返回的文档路径
+        output_dir: Markdown输出目录
+        max_workers: 最大并发请求数
+
+    Returns:
+        测量结果字典
+    """
+    import pdf_to_markdown
+    import vision_api
+    from metrics import get_run_metrics
+
+    cpu_before = cpu_seconds() if resource else None
+    start = time.perf_counter()
+    # 被测函数的进度输出转到标准错误，标准输出只输出结果JSON
+    with contextlib.redirect_stdout(sys.stderr):
+        if scenario == "pdf":
+            pdf_to_markdown.convert_pdf_to_markdown(corpus["pdf"], os.path.join(output_dir, "document.md"), max_workers=max_workers)
+        elif scenario == "ppt":
+            pdf_to_markdown.convert_ppt_to_markdown(corpus["pptx"], os.path.join(output_dir, "slides.md"), max_workers=max_workers)
+        elif scenario == "images":
+            vision_api.process_images(corpus["images"], max_workers=max_workers)
+        elif scenario == "files":
+            pdf_to_markdown.process_files([corpus["pdf"], corpus["pptx"], *corpus["images"]], output_dir, max_workers=max_workers)
+        else:
+            raise ValueError(f"未知场景: {scenario}")
+    elapsed = time.perf_counter() - start
+
+    report = get_run_metrics().report()
+    page_stats = report["stages"].get("page", {})
+    return {
+        "function": SCENARIOS[scenario],
+        "seconds": round(elapsed, 4),
+        "pages": report["pages"]["completed"],
+        "failed_pages": report["pages"]["failed"],
+        "pages_per_second": round(report["pages"]["completed"] / elapsed, 4) if elapsed > 0 else 0.0,
+        "page_p50": page_stats.get("p50"),
+        "page_p99": page_stats.get("p99"),
+        "requests": report["requests"],
+        "retries": report["retries"],
+        "peak_rss_mb": peak_rss_mb(resource.RUSAGE_SELF) if resource else None,
+        "children_peak_rss_mb": peak_rss_mb(resource.RUSAGE_CHILDREN) if resource else None,
+        "cpu_seconds": round(cpu_seconds() - cpu_before, 4) if resource else None,
+        "stages": {stage: stats["p50"] for stage, stats in report["stages"].items()},
+    }
+
+
+def spawn_scenario(scenario: str, corpus: dict, base_url: str, args, verbose: bool) -> dict:
+    """
+    在新的子进程中运行场景，使用独立的空页面缓存
+    """
+    with tempfile.TemporaryDirectory() as work_dir:
+        env = dict(os.environ,
+                   ZHIPUAI_BASE_URL=base_url,
+                   OPENAI_API_KEY="bench.key",
+                   PAGE_CACHE_DIR=os.path.join(work_dir, "cache"),
+                   RETRY_BASE_DELAY=str(args.retry_delay),
+                   MAX_WORKERS=str(args.workers))
+        output_dir = os.path.join(work_dir, "output")
+        os.makedirs(output_dir)
+        command = [sys.executable, os.path.abspath(__file__), "--run-scenario", scenario,
+                   "--corpus-json", json.dumps(corpus), "--output-dir", output_dir, "--workers", str(args.workers)]
+        completed = subprocess.run(command, env=env, stdout=subprocess.PIPE,
+                                   stderr=None if verbose else subprocess.DEVNULL, text=True)
+        if completed.returncode != 0:
+            raise RuntimeError(f"场景 {scenario} 运行失败（退出码 {completed.returncode}），使用 --verbose 查看输出")
+        return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def git_commit() -> str|None:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BENCH_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_results(results: dict):
+    print(f"{'场景':<8}{'函数':<26}{'页数':>6}{'页/秒':>10}{'p50(秒)':>10}{'p99(秒)':>10}{'峰值RSS(MB)':>13}{'CPU(秒)':>10}")
+    for scenario, result in results.items():
+        print(f"{scenario:<8}{result['function']:<26}{result['pages']:>6}{result['pages_per_second']:>10.2f}"
+              f"{result['page_p50'] or 0:>10.3f}{result['page_p99'] or 0:>10.3f}"
+              f"{result['peak_rss_mb'] or 0:>13.1f}{result['cpu_seconds'] or 0:>10.2f}")
+
+
+def print_comparison(baseline: dict, current: dict):
+    """
+    按场景打印当前结果相对基线的变化
+    """
+    print(f"\n与基线对比（基线提交: {baseline.get('git_commit')}，基线配置: {baseline.get('config')}）")
+    for scenario, result in current["results"].items():
+        base = baseline.get("results", {}).get(scenario)
+        if base is None:
+            print(f"{scenario}: 基线中没有该场景")
+            continue
+        parts = []
+        for key, label, higher_is_better in COMPARED_METRICS:
+            old, new = base.get(key), result.get(key)
+            if not old or new is None:
+                continue
+            change = (new - old) / old * 100
+            better = change > 0 if higher_is_better else change < 0
+            parts.append(f"{label} {old:g} → {new:g} ({change:+.1f}%{'，改善' if better and abs(change) >= 1 else ''})")
+        print(f"{scenario}: " + "；".join(parts))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="端到端流水线基准测试")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="逗号分隔的场景: " + ", ".join(SCENARIOS))
+    parser.add_argument("--pages", type=int, default=20, help="合成PDF的页数，PPTX幻灯片数和图片数为其一半")
+    parser.add_argument("--corpus", help="合成文档目录（已存在则直接使用，默认生成到临时目录）")
+    parser.add_argument("-w", "--workers", type=int, default=5, help="最大并发请求数")
+    parser.add_argument("--latency", default="lognormal:0.5,0.4", help="替身服务器的延迟分布，如 0.5、uniform:0.2,1、lognormal:0.5,0.4、exp:0.5")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="替身服务器返回503的请求比例")
+    parser.add_argument("--response-chars", type=int, default=1500, help="每页输出的字符数")
+    parser.add_argument("--chunks-per-second", type=float, default=0.0, help="流式输出每秒发送的片段数，0表示不限速")
+    parser.add_argument("--retry-delay", type=float, default=0.1, help="重试的基础退避秒数")
+    parser.add_argument("--seed", type=int, default=0, help="随机数种子")
+    parser.add_argument("--output", help="把结果保存为JSON文件")
+    parser.add_argument("--compare", help="与之前保存的JSON结果对比")
+    parser.add_argument("--verbose", action="store_true", help="显示被测函数的输出")
+    # 子进程模式（内部使用）
+    parser.add_argument("--run-scenario", help=argparse.SUPPRESS)
+    parser.add_argument("--corpus-json", help=argparse.SUPPRESS)
+    parser.add_argument("--output-dir", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_scenario:
+        result = run_scenario(args.run_scenario, json.loads(args.corpus_json), args.output_dir, args.workers)
+        print(json.dumps(result, ensure_ascii=False))
+        return
+
+    from corpus import build_corpus
+    from stub_server import StubVisionServer
+
+    scenarios = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = [name for name in scenarios if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"未知场景: {', '.join(unknown)}")
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        corpus_dir = args.corpus or os.path.join(temp_dir, "corpus")
+        print(f"生成合成文档: {args.pages} 页PDF，{max(1, args.pages // 2)} 张幻灯片，{max(1, args.pages // 2)} 张图片")
+        corpus = build_corpus(corpus_dir, args.pages, args.seed)
+
+        config = {
+            "pages": args.pages,
+            "workers": args.workers,
+            "latency": args.latency,
+            "error_rate": args.error_rate,
+            "response_chars": args.response_chars,
+            "chunks_per_second": args.chunks_per_second,
+            "seed": args.seed,
+        }
+        results = {}
+        with StubVisionServer(latency=args.latency, error_rate=args.error_rate, response_chars=args.response_chars,
+                              chunks_per_second=args.chunks_per_second, seed=args.seed) as server:
+            for scenario in scenarios:
+                print(f"运行场景 {scenario}（{SCENARIOS[scenario]}）...")
+                results[scenario] = spawn_scenario(scenario, corpus, server.base_url, args, args.verbose)
+
+    current = {
+        "git_commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "config": config,
+        "results": results,
+    }
+    print()
+    print_results(results)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output_file:
+            json.dump(current, output_file, ensure_ascii=False, indent=2)
+        print(f"\n结果已保存到: {args.output}")
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as baseline_file:
+            print_comparison(json.load(baseline_file), current)
+
+
+if __name__ == "__main__":
+    main()
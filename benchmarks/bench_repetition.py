@@ -0,0 +1,85 @@
+"""
+对比原回溯正则 (.{1,20})\\1{4,} 与线性时间重复检测在病态输入上的耗时
+
+用法:
+    python benchmarks/bench_repetition.py [-n 字符数] [-r 每个输入的测量次数]
+"""
+import os
+import re
+import sys
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from repetition import find_repetition
+from vision_api import has_repeated_substring
+
+LEGACY_PATTERN = re.compile(r'(.{1,20})\1{4,}')
+
+
+def pathological_inputs(size: int) -> dict:
+    """
+    构造约size个字符的测试输入：乱码、差一次就构成重复的片段、长单元和整段重复等
+    """
+    rng = random.Random(0)
+    cjk = lambda count: "".join(chr(0x4e00 + rng.randrange(3000)) for _ in range(count))
+
+    def fill(piece):
+        return (piece * (size // len(piece) + 1))[:size]
+
+    inputs = {
+        # 模型输出4096个token的乱码，正则必须扫描全文才能确认没有重复
+        "随机乱码（无重复）": cjk(size),
+        # 每个位置都有重复4次的短单元，正则每个起点都要回溯多个长度
+        "短单元各重复4次": "".join("ab" * 4 + chr(0x4e00 + index % 3000) for index in range(size // 9)),
+        "19字符单元各重复4次": "".join("abcdefghijklmnopqrs" * 4 + chr(0x4e00 + index % 3000) for index in range(size // 77)),
+        # 周期为21的重复，超出正则的单元长度，正则无法发现
+        "21字符单元（正则漏检）": fill("这是一句被模型反复输出的长句子，没有换行。"),
+        # 每一行不同但整段反复出现，正则无法发现
+        "整段重复（正则漏检）": fill("\n".join(cjk(30) for _ in range(3)) + "\n"),
+    }
+    # 正常的长页面：多节文字、公式和表格，各节内容不同
+    sections = []
+    while sum(map(len, sections)) < size:
+        index = len(sections) + 1
+        sections.append(f"## 第{index}节\n\n{cjk(60)}$x_{index}+y_{index}=1$。\n\n| 列1 | 列2 |\n|---|---|\n| {cjk(4)} | {index} |\n\n")
+    inputs["正常页面"] = "".join(sections)[:size]
+    # 结尾才出现的重复：前面全是乱码
+    inputs["结尾处重复"] = cjk(size - 200) + "哈" * 200
+    return inputs
+
+
+def measure(function, text: str, rounds: int) -> tuple[float, object]:
+    """
+    多次运行取最短耗时（毫秒）
+    """
+    best = float("inf")
+    result = None
+    for _ in range(rounds):
+        start = time.perf_counter()
+        result = function(text)
+        best = min(best, time.perf_counter() - start)
+    return best * 1000, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="重复内容检测基准测试")
+    parser.add_argument("-n", "--chars", type=int, default=12000, help="每个输入的字符数（约等于4096个token的输出）")
+    parser.add_argument("-r", "--rounds", type=int, default=5, help="每个输入的测量次数")
+    args = parser.parse_args()
+
+    print(f"输入长度: {args.chars} 字符，取 {args.rounds} 次中的最短耗时")
+    print(f"{'输入':<22}{'原正则':>10}{'短单元检测':>12}{'完整检测':>12}  检测结果")
+    for name, text in pathological_inputs(args.chars).items():
+        legacy_ms, legacy = measure(lambda value: LEGACY_PATTERN.search(value) is not None, text, args.rounds)
+        short_ms, short = measure(has_repeated_substring, text, args.rounds)
+        full_ms, repetition = measure(find_repetition, text, args.rounds)
+        # 短单元检测必须与原正则给出相同的结论
+        assert legacy == short, name
+        print(f"{name:<22}{legacy_ms:>9.2f}ms{short_ms:>10.2f}ms{full_ms:>10.2f}ms  {repetition or '无重复'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+"""
+生成基准测试用的合成文档：PDF（文本层页面和扫描页）、PPTX（纯文本和含图片的幻灯片）和图片
+
+每页内容由带种子的随机数生成且互不相同，不会被空白页检测或近似重复检测跳过。
+
+用法:
+    python benchmarks/corpus.py 输出目录 [--pages 页数] [--seed 种子]
+"""
+import io
+import os
+import random
+import argparse
+
+import fitz  # PyMuPDF
+from PIL import Image, ImageDraw
+from pptx import Presentation
+from pptx.util import Inches, Pt
+
+# 页面尺寸（单位为point）
+PAGE_SIZES = {
+    "a4": (595, 842),
+    "letter": (612, 792),
+    "slide": (960, 540),
+}
+# 图片尺寸（像素）
+IMAGE_SIZES = {
+    "small": (640, 480),
+    "medium": (1240, 1754),
+    "large": (2480, 3508),
+}
+
+
+def random_sentence(rng: random.Random, words: int = 12) -> str:
+    """
+    生成一句随机的英文句子（PDF内置字体和PIL默认字体都能显示）
+    """
+    vocabulary = ["theorem", "proof", "lemma", "matrix", "vector", "space", "function", "limit", "integral",
+                  "series", "group", "ring", "field", "graph", "measure", "kernel", "norm", "basis", "map", "set"]
+    text = " ".join(rng.choice(vocabulary) for _ in range(words))
+    return text.capitalize() + f" ({rng.randrange(10000)})."
+
+
+def draw_page_image(rng: random.Random, size: tuple[int, int], lines: int = 30) -> Image.Image:
+    """
+    绘制一张模拟扫描页的图像：若干行随机文字和一个随机矩形图示
+    """
+    image = Image.new("RGB", size, "white")
+    draw = ImageDraw.Draw(image)
+    width, height = size
+    line_height = max(12, height // (lines + 4))
+    for index in range(lines):
+        draw.text((width // 12, line_height * (index + 2)), random_sentence(rng), fill="black")
+    left = rng.randrange(width // 2)
+    top = rng.randrange(height // 2)
+    draw.rectangle((left, top, left + width // 4, top + height // 8), outline="black", width=3)
+    return image
+
+
+def image_bytes(image: Image.Image, image_format: str = "PNG") -> bytes:
+    buffer = io.BytesIO()
+    image.save(buffer, format=image_format)
+    return buffer.getvalue()
+
+
+def make_pdf(path: str, pages: int, seed: int = 0, size: str = "a4", scanned_ratio: float = 0.5):
+    """
+    生成合成PDF：一部分页面有文本层，其余页面只有一张扫描图像
+
+    Args:
+        path: 输出路径
+        pages: 页数
+        seed: 随机数种子
+        size: 页面尺寸，见PAGE_SIZES
+        scanned_ratio: 扫描页的比例
+    """
+    rng = random.Random(seed)
+    width, height = PAGE_SIZES[size]
+    document = fitz.open()
+    for _ in range(pages):
+        page = document.new_page(width=width, height=height)
+        if rng.random() < scanned_ratio:
+            scan = draw_page_image(rng, (width * 2, height * 2))
+            page.insert_image(page.rect, stream=image_bytes(scan, "JPEG"))
+        else:
+            text = "\n\n".join(random_sentence(rng, rng.randint(8, 30)) for _ in range(12))
+            page.insert_textbox(fitz.Rect(50, 50, width - 50, height - 50), text, fontsize=11, fontname="helv")
+    document.save(path)
+    document.close()
+
+
+def make_pptx(path: str, slides: int, seed: int = 0, picture_ratio: float = 0.5):
+    """
+    生成合成PPTX：一部分幻灯片只有标题和正文，其余幻灯片含有一张图片
+
+    Args:
+        path: 输出路径
+        slides: 幻灯片数
+        seed: 随机数种子
+        picture_ratio: 含图片幻灯片的比例
+    """
+    rng = random.Random(seed)
+    presentation = Presentation()
+    layout = presentation.slide_layouts[1]
+    for _ in range(slides):
+        slide = presentation.slides.add_slide(layout)
+        slide.shapes.title.text = random_sentence(rng, 4)
+        body = slide.placeholders[1].text_frame
+        body.text = random_sentence(rng)
+        for _ in range(rng.randint(2, 5)):
+            paragraph = body.add_paragraph()
+            paragraph.text = random_sentence(rng)
+            paragraph.font.size = Pt(16)
+        if rng.random() < picture_ratio:
+            picture = draw_page_image(rng, (800, 450), lines=8)
+            slide.shapes.add_picture(io.BytesIO(image_bytes(picture)), Inches(5), Inches(4), width=Inches(4))
+    presentation.save(path)
+
+
+def make_images(directory: str, count: int, seed: int = 0, size: str = "medium") -> list:
+    """
+    生成合成图片（PNG和JPEG交替）
+
+    Args:
+        directory: 输出目录
+        count: 图片数
+        seed: 随机数种子
+        size: 图片尺寸，见IMAGE_SIZES
+
+    Returns:
+        图片路径列表
+    """
+    rng = random.Random(seed)
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for index in range(count):
+        extension = "png" if index % 2 == 0 else "jpg"
+        path = os.path.join(directory, f"image_{index + 1:03d}.{extension}")
+        draw_page_image(rng, IMAGE_SIZES[size]).save(path)
+        paths.append(path)
+    return paths
+
+
+def build_corpus(directory: str, pages: int = 20, seed: int = 0) -> dict:
+    """
+    在目录中生成一套基准测试文档
+
+    Args:
+        directory: 输出目录
+        pages: PDF页数；PPTX的幻灯片数和图片数为其一半
+        seed: 随机数种子
+
+    Returns:
+        包含pdf、pptx、images（路径列表）的字典
+    """
+    os.makedirs(directory, exist_ok=True)
+    corpus = {
+        "pdf": os.path.join(directory, "document.pdf"),
+        "pptx": os.path.join(directory, "slides.pptx"),
+    }
+    make_pdf(corpus["pdf"], pages, seed)
+    make_pptx(corpus["pptx"], max(1, pages // 2), seed + 1)
+    corpus["images"] = make_images(os.path.join(directory, "images"), max(1, pages // 2), seed + 2)
+    return corpus
+
+
+def main():
+    parser = argparse.ArgumentParser(description="生成基准测试用的合成文档")
+    parser.add_argument("directory", help="输出目录")
+    parser.add_argument("--pages", type=int, default=20, help="PDF页数，PPTX幻灯片数和图片数为其一半")
+    parser.add_argument("--seed", type=int, default=0, help="随机数种子")
+    args = parser.parse_args()
+
+    corpus = build_corpus(args.directory, args.pages, args.seed)
+    print(f"PDF: {corpus['pdf']}")
+    print(f"PPTX: {corpus['pptx']}")
+    print(f"图片: {len(corpus['images'])} 张，位于 {os.path.dirname(corpus['images'][0])}")
+
+
+if __name__ == "__main__":
+    main()
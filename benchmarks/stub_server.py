@@ -0,0 +1,217 @@
+import json
+import math
+import time
+import random
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+def parse_latency(spec: str|float|None):
+    """
+    解析延迟分布描述，返回每次调用产生一个延迟秒数的函数
+
+    支持的格式:
+        0.5 或 fixed:0.5            固定延迟
+        uniform:0.2,1.0             均匀分布
+        lognormal:0.8,0.5           对数正态分布（中位数秒数, sigma），模拟长尾延迟
+        exp:0.5                     指数分布（均值秒数）
+
+    Args:
+        spec: 延迟分布描述，None或0表示没有延迟
+
+    Returns:
+        接受random.Random实例、返回延迟秒数的函数
+    """
+    if spec is None:
+        return lambda rng: 0.0
+    if isinstance(spec, (int, float)):
+        value = float(spec)
+        return lambda rng: value
+    kind, _, params = spec.partition(":")
+    if not params:
+        kind, params = "fixed", kind
+    values = [float(value) for value in params.split(",")]
+    if kind == "fixed":
+        return lambda rng: values[0]
+    if kind == "uniform":
+        return lambda rng: rng.uniform(values[0], values[1])
+    if kind == "lognormal":
+        mu = math.log(values[0])
+        return lambda rng: rng.lognormvariate(mu, values[1])
+    if kind == "exp":
+        return lambda rng: rng.expovariate(1 / values[0])
+    raise ValueError(f"不支持的延迟分布: {spec}")
+
+
+def synthetic_markdown(rng: random.Random, chars: int) -> str:
+    """
+    生成约chars个字符、各行内容都不相同的Markdown，避免触发重复输出检测
+    """
+    lines = [f"# 第{rng.randrange(1000)}节"]
+    size = len(lines[0])
+    while size < chars:
+        line = "".join(chr(0x4e00 + rng.randrange(3000)) for _ in range(rng.randint(20, 60)))
+        line += f"，$x_{{{rng.randrange(100)}}}$。"
+        lines.append(line)
+        size += len(line) + 2
+    return "\n\n".join(lines)
+
+
+class StubVisionServer:
+    """
+    本地chat-completions接口替身，用于在不消耗API额度的情况下测量客户端开销
+
+    服务器使用HTTP/1.1 keep-alive，并统计建立的TCP连接数、收到的请求数和返回的错误数。
+    可以模拟服务端延迟分布、一定比例的503错误、指定长度的输出，以及流式输出的生成速度。
+    """
+
+    def __init__(self,
+                 host: str = "127.0.0.1",
+                 port: int = 0,
+                 content: str = "# 测试页面\n\n页面内容",
+                 latency: str|float|None = None,
+                 error_rate: float = 0.0,
+                 fail_first: int = 0,
+                 response_chars: int|None = None,
+                 chunks_per_second: float = 0.0,
+                 seed: int|None = None):
+        """
+        Args:
+            host: 监听地址
+            port: 监听端口，0表示随机选择
+            content: 固定的输出内容（未指定response_chars时使用）
+            latency: 收到请求到开始响应的延迟分布，格式见parse_latency
+            error_rate: 返回503错误的请求比例（0~1）
+            fail_first: 前若干个请求固定返回503错误（用于测试重试）
+            response_chars: 每次随机生成约该长度的输出，None表示使用content
+            chunks_per_second: 流式输出每秒发送的片段数（每个片段约一个token），0表示不限速
+            seed: 随机数种子
+        """
+        self.content = content
+        self.latency = parse_latency(latency)
+        self.error_rate = error_rate
+        self.fail_first = fail_first
+        self.response_chars = response_chars
+        self.chunks_per_second = chunks_per_second
+        self.connections = 0
+        self.requests = 0
+        self.errors = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._make_handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/api/paas/v4"
+
+    def _plan(self) -> tuple[float, bool, str]:
+        """
+        为一次请求抽取延迟、是否返回错误和输出内容
+        """
+        with self._lock:
+            self.requests += 1
+            delay = max(0.0, self.latency(self._rng))
+            failed = self.requests <= self.fail_first or self._rng.random() < self.error_rate
+            if failed:
+                self.errors += 1
+            content = self.content
+            if self.response_chars is not None and not failed:
+                content = synthetic_markdown(self._rng, self.response_chars)
+        return delay, failed, content
+
+    def _make_handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def setup(self):
+                super().setup()
+                with stub._lock:
+                    stub.connections += 1
+
+            def log_message(self, format, *args):
+                pass
+
+            def send_json(self, status: int, payload: dict):
+                body = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def send_chunk(self, data: dict|str):
+                payload = data if isinstance(data, str) else json.dumps(data)
+                body = f"data: {payload}\n\n".encode("utf-8")
+                self.wfile.write(f"{len(body):x}\r\n".encode("ascii") + body + b"\r\n")
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                request = json.loads(self.rfile.read(length) or b"{}")
+                delay, failed, content = stub._plan()
+                time.sleep(delay)
+                if failed:
+                    self.send_json(503, {"error": {"code": "1305", "message": "stub overloaded"}})
+                    return
+
+                # 输出按每个片段约2个字符估计token数
+                chunks = [content[index:index + 2] for index in range(0, len(content), 2)]
+                usage = {"prompt_tokens": 1000, "completion_tokens": len(chunks), "total_tokens": 1000 + len(chunks)}
+                if not request.get("stream"):
+                    if stub.chunks_per_second:
+                        time.sleep(len(chunks) / stub.chunks_per_second)
+                    self.send_json(200, {
+                        "id": "stub",
+                        "created": 0,
+                        "model": "stub",
+                        "choices": [{
+                            "index": 0,
+                            "finish_reason": "stop",
+                            "message": {"role": "assistant", "content": content},
+                        }],
+                        "usage": usage,
+                    })
+                    return
+
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                try:
+                    for chunk in chunks:
+                        if stub.chunks_per_second:
+                            time.sleep(1 / stub.chunks_per_second)
+                        self.send_chunk({"id": "stub", "choices": [{"index": 0, "delta": {"role": "assistant", "content": chunk}}]})
+                    self.send_chunk({"id": "stub", "choices": [{"index": 0, "finish_reason": "stop", "delta": {"content": ""}}], "usage": usage})
+                    self.send_chunk("[DONE]")
+                    self.wfile.write(b"0\r\n\r\n")
+                except (BrokenPipeError, ConnectionResetError):
+                    # 客户端提前中止了流式输出
+                    pass
+
+        return Handler
+
+    def reset_counters(self):
+        with self._lock:
+            self.connections = 0
+            self.requests = 0
+            self.errors = 0
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
@@ -0,0 +1,141 @@
+import os
+import json
+import hashlib
+import threading
+
+from vision_api import request_fingerprint
+
+
+def file_fingerprint(path: str) -> str:
+    """
+    计算源文件与视觉模型请求参数的联合指纹，任一变化都会使旧的检查点失效
+
+    Args:
+        path: 源文件路径
+
+    Returns:
+        十六进制SHA-256指纹
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as source_file:
+        for chunk in iter(lambda: source_file.read(1024 * 1024), b""):
+            digest.update(chunk)
+    digest.update(json.dumps(request_fingerprint(), sort_keys=True, ensure_ascii=False).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def content_hash(content: str) -> str:
+    """
+    计算页面结果的哈希，用于在恢复时校验日志行是否完整
+    """
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+class CheckpointJournal:
+    """
+    单个文档的追加式检查点日志（JSONL，保存在输出文件旁边）
+
+    第一行记录源文件指纹，之后每完成一页追加一行：页码、结果哈希、路由说明和页面结果。
+    每行写入后立即刷新，进程崩溃最多丢失正在写入的那一行；
+    恢复时跳过哈希不匹配或无法解析的行，因此半行写入不会污染结果；继续追加前先截掉末尾的半行。
+    """
+
+    def __init__(self, output_path: str, source_path: str):
+        self.path = output_path + ".journal.jsonl"
+        self.source_path = source_path
+        self.fingerprint = file_fingerprint(source_path)
+        self._file = None
+        self._lock = threading.Lock()
+
+    def load(self) -> dict:
+        """
+        读取已完成的页面；日志不存在或源文件已变化时返回空字典
+
+        Returns:
+            从0开始的页码到 (页面结果, 路由说明) 的映射
+        """
+        if not os.path.exists(self.path):
+            return {}
+
+        pages = {}
+        with open(self.path, "r", encoding="utf-8") as journal_file:
+            for line_num, line in enumerate(journal_file):
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if line_num == 0:
+                    if entry.get("type") != "header" or entry.get("fingerprint") != self.fingerprint:
+                        return {}
+                    continue
+                if entry.get("type") != "page" or entry.get("sha256") != content_hash(entry.get("content", "")):
+                    continue
+                pages[entry["page"]] = (entry["content"], entry.get("route"))
+        return pages
+
+    def open(self, resume: bool) -> dict:
+        """
+        打开日志准备追加；不恢复或日志已失效时重新开始
+
+        Args:
+            resume: 是否在已有日志之后继续追加
+
+        Returns:
+            可以直接复用的已完成页面，格式同load()
+        """
+        pages = self.load() if resume else {}
+        if pages:
+            # 崩溃时最后一行可能只写了一半，先截掉，新记录才不会接在半行后面一起丢失
+            self._truncate_partial_line()
+            self._file = open(self.path, "a", encoding="utf-8")
+            return pages
+        self._file = open(self.path, "w", encoding="utf-8")
+        self._write({"type": "header", "source": os.path.abspath(self.source_path), "fingerprint": self.fingerprint})
+        return pages
+
+    def _truncate_partial_line(self):
+        """
+        把日志截断到最后一个换行符之后，去掉没有写完的最后一行
+        """
+        with open(self.path, "rb+") as journal_file:
+            end = journal_file.seek(0, os.SEEK_END)
+            position = end
+            while position > 0:
+                start = max(0, position - 4096)
+                journal_file.seek(start)
+                newline = journal_file.read(position - start).rfind(b"\n")
+                if newline >= 0:
+                    position = start + newline + 1
+                    break
+                position = start
+            if position < end:
+                journal_file.truncate(position)
+
+    def _write(self, entry: dict):
+        with self._lock:
+            self._file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            self._file.flush()
+
+    def record(self, page_num: int, content: str, route: str|None = None):
+        """
+        追加一页的处理结果
+
+        Args:
+            page_num: 从0开始的页码
+            content: 页面结果
+            route: 路由说明（可选）
+        """
+        self._write({"type": "page", "page": page_num, "sha256": content_hash(content), "route": route, "content": content})
+
+    def close(self, remove: bool = False):
+        """
+        关闭日志；全部页面成功时可以删除日志
+
+        Args:
+            remove: 是否删除日志文件
+        """
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if remove and os.path.exists(self.path):
+            os.remove(self.path)
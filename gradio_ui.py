@@ -0,0 +1,214 @@
+import os
+import itertools
+import gradio as gr
+from dotenv import load_dotenv
+from job_manager import get_job_manager, store_upload, submit_document, ConversionJob, DONE, PARTIAL, MARKDOWN_DIR
+
+# 加载环境变量
+load_dotenv()
+
+# 每个浏览器会话最近一次提交的编号，新的提交开始推送进度后，旧的进度推送随之结束；
+# 进度推送结束（任务全部结束或页面关闭）时移除该会话的记录
+_session_generations = {}
+_generation_counter = itertools.count(1)
+# 每个浏览器会话已经取消的任务，共享任务的等待数只能由同一会话减少一次；任务结束后移除
+_session_cancels = set()
+
+
+def submit_file(file) -> ConversionJob:
+    """
+    保存上传的文件并提交后台转换任务
+    
+    Args:
+        file: 上传的文件（路径或带name属性的对象）
+        
+    Returns:
+        ConversionJob
+    """
+    original_file_path = file if isinstance(file, str) else file.name
+    return submit_document(store_upload(original_file_path), os.path.basename(original_file_path))
+
+
+def process_files_ui(files, job_ids, request: gr.Request = None):
+    """
+    提交上传的文件（PDF、PPT或图片）为后台转换任务，并持续推送本会话所有任务的进度
+    
+    点击处理函数只负责提交和推送进度，页面在任务管理器的共享并发池中转换，
+    因此多个用户、多个文件可以同时转换，大文件不会阻塞其他任务。
+    
+    Args:
+        files: 上传的文件列表
+        job_ids: 本会话已提交的任务ID列表
+        request: Gradio请求，用于区分浏览器会话
+        
+    Yields:
+        (任务ID列表, 状态信息, 已完成的Markdown文件列表, Markdown源码, Markdown渲染, 可取消任务下拉框)
+    """
+    job_ids = list(job_ids or [])
+    messages = []
+    for file in files or []:
+        try:
+            job = submit_file(file)
+            if job.id not in job_ids:
+                job_ids.append(job.id)
+        except Exception as e:
+            file_name = os.path.basename(file if isinstance(file, str) else file.name)
+            messages.append(f"提交文件 '{file_name}' 时出错: {str(e)}")
+    
+    if not job_ids:
+        yield job_ids, "\n".join(messages) or "请上传文件（支持PDF、PPT和常见图片格式）", None, "", "", gr.Dropdown(choices=[], value=None)
+        return
+    
+    session = request.session_hash if request is not None else None
+    # 编号全局递增，会话记录被移除后重新提交也不会与仍在退出中的旧推送编号相同
+    generation = next(_generation_counter)
+    _session_generations[session] = generation
+    
+    try:
+        for jobs in get_job_manager().watch(job_ids):
+            if _session_generations.get(session) != generation:
+                return
+            status = "\n".join(messages + [job.describe() for job in jobs])
+            finished = [job.output_path for job in jobs if job.status in (DONE, PARTIAL) and os.path.exists(job.output_path)]
+            # 预览第一个完成的文件
+            preview = view_markdown(finished[0]) if finished else ""
+            cancellable = [(job.describe(), job.id) for job in jobs if not job.is_finished]
+            yield job_ids, status, finished or None, preview, preview, gr.Dropdown(choices=cancellable, value=None)
+    finally:
+        if _session_generations.get(session) == generation:
+            _session_generations.pop(session, None)
+
+
+def prune_session_cancels():
+    """
+    移除已结束或已被任务管理器移除的任务的取消记录（这些任务不能再被取消）
+    """
+    manager = get_job_manager()
+    for session, job_id in list(_session_cancels):
+        job = manager.get(job_id)
+        if job is None or job.is_finished:
+            _session_cancels.discard((session, job_id))
+
+
+def cancel_job_ui(job_id, request: gr.Request = None):
+    """
+    取消选中的转换任务
+    
+    Args:
+        job_id: 任务ID
+        request: Gradio请求，用于区分浏览器会话
+        
+    Returns:
+        操作结果信息
+    """
+    if not job_id:
+        return "请先选择要取消的任务"
+    session = request.session_hash if request is not None else None
+    prune_session_cancels()
+    if (session, job_id) in _session_cancels:
+        return "已经取消过该任务"
+    job = get_job_manager().get(job_id)
+    if get_job_manager().cancel(job_id):
+        _session_cancels.add((session, job_id))
+        if job.refs > 0:
+            return f"其他用户也提交了 '{job.name}'，该文档会继续转换"
+        return f"已取消任务 '{job.name}'，已完成的页面会保留在输出文件中"
+    return "任务不存在或已经结束"
+
+
+def view_markdown(markdown_path):
+    """
+    查看生成的Markdown文件内容
+    
+    Args:
+        markdown_path: Markdown文件路径
+        
+    Returns:
+        Markdown文件内容
+    """
+    if not markdown_path or not os.path.exists(markdown_path):
+        return "没有可用的Markdown文件"
+    
+    try:
+        with open(markdown_path, "r", encoding="utf-8") as f:
+            content = f.read()
+        return content
+    except Exception as e:
+        return f"读取Markdown文件时出错: {str(e)}"
+
+
+def create_app() -> gr.Blocks:
+    """
+    创建Gradio界面
+    
+    Returns:
+        gr.Blocks应用，调用launch()启动
+    """
+    with gr.Blocks(title="PDF转Markdown工具") as app:
+        gr.Markdown("<div style='text-align: center;'><h1>PDF转Markdown工具</h1></div>")
+        gr.Markdown("""<div style='text-align: center;'>作者: <a href="https://github.com/because66666">Because66666</a></div>""")
+        gr.Markdown("<div style='text-align: center;'>使用LLM视觉模型将PDF文件转换为Markdown格式</div>")
+    
+        jobs_state = gr.State([])
+    
+        with gr.Row():
+            with gr.Column():
+                file_input = gr.Files(label="上传文件", file_types=[".pdf", ".ppt", ".pptx", ".jpg", ".jpeg", ".png", ".bmp", ".gif", ".tiff"], type="filepath")
+                convert_btn = gr.Button("开始转换", variant="primary")
+                result = gr.Textbox(label="任务进度", lines=5)
+                download_files = gr.Files(label="下载转换结果")
+                with gr.Row():
+                    job_select = gr.Dropdown(label="进行中的任务", choices=[])
+                    cancel_btn = gr.Button("取消所选任务")
+                cancel_result = gr.Textbox(label="取消结果", lines=1)
+        
+            with gr.Column():
+                markdown_output = gr.Textbox(label="Markdown源码", lines=20)
+        
+            with gr.Column():
+                # 创建Markdown渲染组件
+                markdown_render = gr.Markdown(label="Markdown渲染预览", elem_id="markdown-render")
+            
+                # 添加自定义CSS样式，使Markdown渲染区域与文本框样式一致
+                gr.HTML("""
+                <style>
+                #markdown-render {
+                    border: 1px solid rgba(0, 0, 0, 0.1);
+                    border-radius: 4px;
+                    padding: 10px;
+                    background-color: white;
+                    height: 400px;
+                    overflow-y: auto;
+                    margin-top: 5px;
+                }
+                </style>
+                """)
+    
+        # 设置事件处理：转换进度以生成器流式推送，推送进度本身几乎不占资源，因此不限制并发
+        convert_btn.click(
+            process_files_ui,
+            inputs=[file_input, jobs_state],
+            outputs=[jobs_state, result, download_files, markdown_output, markdown_render, job_select],
+            concurrency_limit=None
+        )
+        cancel_btn.click(cancel_job_ui, inputs=[job_select], outputs=[cancel_result])
+    
+        gr.Markdown("""
+        ## 使用说明
+        1. 上传文件（支持PDF和常见图片格式：JPG、PNG、BMP、GIF、TIFF、PPT、PPTX等）
+        2. 可以一次上传多个文件进行批量处理，转换过程中也可以继续上传并提交新的文件
+        3. 点击"开始转换"按钮，任务在后台转换，"任务进度"中实时显示每个文件已完成的页数
+        4. 每个文件转换完成后即可在"下载转换结果"中下载，右侧会显示第一个完成的文件的Markdown内容
+        5. 在"进行中的任务"中选择任务并点击"取消所选任务"可以取消转换，已完成的页面会保留在输出文件中
+    
+        **文件存储位置**:
+        - 上传的文件按内容哈希保存在 `files/upload/<内容哈希>` 目录，相同内容只保存一份
+        - 生成的Markdown文件按文档保存在 `files/markdown/<文档指纹>` 目录，已经转换过的文档再次上传时直接返回已有结果
+    
+        **注意**: 
+        - 请确保已在.env文件中设置了OPENAI_API_KEY环境变量
+        - 图片文件将直接处理，PDF文件会按页处理并合并结果
+        - 所有任务共享MAX_WORKERS个并发请求，多个任务的页面轮流处理
+        """)
+    
+    return app
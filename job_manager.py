@@ -0,0 +1,403 @@
+import os
+import time
+import uuid
+import shutil
+import asyncio
+import hashlib
+import functools
+import threading
+from typing import Callable, Optional
+
+from dotenv import load_dotenv
+
+from async_engine import RequestScheduler, run_jobs
+
+# 加载环境变量
+load_dotenv()
+
+# 上传文件和转换结果的默认存放目录
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+UPLOAD_DIR = os.path.join(BASE_DIR, "files", "upload")
+MARKDOWN_DIR = os.path.join(BASE_DIR, "files", "markdown")
+
+# 任务状态
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+PARTIAL = "partial"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+STATUS_LABELS = {
+    QUEUED: "排队中",
+    RUNNING: "转换中",
+    DONE: "已完成",
+    PARTIAL: "部分页面失败",
+    FAILED: "失败",
+    CANCELLED: "已取消",
+}
+FINISHED_STATUSES = (DONE, PARTIAL, FAILED, CANCELLED)
+
+# 最多保留的已结束任务数，超出后最早结束的任务被移除（之后查询返回不存在）
+MAX_FINISHED_JOBS = int(os.environ.get("MAX_FINISHED_JOBS", 1000))
+
+
+class JobCancelledError(Exception):
+    """
+    任务被取消时，未完成的页面以该异常记为失败
+    """
+
+
+def is_complete_output(output_path: str) -> bool:
+    """
+    判断输出文件是否是一次完整成功的转换结果（没有残留的检查点日志和失败页面报告）
+    """
+    return (os.path.exists(output_path)
+            and not os.path.exists(output_path + ".journal.jsonl")
+            and not os.path.exists(output_path + ".failed.json"))
+
+
+class ConversionJob:
+    """
+    一个后台转换任务：上传的文件、输出路径、状态和逐页进度
+
+    同一文档的多次提交共享一个任务，refs记录仍在等待该任务的提交数。
+    """
+
+    def __init__(self, file_path: str, output_path: str, name: str|None = None, key: str|None = None):
+        """
+        Args:
+            file_path: 待转换的文件路径
+            output_path: 输出的Markdown文件路径
+            name: 显示名称，默认为文件名
+            key: 文档键（内容与请求参数的指纹），相同键的提交合并为一个任务
+        """
+        self.id = uuid.uuid4().hex[:8]
+        self.file_path = file_path
+        self.output_path = output_path
+        self.name = name or os.path.basename(file_path)
+        self.key = key
+        self.refs = 1
+        self.reused = False
+        self.status = QUEUED
+        self.error = None
+        self.submitted = time.time()
+        self.finished = None
+        self.document = None
+        self.completed_tasks = set()
+        self.future = None
+        self._total_pages = 0
+        self._done_pages = 0
+
+    @property
+    def total_pages(self) -> int:
+        document = self.document
+        return document.total if document is not None else self._total_pages
+
+    @property
+    def done_pages(self) -> int:
+        document = self.document
+        if document is None:
+            return self._done_pages
+        return len(document.results) + len(document.failures)
+
+    def release(self):
+        """
+        任务结束后保留页数并释放文档（页面任务和结果），长期运行的服务不会积累已结束文档的内存
+        """
+        self._total_pages = self.total_pages
+        self._done_pages = self.done_pages
+        self.document = None
+        self.completed_tasks = set()
+
+    @property
+    def is_finished(self) -> bool:
+        return self.status in FINISHED_STATUSES
+
+    def describe(self) -> str:
+        """
+        生成一行任务状态说明，例如 "[1a2b3c4d] report.pdf: 转换中 12/300 页"
+        """
+        text = f"[{self.id}] {self.name}: {STATUS_LABELS[self.status]}"
+        if self.total_pages:
+            text += f" {self.done_pages}/{self.total_pages} 页"
+        if self.reused:
+            text += "（复用已有结果）"
+        if self.error:
+            text += f"（{self.error}）"
+        return text
+
+
+class JobManager:
+    """
+    后台文档转换任务管理器
+
+    所有任务在同一个后台事件循环线程中运行，页面共享一个并发上限为max_workers的调度器：
+    每个任务同一时刻只有一个页面在等待并发名额，因此多个任务的页面轮流获得名额，
+    大文档不会阻塞后提交的小文档。提交、查询和取消都可以在任意线程中调用。
+
+    提交时给出文档键，同一文档正在转换时后来的提交合并到已有任务，
+    已经成功转换过（包括输出文件已在磁盘上的）则直接返回已完成的任务。
+    已结束的任务最多保留max_finished个，长期运行时任务表不会无限增长。
+    """
+
+    def __init__(self, max_workers: int|None = None, api_key: str|None = None, max_finished: int = MAX_FINISHED_JOBS):
+        """
+        Args:
+            max_workers: 所有任务共享的最大并发请求数，如果为None则从环境变量获取
+            api_key: OpenAI API密钥，如果为None则从环境变量获取
+            max_finished: 最多保留的已结束任务数
+        """
+        if max_workers is None:
+            max_workers = int(os.environ.get("MAX_WORKERS", 5))
+        self.max_workers = max_workers
+        self.api_key = api_key or os.environ.get("OPENAI_API_KEY")
+        self.max_finished = max_finished
+        self.jobs = {}
+        self._by_key = {}
+        self._loop = None
+        self._scheduler = None
+        self._lock = threading.Lock()
+
+    def _get_loop(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(target=self._loop.run_forever, name="job-manager", daemon=True).start()
+            return self._loop
+
+    def submit(self, file_path: str, output_path: str, name: str|None = None,
+               opener: Callable|None = None, key: str|None = None) -> ConversionJob:
+        """
+        提交一个文件转换任务，立即返回
+
+        Args:
+            file_path: 待转换的文件路径
+            output_path: 输出的Markdown文件路径
+            name: 显示名称，默认为文件名
+            opener: 创建DocumentJob的函数，参数为文件路径、输出路径和API密钥，默认为pdf_to_markdown.open_file_job
+            key: 文档键，相同键的提交共享转换任务和结果；为None时总是新建任务
+
+        Returns:
+            ConversionJob（可能是与其他提交共享的任务）
+        """
+        with self._lock:
+            existing = self._by_key.get(key) if key is not None else None
+            if existing is not None:
+                if not existing.is_finished:
+                    # 同一文档正在转换，合并到已有任务
+                    existing.refs += 1
+                    return existing
+                if existing.status == DONE and is_complete_output(existing.output_path):
+                    return existing
+
+            self._prune()
+            job = ConversionJob(file_path, output_path, name, key)
+            self.jobs[job.id] = job
+            if key is not None:
+                self._by_key[key] = job
+            if key is not None and is_complete_output(output_path):
+                # 之前的运行已经完整转换过该文档
+                job.status = DONE
+                job.reused = True
+                job.finished = time.time()
+                return job
+
+        job.future = asyncio.run_coroutine_threadsafe(self._run(job, opener), self._get_loop())
+        job.future.add_done_callback(lambda future: self._on_done(job, future))
+        return job
+
+    def _prune(self):
+        """
+        已结束的任务超过上限时移除最早结束的任务（调用方需持有锁）
+
+        已完成文档的输出文件仍在磁盘上，之后再次提交同一文档时按输出文件直接返回结果。
+        """
+        finished = [job for job in self.jobs.values() if job.is_finished and job.finished is not None]
+        excess = len(finished) - self.max_finished
+        if excess <= 0:
+            return
+        for job in sorted(finished, key=lambda job: job.finished)[:excess]:
+            del self.jobs[job.id]
+            if job.key is not None and self._by_key.get(job.key) is job:
+                del self._by_key[job.key]
+
+    def _on_done(self, job: ConversionJob, future):
+        # 任务在开始运行前被取消时，_run不会执行，在这里标记为已取消
+        if future.cancelled() and job.status == QUEUED:
+            job.status = CANCELLED
+            job.finished = time.time()
+
+    async def _run(self, job: ConversionJob, opener: Callable|None):
+        if opener is None:
+            from pdf_to_markdown import open_file_job as opener
+        if self._scheduler is None:
+            self._scheduler = RequestScheduler(self.max_workers)
+
+        try:
+            # 与process_files_async一样在事件循环线程中打开文档，文档的重排缓冲绑定在该线程上
+            job.document = opener(job.file_path, job.output_path, self.api_key)
+            if job.document is None:
+                job.status = FAILED
+                job.error = "无法打开文件或文件类型不支持"
+                return
+            job.status = RUNNING
+            # 运行统计按任务ID区分页面，同名上传和同一文档的多次转换不会合并
+            job.document.run_id = job.id
+            # 记录已成功的页面任务，取消时据此找出未完成的页面
+            handler = job.document.handler
+
+            async def tracked_handler(task):
+                result = await handler(task)
+                job.completed_tasks.add(id(task))
+                return result
+
+            job.document.handler = tracked_handler
+            await run_jobs([job.document], self._scheduler)
+            job.status = PARTIAL if job.document.failures else DONE
+        except asyncio.CancelledError:
+            self._abandon(job)
+            job.status = CANCELLED
+        except Exception as e:
+            job.status = FAILED
+            job.error = str(e)
+        finally:
+            job.release()
+            job.finished = time.time()
+
+    def _abandon(self, job: ConversionJob):
+        """
+        把被取消任务中未完成的页面记为失败并执行收尾，已完成的页面照常写出，检查点日志保留
+        """
+        document = job.document
+        if document is None or document.finished:
+            return
+        finished = job.completed_tasks | {id(task) for task, _, _ in document.failures}
+        for task in document.tasks:
+            if id(task) not in finished:
+                document.add_failure(task, JobCancelledError("任务已取消"), 0)
+
+    def cancel(self, job_id: str) -> bool:
+        """
+        取消一次提交：任务由多次提交共享时只减少等待数，最后一个提交取消时才真正停止转换
+
+        Args:
+            job_id: 任务ID
+
+        Returns:
+            任务存在且尚未结束时返回True
+        """
+        with self._lock:
+            job = self.jobs.get(job_id)
+            if job is None or job.is_finished or job.future is None:
+                return False
+            job.refs -= 1
+            if job.refs > 0:
+                return True
+        job.future.cancel()
+        return True
+
+    def get(self, job_id: str) -> Optional[ConversionJob]:
+        return self.jobs.get(job_id)
+
+    def watch(self, job_ids: list, interval: float = 0.5):
+        """
+        生成器：任务状态变化时产出任务列表，全部任务结束后停止（用于向界面流式推送进度）
+
+        Args:
+            job_ids: 要关注的任务ID列表
+            interval: 轮询间隔秒数
+
+        Yields:
+            ConversionJob列表（按提交顺序）
+        """
+        last = None
+        while True:
+            jobs = [self.jobs[job_id] for job_id in job_ids if job_id in self.jobs]
+            snapshot = [(job.status, job.done_pages, job.total_pages) for job in jobs]
+            if snapshot != last:
+                last = snapshot
+                yield jobs
+            if all(job.is_finished for job in jobs):
+                return
+            time.sleep(interval)
+
+
+def store_upload(source_path: str, file_name: str|None = None, upload_dir: str = UPLOAD_DIR) -> str:
+    """
+    按内容哈希保存上传的文件，相同内容只保存一份，同名的不同文件也不会互相覆盖
+
+    Args:
+        source_path: 上传的临时文件路径
+        file_name: 保存的文件名，默认为源文件名
+        upload_dir: 上传目录
+
+    Returns:
+        保存后的文件路径（<上传目录>/<内容哈希>/<文件名>，保留第一次上传时的文件名）
+    """
+    digest = hashlib.sha256()
+    with open(source_path, "rb") as upload_file:
+        for chunk in iter(lambda: upload_file.read(1024 * 1024), b""):
+            digest.update(chunk)
+    content_dir = os.path.join(upload_dir, digest.hexdigest()[:32])
+    os.makedirs(content_dir, exist_ok=True)
+
+    existing = [name for name in os.listdir(content_dir) if not name.endswith(".tmp")]
+    if existing:
+        return os.path.join(content_dir, existing[0])
+    file_path = os.path.join(content_dir, os.path.basename(file_name or source_path))
+    # 先复制到临时文件再改名，并发上传同一文件时不会读到写了一半的文件
+    temp_path = f"{file_path}.{uuid.uuid4().hex[:8]}.tmp"
+    shutil.copy2(source_path, temp_path)
+    os.replace(temp_path, file_path)
+    return file_path
+
+
+def submit_document(file_path: str, name: str|None = None, hybrid: bool = False,
+                    markdown_dir: str = MARKDOWN_DIR, manager: "JobManager|None" = None) -> ConversionJob:
+    """
+    提交已保存的文档，按文档键合并重复的转换
+
+    文档键由文件内容、视觉模型请求参数和转换模式共同决定：同一文档正在转换时合并到已有任务，
+    已经转换过时直接返回已有的Markdown文件，之前被取消或部分失败时只处理未完成的页面。
+
+    Args:
+        file_path: store_upload保存后的文件路径
+        name: 显示名称，默认为文件名
+        hybrid: 是否启用混合模式
+        markdown_dir: 输出目录，结果保存在<输出目录>/<文档键>/下
+        manager: 任务管理器，默认为全局任务管理器
+
+    Returns:
+        ConversionJob
+    """
+    from checkpoint import file_fingerprint
+    from pdf_to_markdown import open_file_job
+
+    fingerprint = file_fingerprint(file_path)
+    key = fingerprint + ("-hybrid" if hybrid else "")
+    # 输出文件按文档键存放，沿用第一次转换时的文件名
+    output_dir = os.path.join(markdown_dir, fingerprint[:32] + ("-hybrid" if hybrid else ""))
+    os.makedirs(output_dir, exist_ok=True)
+    outputs = [output for output in os.listdir(output_dir) if output.endswith(".md")]
+    output_name = outputs[0] if outputs else os.path.splitext(os.path.basename(file_path))[0] + ".md"
+
+    manager = manager or get_job_manager()
+    # 取消或部分失败后再次提交时从检查点日志继续，已完成的页面不会被清空重做
+    opener = functools.partial(open_file_job, hybrid=hybrid, resume=True)
+    return manager.submit(file_path, os.path.join(output_dir, output_name), name, opener, key)
+
+
+_job_manager = None
+_job_manager_lock = threading.Lock()
+
+
+def get_job_manager() -> JobManager:
+    """
+    获取全局任务管理器（第一次调用时按环境变量MAX_WORKERS创建）
+    """
+    global _job_manager
+    with _job_manager_lock:
+        if _job_manager is None:
+            _job_manager = JobManager()
+        return _job_manager
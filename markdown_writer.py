@@ -0,0 +1,83 @@
+import os
+import asyncio
+
+from dotenv import load_dotenv
+
+# 加载环境变量
+load_dotenv()
+
+
+class OrderedMarkdownWriter:
+    """
+    按页码顺序流式写出Markdown文件的重排缓冲
+
+    页面可以乱序完成：某页到达时，如果之前的页面都已完成，就立即连同缓冲中
+    紧随其后的页面一起写入文件并刷新，因此转换过程中可以用tail -f等方式查看输出。
+    缓冲中最多积压window页，调度器在分配新页面前调用wait_for_slot，
+    慢页面（例如正在重试）会暂停后续页面的分配，而不是让结果无限堆积在内存中。
+
+    所有方法都应在同一个事件循环线程中调用。
+    """
+
+    def __init__(self, output_path: str, total: int, window: int|None = None):
+        """
+        Args:
+            output_path: 输出的Markdown文件路径（立即创建并清空）
+            total: 文档总页数
+            window: 领先于已写出页面的最大页数，如果为None则从环境变量REORDER_WINDOW获取，默认为64
+        """
+        if window is None:
+            window = int(os.environ.get("REORDER_WINDOW", 64))
+        self.output_path = output_path
+        self.total = total
+        self.window = max(1, window)
+        self.next_index = 0
+        self._pending = {}
+        self._advanced = asyncio.Event()
+        self._file = open(output_path, "w", encoding="utf-8")
+
+    @property
+    def buffered(self) -> int:
+        """
+        已完成但尚未写出的页面数
+        """
+        return len(self._pending)
+
+    def put(self, index: int, content: str):
+        """
+        提交一页内容，写出所有已连续完成的页面
+
+        Args:
+            index: 从0开始的页码
+            content: 该页的Markdown内容
+        """
+        self._pending[index] = content
+        if index != self.next_index:
+            return
+        while self.next_index in self._pending:
+            self._file.write(self._pending.pop(self.next_index))
+            self.next_index += 1
+        self._file.flush()
+        self._advanced.set()
+
+    async def wait_for_slot(self, index: int):
+        """
+        等待直到第index页进入写出窗口
+
+        Args:
+            index: 从0开始的页码
+        """
+        while index >= self.next_index + self.window:
+            self._advanced.clear()
+            await self._advanced.wait()
+
+    def close(self):
+        """
+        写出缓冲中剩余的页面（正常情况下为空）并关闭文件
+        """
+        if self._file.closed:
+            return
+        for index in sorted(self._pending):
+            self._file.write(self._pending[index])
+        self._pending.clear()
+        self._file.close()
@@ -0,0 +1,425 @@
+import os
+import json
+import time
+import math
+import random
+import threading
+import contextvars
+from contextlib import contextmanager
+from collections import defaultdict, OrderedDict
+
+from dotenv import load_dotenv
+
+# 加载环境变量
+load_dotenv()
+
+# 记录耗时的阶段（按页面处理的先后顺序）
+STAGES = {
+    "render": "页面加载、路由分析与渲染（有渲染进程池时为等待预渲染结果的时间）",
+    "cache": "计算缓存键并查询页面缓存",
+    "encode": "图像base64编码",
+    "queue": "等待限速器放行",
+    "request": "发出请求到收到响应头（上传图像、服务端排队）",
+    "first_token": "收到响应头到收到第一个输出片段（模型读取图像和提示词）",
+    "generation": "第一个输出片段到响应结束（模型生成输出）",
+    "retry_wait": "失败后等待重试的退避时间",
+    "page": "单页总耗时（第一次尝试开始到最后一次尝试结束，包括重试等待）",
+}
+# 报告中统计的百分位
+PERCENTILES = (50, 90, 99)
+# 每个阶段最多保留的耗时样本数（蓄水池抽样），百分位按样本估计，次数、总和与最大值精确统计
+MAX_STAGE_SAMPLES = 4096
+# 最多保留的已结束页面的逐页耗时（长期运行的服务中先结束的页面先被丢弃）
+MAX_PAGE_TIMINGS = int(os.environ.get("METRICS_MAX_PAGES", 10000))
+
+# 当前正在处理的页面（由run_jobs在调用页面处理协程前设置，经asyncio.to_thread传入线程）
+_current_page = contextvars.ContextVar("current_page", default=None)
+
+
+def percentile(sorted_values: list, q: float) -> float:
+    """
+    按最近秩法计算已排序数据的百分位数
+    """
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(q / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+class StageSamples:
+    """
+    单个阶段的耗时统计：精确的次数、总和与最大值，以及固定容量的均匀样本（蓄水池抽样）
+
+    内存占用和计算百分位的开销与记录次数无关，长期运行的服务也不会随处理的页面数增长。
+    """
+
+    def __init__(self, capacity: int = MAX_STAGE_SAMPLES, rng: random.Random|None = None):
+        self.capacity = capacity
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.samples = []
+        self._rng = rng or random.Random()
+
+    def add(self, seconds: float):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        if len(self.samples) < self.capacity:
+            self.samples.append(seconds)
+        else:
+            index = self._rng.randrange(self.count)
+            if index < self.capacity:
+                self.samples[index] = seconds
+
+    def summary(self) -> dict:
+        values = sorted(self.samples)
+        return {
+            "count": self.count,
+            "total": round(self.total, 6),
+            **{f"p{q}": round(percentile(values, q), 6) for q in PERCENTILES},
+            "max": round(self.max, 6),
+        }
+
+
+class PageTiming:
+    """
+    单个页面在所有尝试中的各阶段耗时、token用量和最终状态
+    """
+
+    def __init__(self, document: str, page: int, run: str = ""):
+        """
+        Args:
+            document: 文档名称
+            page: 从1开始的页码
+            run: 文档所属任务的ID，用于区分同名文档和同一文档的多次转换
+        """
+        self.document = document
+        self.page = page
+        self.run = run
+        self.attempts = 0
+        self.status = "running"
+        self.stages = defaultdict(float)
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.started = time.perf_counter()
+        self.finished = None
+
+    def to_dict(self) -> dict:
+        return {
+            "document": self.document,
+            "page": self.page,
+            "job": self.run or None,
+            "status": self.status,
+            "attempts": self.attempts,
+            "seconds": round((self.finished or time.perf_counter()) - self.started, 6),
+            "stages": {stage: round(seconds, 6) for stage, seconds in self.stages.items()},
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+        }
+
+
+class RunMetrics:
+    """
+    一次运行的耗时与token用量统计（线程安全）
+
+    各阶段的耗时既计入全局样本，也计入当前页面（由page设置的上下文变量确定），
+    运行结束时汇总为JSON报告或Prometheus文本格式的指标。
+    样本数和逐页耗时都有上限（MAX_STAGE_SAMPLES、MAX_PAGE_TIMINGS），可以在长期运行的服务中使用。
+    """
+
+    def __init__(self, max_pages: int = MAX_PAGE_TIMINGS):
+        self.started_at = time.time()
+        self.started = time.perf_counter()
+        self.samples = defaultdict(StageSamples)
+        self.pages = OrderedDict()
+        # 已结束的页面按结束顺序排列，超出上限时从最早结束的页面开始丢弃
+        self._finished = OrderedDict()
+        self.max_pages = max_pages
+        self.dropped_pages = 0
+        self.completed = 0
+        self.requests = 0
+        self.retries = 0
+        self.failures = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.total_tokens = 0
+        self._lock = threading.Lock()
+
+    def record(self, stage: str, seconds: float):
+        """
+        记录一个阶段的一次耗时
+
+        Args:
+            stage: 阶段名称，见STAGES
+            seconds: 耗时秒数
+        """
+        page = _current_page.get()
+        with self._lock:
+            self.samples[stage].add(seconds)
+            if page is not None:
+                page.stages[stage] += seconds
+
+    @contextmanager
+    def stage(self, stage: str):
+        """
+        记录with语句块的耗时（出错时同样记录）
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - start)
+
+    def add_usage(self, usage: dict|None):
+        """
+        累加一次模型请求的token用量
+
+        Args:
+            usage: 响应中的usage字段，没有时只计入请求数
+        """
+        usage = usage or {}
+        prompt_tokens = usage.get("prompt_tokens") or 0
+        completion_tokens = usage.get("completion_tokens") or 0
+        page = _current_page.get()
+        with self._lock:
+            self.requests += 1
+            self.prompt_tokens += prompt_tokens
+            self.completion_tokens += completion_tokens
+            self.total_tokens += usage.get("total_tokens") or prompt_tokens + completion_tokens
+            if page is not None:
+                page.prompt_tokens += prompt_tokens
+                page.completion_tokens += completion_tokens
+
+    def _page(self, document: str, page: int, run: str|None) -> PageTiming:
+        key = (document, page, run or "")
+        with self._lock:
+            timing = self.pages.get(key)
+            if timing is None:
+                timing = self.pages[key] = PageTiming(*key)
+                self._evict()
+            return timing
+
+    def _evict(self):
+        """
+        逐页耗时超过上限时丢弃最早结束的页面（调用方需持有锁），正在处理的页面不会被丢弃
+        """
+        while len(self.pages) > self.max_pages and self._finished:
+            key, _ = self._finished.popitem(last=False)
+            if self.pages.pop(key, None) is not None:
+                self.dropped_pages += 1
+
+    def _mark_finished(self, timing: PageTiming):
+        """
+        记录页面的结束时间，并把页面移到结束顺序的末尾（调用方需持有锁）
+        """
+        timing.finished = time.perf_counter()
+        key = (timing.document, timing.page, timing.run)
+        # 已被丢弃的页面不再登记
+        if self.pages.get(key) is timing:
+            self._finished[key] = None
+            self._finished.move_to_end(key)
+
+    def _finish_page(self, timing: PageTiming, status: str):
+        """
+        记录页面的最终状态，页面总耗时计入page阶段（调用方需持有锁）
+        """
+        timing.status = status
+        self._mark_finished(timing)
+        self.samples["page"].add(timing.finished - timing.started)
+
+    @contextmanager
+    def page(self, document: str, page: int, run: str|None = None):
+        """
+        在with语句块内把各阶段耗时和token用量计入指定页面（每次尝试调用一次）
+
+        Args:
+            document: 文档名称
+            page: 从1开始的页码
+            run: 文档所属任务的ID，同名文档或同一文档的多次转换按任务分别统计
+        """
+        timing = self._page(document, page, run)
+        timing.attempts += 1
+        token = _current_page.set(timing)
+        try:
+            yield timing
+            with self._lock:
+                self.completed += 1
+                self._finish_page(timing, "ok")
+        finally:
+            _current_page.reset(token)
+            if timing.status == "running":
+                with self._lock:
+                    self._mark_finished(timing)
+
+    def record_retry(self, document: str, page: int, delay: float, run: str|None = None):
+        """
+        记录一次重试及其退避时间
+        """
+        timing = self._page(document, page, run)
+        with self._lock:
+            self.retries += 1
+            self.samples["retry_wait"].add(delay)
+            timing.stages["retry_wait"] += delay
+
+    def record_failure(self, document: str, page: int, run: str|None = None):
+        """
+        记录一个重试耗尽或遇到致命错误的页面
+        """
+        timing = self._page(document, page, run)
+        with self._lock:
+            self.failures += 1
+            self._finish_page(timing, "failed")
+
+    def cost(self) -> dict|None:
+        """
+        按环境变量中的单价估算费用
+
+        环境变量:
+            TOKEN_PRICE_INPUT: 每百万输入token的价格（留空则不估算费用）
+            TOKEN_PRICE_OUTPUT: 每百万输出token的价格（留空则与输入相同）
+
+        Returns:
+            包含输入、输出和合计费用的字典，未设置单价时返回None
+        """
+        input_price = os.environ.get("TOKEN_PRICE_INPUT")
+        if not input_price:
+            return None
+        input_price = float(input_price)
+        output_price = float(os.environ.get("TOKEN_PRICE_OUTPUT") or input_price)
+        input_cost = self.prompt_tokens * input_price / 1_000_000
+        output_cost = self.completion_tokens * output_price / 1_000_000
+        return {
+            "input": round(input_cost, 6),
+            "output": round(output_cost, 6),
+            "total": round(input_cost + output_cost, 6),
+        }
+
+    def report(self, with_pages: bool = True) -> dict:
+        """
+        汇总本次运行的统计：各阶段耗时的百分位、逐页耗时、重试次数、token用量和费用
+
+        Args:
+            with_pages: 是否包含逐页耗时（Prometheus指标不需要）
+
+        Returns:
+            可以直接序列化为JSON的字典
+        """
+        with self._lock:
+            stages = {stage: samples.summary() for stage, samples in self.samples.items()}
+            pages = [timing.to_dict() for _, timing in sorted(self.pages.items())] if with_pages else []
+            completed = self.completed
+            dropped_pages = self.dropped_pages
+
+        elapsed = time.perf_counter() - self.started
+        return {
+            "started_at": time.strftime("%Y-%m-%dT%H:%M:%S%z", time.localtime(self.started_at)),
+            "elapsed_seconds": round(elapsed, 4),
+            "pages": {
+                "completed": completed,
+                "failed": self.failures,
+                "per_second": round(completed / elapsed, 4) if elapsed > 0 else 0.0,
+            },
+            "requests": self.requests,
+            "retries": self.retries,
+            "tokens": {
+                "prompt": self.prompt_tokens,
+                "completion": self.completion_tokens,
+                "total": self.total_tokens,
+            },
+            "cost": self.cost(),
+            "stages": stages,
+            "page_timings": pages,
+            "dropped_page_timings": dropped_pages,
+        }
+
+    def write_report(self, path: str):
+        """
+        把运行报告写入JSON文件
+        """
+        with open(path, "w", encoding="utf-8") as report_file:
+            json.dump(self.report(), report_file, ensure_ascii=False, indent=2)
+
+    def prometheus(self) -> str:
+        """
+        生成Prometheus文本格式的指标
+        """
+        report = self.report(with_pages=False)
+        lines = [
+            "# HELP md_pages_total 处理完成的页面数",
+            "# TYPE md_pages_total counter",
+            f'md_pages_total{{status="ok"}} {report["pages"]["completed"]}',
+            f'md_pages_total{{status="failed"}} {report["pages"]["failed"]}',
+            "# HELP md_requests_total 视觉模型请求数",
+            "# TYPE md_requests_total counter",
+            f"md_requests_total {report['requests']}",
+            "# HELP md_retries_total 重试次数",
+            "# TYPE md_retries_total counter",
+            f"md_retries_total {report['retries']}",
+            "# HELP md_tokens_total 视觉模型token用量",
+            "# TYPE md_tokens_total counter",
+            f'md_tokens_total{{kind="prompt"}} {report["tokens"]["prompt"]}',
+            f'md_tokens_total{{kind="completion"}} {report["tokens"]["completion"]}',
+            "# HELP md_stage_seconds 各阶段耗时",
+            "# TYPE md_stage_seconds summary",
+        ]
+        for stage, stats in report["stages"].items():
+            for q in PERCENTILES:
+                lines.append(f'md_stage_seconds{{stage="{stage}",quantile="{q / 100}"}} {stats[f"p{q}"]}')
+            lines.append(f'md_stage_seconds_sum{{stage="{stage}"}} {stats["total"]}')
+            lines.append(f'md_stage_seconds_count{{stage="{stage}"}} {stats["count"]}')
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path: str):
+        """
+        把指标写入Prometheus文本格式文件（先写临时文件再替换，供node_exporter的textfile收集器读取）
+        """
+        temp_path = path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as metrics_file:
+            metrics_file.write(self.prometheus())
+        os.replace(temp_path, path)
+
+    def serve(self, port: int, host: str = "127.0.0.1"):
+        """
+        在后台线程中启动/metrics接口
+
+        Args:
+            port: 监听端口
+            host: 监听地址
+
+        Returns:
+            HTTP服务器，调用shutdown停止
+        """
+        from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                if self.path != "/metrics":
+                    self.send_error(404)
+                    return
+                body = metrics.prometheus().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+
+_run_metrics = RunMetrics()
+
+
+def get_run_metrics() -> RunMetrics:
+    """
+    获取整个运行期间的耗时与token用量统计
+    """
+    return _run_metrics
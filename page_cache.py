@@ -0,0 +1,202 @@
+import os
+import json
+import time
+import asyncio
+import hashlib
+import sqlite3
+import threading
+from typing import Optional
+
+from dotenv import load_dotenv
+from vision_api import request_fingerprint
+
+# 加载环境变量
+load_dotenv()
+
+# 默认缓存目录与容量上限
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "files", "cache")
+DEFAULT_CACHE_MAX_MB = 512
+
+
+class PageCache:
+    """
+    基于内容寻址的页面结果缓存
+
+    缓存键由页面图像字节和视觉模型请求参数（模型名称、提示词、解码参数）共同哈希得到，
+    因此页面内容或请求参数任一变化都会自然失效。结果保存在SQLite数据库中，
+    总大小超过上限时按最近最少使用（LRU）顺序淘汰。总大小在打开数据库时统计一次，之后随写入和淘汰增减。
+    在事件循环中请使用get_async和put_async，数据库读写在线程中进行，不阻塞事件循环。
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: int, enabled: bool = True):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = None
+        self._total = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        """
+        延迟打开缓存数据库（调用方需持有锁）
+        """
+        if self._conn is None:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            db_path = os.path.join(self.cache_dir, "page_cache.sqlite3")
+            self._conn = sqlite3.connect(db_path, check_same_thread=False)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS pages ("
+                "key TEXT PRIMARY KEY, content TEXT NOT NULL, "
+                "size INTEGER NOT NULL, last_access REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_last_access ON pages(last_access)")
+            self._conn.commit()
+            self._total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM pages").fetchone()[0]
+        return self._conn
+
+    @staticmethod
+    def make_key(image_bytes: bytes, mode: str|None = None) -> str:
+        """
+        计算页面图像的缓存键
+
+        Args:
+            image_bytes: 渲染后的页面图像字节
+            mode: 请求方式，None表示单页请求；打包请求拆出的结果使用不同的键，与单页提示词的结果分开保存
+
+        Returns:
+            十六进制SHA-256缓存键
+        """
+        digest = hashlib.sha256()
+        digest.update(image_bytes)
+        digest.update(json.dumps(request_fingerprint(), sort_keys=True, ensure_ascii=False).encode("utf-8"))
+        if mode is not None:
+            digest.update(f"\0{mode}".encode("utf-8"))
+        return digest.hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        """
+        查询缓存，命中时刷新访问时间
+
+        Args:
+            key: 缓存键
+
+        Returns:
+            缓存的页面结果，未命中或缓存被禁用时返回None
+        """
+        if not self.enabled:
+            return None
+        with self._lock:
+            conn = self._connect()
+            row = conn.execute("SELECT content FROM pages WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            conn.execute("UPDATE pages SET last_access = ? WHERE key = ?", (time.time(), key))
+            conn.commit()
+            self.hits += 1
+            return row[0]
+
+    def put(self, key: str, content: str):
+        """
+        写入缓存，并在超出容量上限时淘汰最久未使用的条目
+
+        Args:
+            key: 缓存键
+            content: 页面结果
+        """
+        if not self.enabled:
+            return
+        size = len(content.encode("utf-8"))
+        with self._lock:
+            conn = self._connect()
+            # 覆盖已有条目时先减去旧条目的大小
+            row = conn.execute("SELECT size FROM pages WHERE key = ?", (key,)).fetchone()
+            conn.execute(
+                "INSERT OR REPLACE INTO pages (key, content, size, last_access) VALUES (?, ?, ?, ?)",
+                (key, content, size, time.time()),
+            )
+            self._total += size - (row[0] if row is not None else 0)
+            while self._total > self.max_bytes:
+                row = conn.execute("SELECT key, size FROM pages ORDER BY last_access LIMIT 1").fetchone()
+                if row is None:
+                    self._total = 0
+                    break
+                conn.execute("DELETE FROM pages WHERE key = ?", (row[0],))
+                self._total -= row[1]
+            conn.commit()
+
+    async def get_async(self, key: str) -> Optional[str]:
+        """
+        查询缓存（异步版本），数据库读写在线程中进行
+
+        Args:
+            key: 缓存键
+
+        Returns:
+            同get
+        """
+        if not self.enabled:
+            return None
+        return await asyncio.to_thread(self.get, key)
+
+    async def put_async(self, key: str, content: str):
+        """
+        写入缓存（异步版本），数据库读写在线程中进行
+
+        Args:
+            key: 缓存键
+            content: 页面结果
+        """
+        if not self.enabled:
+            return
+        await asyncio.to_thread(self.put, key, content)
+
+    def clear(self):
+        """
+        清空所有缓存条目
+        """
+        with self._lock:
+            conn = self._connect()
+            conn.execute("DELETE FROM pages")
+            conn.commit()
+            conn.execute("VACUUM")
+            self._total = 0
+
+    def stats(self) -> dict:
+        """
+        返回缓存统计信息
+
+        Returns:
+            包含命中次数、未命中次数、条目数和占用字节数的字典
+        """
+        with self._lock:
+            conn = self._connect()
+            entries, size = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM pages").fetchone()
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'entries': entries,
+            'bytes': size,
+        }
+
+
+_page_cache = None
+_page_cache_lock = threading.Lock()
+
+
+def get_page_cache() -> PageCache:
+    """
+    获取进程内共享的页面缓存实例，目录和容量上限从环境变量读取
+
+    Returns:
+        PageCache实例
+    """
+    global _page_cache
+    with _page_cache_lock:
+        if _page_cache is None:
+            cache_dir = os.environ.get("PAGE_CACHE_DIR") or DEFAULT_CACHE_DIR
+            max_mb = float(os.environ.get("PAGE_CACHE_MAX_MB", DEFAULT_CACHE_MAX_MB))
+            _page_cache = PageCache(cache_dir, int(max_mb * 1024 * 1024))
+        return _page_cache
@@ -0,0 +1,245 @@
+import io
+import os
+import asyncio
+import hashlib
+import threading
+from collections import deque
+
+from typing import TYPE_CHECKING
+
+from dotenv import load_dotenv
+
+from async_engine import released_slot
+
+if TYPE_CHECKING:
+    from PIL import Image
+
+# 加载环境变量
+load_dotenv()
+
+# 与背景灰度（出现最多的灰度值）相差超过该值的像素视为内容，深色背景的幻灯片同样适用
+INK_DELTA = 48
+# 感知哈希的网格边长（哈希共HASH_SIZE*HASH_SIZE位），网格越细越不容易把不同的文字页判为重复
+HASH_SIZE = 32
+# 计算签名前将图像缩小到的最大边长（过小会让细小的文字在缩小后消失）
+SIGNATURE_SIDE = 1024
+
+
+def page_signature(image: "Image.Image", total_pixels: int|None = None) -> tuple[bool, int]:
+    """
+    根据像素统计判断页面是否空白，并计算差值感知哈希（dHash）
+
+    页面与背景色不同的像素比例低于BLANK_INK_RATIO（默认为0.0002）时视为空白，
+    只有页码或少量扫描噪点的页面也会被判为空白。图像应为实际发送的分辨率，
+    低分辨率预览中细小的文字会消失，只有一行短公式的页面会被误判为空白。
+
+    Args:
+        image: 页面图像
+        total_pixels: 整页在同一分辨率下的像素数（图像裁剪过边距时给出），为None时按图像大小计算
+
+    Returns:
+        (是否空白, 感知哈希) 元组
+    """
+    from PIL import Image
+
+    gray = image.convert("L")
+    histogram = gray.histogram()
+    background = histogram.index(max(histogram))
+    ink = sum(count for level, count in enumerate(histogram) if abs(level - background) > INK_DELTA)
+    ink_ratio = ink / max(1, total_pixels or gray.width * gray.height)
+    blank = ink_ratio < float(os.environ.get("BLANK_INK_RATIO", 0.0002))
+
+    # 每个像素与右侧相邻像素比较亮度，得到HASH_SIZE*HASH_SIZE位的哈希
+    pixels = list(gray.resize((HASH_SIZE + 1, HASH_SIZE), Image.BILINEAR).getdata())
+    phash = 0
+    for row in range(HASH_SIZE):
+        offset = row * (HASH_SIZE + 1)
+        for col in range(HASH_SIZE):
+            phash = (phash << 1) | (pixels[offset + col] < pixels[offset + col + 1])
+    return blank, phash
+
+
+def image_signature(image) -> tuple[bool, int]:
+    """
+    计算图像文件或图像字节的签名
+
+    Args:
+        image: 图像文件路径或内存中的图像字节
+
+    Returns:
+        同page_signature
+    """
+    from PIL import Image
+
+    source = image if isinstance(image, (str, os.PathLike)) else io.BytesIO(image)
+    with Image.open(source) as opened:
+        opened.draft("L", (SIGNATURE_SIDE, SIGNATURE_SIDE))
+        preview = opened.convert("L")
+        preview.thumbnail((SIGNATURE_SIDE, SIGNATURE_SIDE))
+        return page_signature(preview)
+
+
+def content_digest(data: bytes) -> str:
+    """
+    计算图像字节的内容摘要，摘要相同的页面完全相同，可以直接复用结果
+    """
+    return hashlib.sha256(data).hexdigest()
+
+
+def hash_distance(a: int, b: int) -> float:
+    """
+    两个感知哈希之间不同位所占的比例（0表示完全相同）
+    """
+    return (a ^ b).bit_count() / (HASH_SIZE * HASH_SIZE)
+
+
+class DuplicateIndex:
+    """
+    单个文档内的重复页面索引
+
+    每页在调用视觉模型前查询索引：如果前面某页的图像与它完全相同（内容摘要相同），
+    或者开启了近似重复（threshold大于0）且感知哈希的差异不超过threshold，就等待那一页的结果并直接复用。
+    感知哈希对只改动了几个字符的页面几乎没有差别，近似重复可能复用到内容不同的页面，因此默认关闭。
+    等待期间让出调度器的并发名额（被等待的页面可能正在退避重试，
+    需要重新获得名额）；只和前面的页面比较，不会出现互相等待；
+    索引只保留最近window页，内存占用有上限。所有方法都应在同一个事件循环线程中调用。
+    """
+
+    def __init__(self, threshold: float, window: int = 50):
+        """
+        Args:
+            threshold: 判为近似重复的最大差异比例（0~1），0表示只复用完全相同的页面
+            window: 参与比较的最近页面数
+        """
+        self.threshold = threshold
+        self.window = max(1, window)
+        self._entries = deque(maxlen=self.window)
+        self._futures = {}
+
+    def _future(self, page_num: int):
+        future = self._futures.get(page_num)
+        if future is None:
+            future = asyncio.get_running_loop().create_future()
+            self._futures[page_num] = future
+        return future
+
+    def matches(self, digest: str, phash: int|None, other_digest: str, other_hash: int|None) -> bool:
+        """
+        判断两页是否可以共用结果：内容摘要相同，或开启近似重复时感知哈希足够接近
+        """
+        if digest == other_digest:
+            return True
+        return (self.threshold > 0 and phash is not None and other_hash is not None
+                and hash_distance(phash, other_hash) <= self.threshold)
+
+    async def reuse(self, page_num: int, digest: str, phash: int|None = None) -> tuple[int, str]|None:
+        """
+        登记本页的签名，并查找可以复用结果的前面页面
+
+        Args:
+            page_num: 从0开始的页码
+            digest: 本页图像的内容摘要
+            phash: 本页的感知哈希（只在开启近似重复时使用）
+
+        Returns:
+            (被复用的页码, 页面结果) 元组；没有重复页面或该页最终失败时返回None
+        """
+        match = None
+        for other_digest, other_hash, other_num in self._entries:
+            if other_num < page_num and self.matches(digest, phash, other_digest, other_hash):
+                match = other_num
+        if all(other_num != page_num for _, _, other_num in self._entries):
+            self._entries.append((digest, phash, page_num))
+            # 窗口外的页面不再需要保留结果
+            live = {other_num for _, _, other_num in self._entries}
+            for stale in [num for num in self._futures if num not in live]:
+                del self._futures[stale]
+        self._future(page_num)
+
+        if match is None or match not in self._futures:
+            return None
+        future = self._futures[match]
+        if future.done():
+            text = future.result()
+        else:
+            async with released_slot():
+                text = await asyncio.shield(future)
+        if text is None:
+            return None
+        return match, text
+
+    def resolve(self, page_num: int, text: str|None):
+        """
+        记录一页的最终结果，等待该页的重复页面随即复用；text为None表示该页失败
+
+        Args:
+            page_num: 从0开始的页码
+            text: 页面结果
+        """
+        future = self._futures.get(page_num)
+        if future is not None and not future.done():
+            future.set_result(text)
+
+
+def get_duplicate_index() -> DuplicateIndex|None:
+    """
+    按环境变量创建一个文档的重复页面索引
+
+    环境变量:
+        DUPLICATE_THRESHOLD: 判为近似重复的最大哈希差异比例（默认为0，只复用完全相同的页面），设为负数时关闭
+        DUPLICATE_WINDOW: 参与比较的最近页面数（默认为50）
+
+    Returns:
+        DuplicateIndex实例，关闭时返回None
+    """
+    threshold = float(os.environ.get("DUPLICATE_THRESHOLD") or 0)
+    if threshold < 0:
+        return None
+    return DuplicateIndex(threshold, int(os.environ.get("DUPLICATE_WINDOW", 50)))
+
+
+class FilterStats:
+    """
+    跳过的页面计数：空白页和复用结果的重复页面
+    """
+
+    def __init__(self, parent: "FilterStats|None" = None):
+        self.blank = 0
+        self.duplicate = 0
+        self.parent = parent
+        self._lock = threading.Lock()
+
+    def record(self, info: dict|None):
+        """
+        根据页面的渲染参数或签名记录是否被跳过
+
+        Args:
+            info: 包含blank和duplicate_of字段的字典（可以为None）
+        """
+        if not info:
+            return
+        with self._lock:
+            if info.get("blank"):
+                self.blank += 1
+            elif info.get("duplicate_of") is not None:
+                self.duplicate += 1
+        if self.parent is not None:
+            self.parent.record(info)
+
+    def summary(self) -> str|None:
+        """
+        生成一行跳过统计，没有跳过任何页面时返回None
+        """
+        if not self.blank and not self.duplicate:
+            return None
+        return f"跳过: 空白页 {self.blank} 页，重复页面 {self.duplicate} 页（共节省 {self.blank + self.duplicate} 次API调用）"
+
+
+_filter_stats = FilterStats()
+
+
+def get_filter_stats() -> FilterStats:
+    """
+    获取整个运行期间所有文档汇总的跳过统计
+    """
+    return _filter_stats
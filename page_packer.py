@@ -0,0 +1,255 @@
+import io
+import os
+import math
+import asyncio
+import contextvars
+
+from dotenv import load_dotenv
+
+from vision_api import process_packed_pages_async, ESTIMATED_IMAGE_TOKENS
+
+# 加载环境变量
+load_dotenv()
+
+# 视觉模型把图像缩放到不超过该边长后按PATCH_PX像素的图块计算token
+# （MODEL_IMAGE_SIDE为PATCH_PX的40倍，满幅图像约为ESTIMATED_IMAGE_TOKENS个token）
+MODEL_IMAGE_SIDE = 1120
+PATCH_PX = 28
+# 拼接图像中页与页之间的分隔线宽度和分隔线颜色
+TILE_GAP = 8
+TILE_GAP_COLOR = (160, 160, 160)
+# 拼接图像中页序号标签的字号
+TILE_LABEL_SIZE = 28
+# 打包模式：bundle为多张图像放在同一请求中，tile为拼接成一张图像
+PACK_MODES = ("bundle", "tile")
+
+
+def image_size(image: bytes) -> tuple[int, int]:
+    """
+    只读取图像头部获取尺寸
+    """
+    from PIL import Image
+
+    with Image.open(io.BytesIO(image)) as opened:
+        return opened.size
+
+
+def estimate_image_tokens(image: bytes) -> int:
+    """
+    按图像尺寸粗略估计视觉模型为一张图像消耗的输入token数
+
+    Args:
+        image: 编码后的图像字节
+
+    Returns:
+        预估的token数，满幅图像约为ESTIMATED_IMAGE_TOKENS
+    """
+    width, height = image_size(image)
+    scale = min(1.0, MODEL_IMAGE_SIDE / max(width, height, 1))
+    return max(1, math.ceil(width * scale / PATCH_PX) * math.ceil(height * scale / PATCH_PX))
+
+
+def tile_images(images: list) -> bytes:
+    """
+    把多页图像按网格拼接成一张图像，每页左上角标注页序号
+
+    每页缩放到相同的单元格内，整张图像的长边不超过MODEL_IMAGE_SIDE的两倍，
+    避免模型再次缩放时文字过小。
+
+    Args:
+        images: 各页的图像字节
+
+    Returns:
+        拼接后的PNG图像字节
+    """
+    from PIL import Image, ImageDraw, ImageFont
+
+    pages = [Image.open(io.BytesIO(image)).convert("RGB") for image in images]
+    columns = math.ceil(math.sqrt(len(pages)))
+    rows = math.ceil(len(pages) / columns)
+    cell_width = max(page.width for page in pages)
+    cell_height = max(page.height for page in pages)
+    scale = min(1.0, 2 * MODEL_IMAGE_SIDE / max(columns * cell_width, rows * cell_height))
+    cell_width, cell_height = max(1, int(cell_width * scale)), max(1, int(cell_height * scale))
+
+    canvas = Image.new(
+        "RGB",
+        (columns * cell_width + (columns - 1) * TILE_GAP, rows * cell_height + (rows - 1) * TILE_GAP),
+        TILE_GAP_COLOR
+    )
+    draw = ImageDraw.Draw(canvas)
+    try:
+        font = ImageFont.truetype("arial.ttf", TILE_LABEL_SIZE)
+    except OSError:
+        font = ImageFont.load_default()
+    for index, page in enumerate(pages):
+        left = (index % columns) * (cell_width + TILE_GAP)
+        top = (index // columns) * (cell_height + TILE_GAP)
+        canvas.paste((255, 255, 255), (left, top, left + cell_width, top + cell_height))
+        page.thumbnail((cell_width, cell_height))
+        canvas.paste(page, (left, top))
+        label = f"[{index + 1}]"
+        box = draw.textbbox((left, top), label, font=font)
+        draw.rectangle((box[0], box[1], box[2] + 8, box[3] + 8), fill=(0, 0, 0))
+        draw.text((left + 4, top + 4), label, fill=(255, 255, 255), font=font)
+
+    buffer = io.BytesIO()
+    canvas.save(buffer, format="PNG", optimize=True)
+    return buffer.getvalue()
+
+
+class PagePacker:
+    """
+    单个文档（或一批图片）的多页打包器
+
+    页面在调用视觉模型前提交给打包器：凑满max_pages页、预估图像token数即将超过max_tokens，
+    或第一页等待超过linger秒时，把已提交的页面合并为一次请求，再按分隔标记把响应拆回各页。
+    - 单独一页凑不成批、或响应中某页无法拆分时，该页返回None，由调用方改为单页请求
+    - 打包请求失败时，异常传给批内每一页，由调度器按各页的重试策略重试（重试时重新打包）
+    所有方法都应在同一个事件循环线程中调用。
+    """
+
+    def __init__(self, api_key: str|None, max_pages: int, max_tokens: int, linger: float = 0.2, mode: str = "bundle"):
+        """
+        Args:
+            api_key: OpenAI API密钥
+            max_pages: 每次请求最多打包的页数
+            max_tokens: 每次请求中图像的预估token数上限
+            linger: 批次中第一页最多等待其他页面的秒数
+            mode: bundle（多张图像放在同一请求中）或tile（拼接成一张图像）
+        """
+        if mode not in PACK_MODES:
+            raise ValueError(f"不支持的打包模式: {mode}")
+        self.api_key = api_key
+        self.max_pages = max_pages
+        self.max_tokens = max_tokens
+        self.linger = linger
+        self.mode = mode
+        self.requests = 0
+        self.packed_pages = 0
+        self.fallback_pages = 0
+        self._pending = []
+        self._pending_tokens = 0
+        self._timer = None
+        self._sending = set()
+
+    async def process(self, image: bytes) -> str|None:
+        """
+        提交一页图像，等待所在批次的结果
+
+        Args:
+            image: 编码后的页面图像字节
+
+        Returns:
+            该页的模型输出；图像过大不适合打包、批次只有这一页或响应无法拆分时返回None
+        """
+        tokens = estimate_image_tokens(image)
+        # 至少能和另一页同批时才打包，大图像直接单页请求
+        if tokens * 2 > self.max_tokens:
+            return None
+        if self._pending and self._pending_tokens + tokens > self.max_tokens:
+            self._flush()
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((image, tokens, future))
+        self._pending_tokens += tokens
+        if len(self._pending) >= self.max_pages:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.linger, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending, self._pending_tokens = self._pending, [], 0
+        batch = [entry for entry in batch if not entry[2].done()]
+        if len(batch) == 1:
+            batch[0][2].set_result(None)
+        elif batch:
+            # 打包请求属于批内所有页面，不继承触发发送的那一页的统计上下文
+            task = contextvars.Context().run(asyncio.ensure_future, self._send(batch))
+            self._sending.add(task)
+            task.add_done_callback(self._sending.discard)
+
+    async def _send(self, batch: list):
+        images = [image for image, _, _ in batch]
+        image_tokens = sum(tokens for _, tokens, _ in batch)
+        try:
+            if self.mode == "tile":
+                tiled = await asyncio.to_thread(tile_images, images)
+                texts = await process_packed_pages_async([tiled], len(batch), self.api_key, estimate_image_tokens(tiled))
+            else:
+                texts = await process_packed_pages_async(images, len(batch), self.api_key, image_tokens)
+        except Exception as e:
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        self.requests += 1
+        for (_, _, future), text in zip(batch, texts):
+            if text is None:
+                self.fallback_pages += 1
+            else:
+                self.packed_pages += 1
+            if not future.done():
+                future.set_result(text)
+
+    def summary(self) -> str|None:
+        """
+        生成一行打包统计，没有发送过打包请求时返回None
+        """
+        if not self.requests:
+            return None
+        summary = f"打包: {self.requests} 次请求处理了 {self.packed_pages} 页"
+        if self.fallback_pages:
+            summary += f"，{self.fallback_pages} 页无法拆分，改为单页请求"
+        return summary
+
+
+# 命令行参数设置的每次请求最多打包页数，优先于环境变量
+_configured_pages = None
+
+
+def configure_packing(max_pages: int|None):
+    """
+    设置每次请求最多打包的页数（覆盖环境变量PACK_PAGES），1表示关闭打包
+
+    Args:
+        max_pages: 每次请求最多打包的页数，None表示使用环境变量
+    """
+    global _configured_pages
+    _configured_pages = max_pages
+
+
+def get_page_packer(api_key: str|None, max_pages: int|None = None) -> PagePacker|None:
+    """
+    按配置为一个文档创建多页打包器
+
+    环境变量:
+        PACK_PAGES: 每次请求最多打包的页数（默认为1，即不打包）
+        PACK_MAX_TOKENS: 每次请求中图像的预估token数上限（默认为满幅图像的4倍）
+        PACK_LINGER: 批次中第一页最多等待其他页面的秒数（默认为0.2）
+        PACK_MODE: bundle（多张图像放在同一请求中，默认）或tile（拼接成一张图像）
+
+    Args:
+        api_key: OpenAI API密钥
+        max_pages: 每次请求最多打包的页数，None表示使用configure_packing的设置或环境变量
+
+    Returns:
+        PagePacker实例，未开启打包时返回None
+    """
+    if max_pages is None:
+        max_pages = _configured_pages if _configured_pages is not None else int(os.environ.get("PACK_PAGES", 1))
+    if max_pages <= 1:
+        return None
+    return PagePacker(
+        api_key,
+        max_pages,
+        int(os.environ.get("PACK_MAX_TOKENS", ESTIMATED_IMAGE_TOKENS * 4)),
+        float(os.environ.get("PACK_LINGER", 0.2)),
+        os.environ.get("PACK_MODE", "bundle").lower()
+    )
@@ -1,142 +1,301 @@
 import os
-import sys
+import io
+import json
+import asyncio
 import argparse
-from pathlib import Path
+import threading
 import tempfile
-import fitz  # PyMuPDF
-import concurrent.futures
 import imghdr
-from queue import Queue
-from tqdm import tqdm
-from vision_api import process_pdf_page
+from typing import TYPE_CHECKING
+from vision_api import process_pdf_page_async, check_repetition, get_stream_stats, ImageInput
+from async_engine import RequestScheduler, DocumentJob, run_jobs, run_sync
+from page_cache import get_page_cache
+from checkpoint import CheckpointJournal
+from markdown_writer import OrderedMarkdownWriter
+from render_pool import prepare_loaded_page, DocumentRenderer, get_render_pool, get_render_ahead
+from render_policy import RenderStats
+from page_filter import image_signature, content_digest, get_duplicate_index, get_filter_stats, FilterStats
+from page_packer import get_page_packer, configure_packing
+from metrics import get_run_metrics
 from dotenv import load_dotenv
-from pptx import Presentation
+
+if TYPE_CHECKING:
+    from page_packer import PagePacker
 
 # 加载环境变量
 load_dotenv()
 
+# PyMuPDF、python-pptx和tqdm导入较慢，只在第一次处理对应类型的文件（或使用对应功能）时才导入，
+# 例如转换单张图片时不会导入PyMuPDF和python-pptx
+
+
+def read_image_bytes(image: ImageInput) -> bytes:
+    """
+    将各种形式的图像输入统一读取为字节，文件只读取一次，缓存键和请求共用同一份数据
+    
+    Args:
+        image: 图像文件路径、内存中的图像字节或二进制文件对象
+        
+    Returns:
+        图像字节
+    """
+    if isinstance(image, (str, os.PathLike)):
+        with open(image, "rb") as image_file:
+            return image_file.read()
+    if hasattr(image, "read"):
+        return image.read()
+    return bytes(image)
+
+
+async def process_image_cached_async(image: ImageInput, api_key: str|None = None, packer: "PagePacker|None" = None) -> str:
+    """
+    先查询页面缓存，未命中时再调用视觉模型处理图像并写回缓存；可以与其他页面打包为一次请求
+    
+    Args:
+        image: 图像文件路径、内存中的图像字节或二进制文件对象
+        api_key: OpenAI API密钥
+        packer: 多页打包器，None表示单页请求
+        
+    Returns:
+        视觉模型的文本输出
+    """
+    cache = get_page_cache()
+    if not cache.enabled and packer is None:
+        return check_repetition(await process_pdf_page_async(image, api_key))
+
+    image = read_image_bytes(image)
+    # 单页请求的结果在任何模式下都可以复用；打包请求拆出的结果只在同一打包方式下复用
+    cache_keys = {}
+    if cache.enabled:
+        with get_run_metrics().stage("cache"):
+            cache_keys[None] = cache.make_key(image)
+            if packer is not None:
+                cache_keys[packer.mode] = cache.make_key(image, f"packed-{packer.mode}")
+            for cache_key in cache_keys.values():
+                cached_text = await cache.get_async(cache_key)
+                if cached_text is not None:
+                    return cached_text
+
+    # 打包请求无法拆分出本页结果时改为单页请求
+    image_text = None
+    mode = None
+    if packer is not None:
+        image_text = await packer.process(image)
+        mode = packer.mode if image_text is not None else None
+    if image_text is None:
+        image_text = await process_pdf_page_async(image, api_key)
+    # 退化为连续重复的输出按可重试错误处理，不写入缓存
+    check_repetition(image_text)
+    if mode in cache_keys:
+        await cache.put_async(cache_keys[mode], image_text)
+    return image_text
+
+
+def prepare_page(page_data):
+    """
+    按需加载PDF页面，完成路由分析和渲染，页面对象用完即释放
+    
+    PyMuPDF不支持多个线程同时操作同一个文档，所以同一文档的加载、分析和渲染
+    都在该文档的锁内串行进行；不同文档之间互不影响。
+    
+    Args:
+        page_data: 包含页面处理所需数据的字典
+        
+    Returns:
+        同render_pool.prepare_loaded_page
+    """
+    with page_data['document_lock']:
+        # 任务取消后文档可能已经关闭，排队中的渲染不再加载页面
+        if page_data['document'].is_closed:
+            raise RuntimeError("PDF文件已关闭")
+        page = page_data['document'].load_page(page_data['page_num'])
+        # 按渲染策略将页面直接渲染到内存中，不经过临时文件
+        return prepare_loaded_page(page, page_data.get('hybrid', False))
+
 
-def process_single_page(page_data):
+async def process_single_page_async(page_data):
     """
-    处理单个PDF页面
+    处理单个PDF页面：渲染在进程池（或线程）中进行，等待API响应时不占用线程
     
     Args:
         page_data: 包含页面处理所需数据的字典
         
     Returns:
-        包含页码和处理结果的元组
+        包含页码、处理结果、路由说明和渲染参数（本地文本层转换时为None）的元组
     """
     page_num = page_data['page_num']
-    page = page_data['page']
-    temp_dir = page_data['temp_dir']
     api_key = page_data['api_key']
-    total_pages = page_data['total_pages']
     
-    # print(f"处理第 {page_num + 1} 页，共 {total_pages} 页...")
+    # 加载和渲染是CPU密集操作：有渲染进程池时取预渲染结果，否则放到线程中执行
+    renderer = page_data.get('renderer')
+    with get_run_metrics().stage("render"):
+        if renderer is not None:
+            route, page_markdown, image_bytes, render_info = await renderer.get(page_num)
+        else:
+            route, page_markdown, image_bytes, render_info = await asyncio.to_thread(prepare_page, page_data)
+    if page_markdown is not None:
+        return page_num, f"\n\n{page_markdown}\n\n", route, render_info
     
-    # 将页面渲染为图像
-    image_path = os.path.join(temp_dir, f"page_{page_num + 1}.png")
-    pix = page.get_pixmap()
-    pix.save(image_path)
+    # 与前面某页相同（或开启近似重复时与其近似）时直接复用该页的结果
+    duplicates = page_data.get('duplicates')
+    if duplicates is not None:
+        reused = await duplicates.reuse(page_num, render_info['digest'], render_info['phash'])
+        if reused is not None:
+            original_num, page_text = reused
+            duplicates.resolve(page_num, page_text)
+            render_info = dict(render_info, duplicate_of=original_num)
+            return page_num, f"\n\n{page_text}\n\n", f"重复页面（复用第 {original_num + 1} 页）", render_info
     
-    # 调用OpenAI视觉模型处理图像
-    page_text = process_pdf_page(image_path, api_key)
+    # 调用OpenAI视觉模型处理图像（优先使用缓存结果，开启打包时与其他页面合并请求）
+    page_text = await process_image_cached_async(image_bytes, api_key, page_data.get('packer'))
+    if duplicates is not None:
+        duplicates.resolve(page_num, page_text)
     
-    # 返回页码和处理结果
-    return page_num, f"\n\n{page_text}\n\n"
+    # 返回页码、处理结果、路由说明和渲染参数
+    return page_num, f"\n\n{page_text}\n\n", route, render_info
 
 
-def process_single_slide(slide_data):
+def render_slide(slide_data):
     """
-    处理单个PPT幻灯片
+    将单个PPT幻灯片渲染为图像
+    
+    使用整个演示文稿共享的导出结果（LibreOffice或PowerPoint，只导出一次），
+    两者都不可用时用PIL绘制幻灯片中的文本作为替代图像。
     
     Args:
         slide_data: 包含幻灯片处理所需数据的字典
         
     Returns:
-        包含幻灯片编号和处理结果的元组
+        (图像, 渲染参数) 元组：图像为内存中的字节或导出的图像路径，
+        渲染参数只有经PDF渲染时才有，其余情况为None
     """
     slide_num = slide_data['slide_num']
     slide = slide_data['slide']
-    temp_dir = slide_data['temp_dir']
-    api_key = slide_data['api_key']
-    total_slides = slide_data['total_slides']
     
-    # 将幻灯片渲染为图像
-    image_path = os.path.join(temp_dir, f"slide_{slide_num + 1}.png")
+    rendered = slide_data['deck'].render(slide_num)
+    if rendered is not None:
+        return rendered
+    
+    # 备用方法：使用PIL创建包含幻灯片文本的图像
+    from PIL import Image, ImageDraw, ImageFont
+    
+    img = Image.new('RGB', (960, 720), color='white')
+    draw = ImageDraw.Draw(img)
+    
+    # 获取幻灯片中的文本
+    slide_text = ""
+    for shape in slide.shapes:
+        if hasattr(shape, "text"):
+            slide_text += shape.text + "\n"
     
-    # 尝试使用win32com导出幻灯片（仅Windows）
+    # 在图像上绘制文本
     try:
-        import win32com.client
-        import pythoncom
-        
-        # 尝试初始化COM（如果尚未初始化）
-        try:
-            pythoncom.CoInitialize()
-        except Exception:
-            pass  # COM可能已经初始化，忽略错误
-        
-        powerpoint = win32com.client.Dispatch("PowerPoint.Application")
-        powerpoint.Visible = False
-        
-        presentation = powerpoint.Presentations.Open(os.path.abspath(slide_data['ppt_path']))
-        presentation.Slides[slide_num + 1].Export(image_path, "PNG")
-        
-        presentation.Close()
-        powerpoint.Quit()
-        
-        # 反初始化COM
-        try:
-            pythoncom.CoUninitialize()
-        except Exception:
-            pass
-        
-    except Exception:
-        # 备用方法：使用PIL创建包含幻灯片文本的图像
-        from PIL import Image, ImageDraw, ImageFont
-        
-        img = Image.new('RGB', (960, 720), color='white')
-        draw = ImageDraw.Draw(img)
-        
-        # 获取幻灯片中的文本
-        slide_text = ""
-        for shape in slide.shapes:
-            if hasattr(shape, "text"):
-                slide_text += shape.text + "\n"
+        font = ImageFont.truetype("arial.ttf", 20)
+    except:
+        font = ImageFont.load_default()
+    
+    y_offset = 50
+    for line in slide_text.split('\n')[:20]:
+        draw.text((50, y_offset), line, fill='black', font=font)
+        y_offset += 30
+    
+    # 备用图像直接编码到内存，不写入临时文件
+    buffer = io.BytesIO()
+    img.save(buffer, format="PNG")
+    return buffer.getvalue(), None
+
+
+def prepare_slide(slide_data):
+    """
+    对幻灯片做路由并渲染
+    
+    混合模式下，只由文本框、占位符和表格组成的幻灯片直接从形状生成Markdown，
+    含有图片、图表或图示的幻灯片才渲染为图像。
+    
+    Args:
+        slide_data: 包含幻灯片处理所需数据的字典
         
-        # 在图像上绘制文本
-        try:
-            font = ImageFont.truetype("arial.ttf", 20)
-        except:
-            font = ImageFont.load_default()
+    Returns:
+        同render_pool.prepare_loaded_page；渲染参数至少包含blank和phash，非空白页还有digest
+    """
+    if slide_data.get('hybrid', False):
+        from ppt_render import slide_to_markdown
         
-        y_offset = 50
-        for line in slide_text.split('\n')[:20]:
-            draw.text((50, y_offset), line, fill='black', font=font)
-            y_offset += 30
+        slide_markdown = slide_to_markdown(slide_data['slide'])
+        if slide_markdown is not None:
+            return "本地形状（无图片）", slide_markdown, None, None
+    
+    image, render_info = render_slide(slide_data)
+    if render_info is None:
+        blank, phash = image_signature(image)
+        # 替代图像或导出的图像没有文本层，有文字的幻灯片同样不判为空白
+        if blank and any(getattr(shape, "text", "").strip() for shape in slide_data['slide'].shapes):
+            blank = False
+        render_info = {"blank": blank, "phash": phash}
+        if not blank:
+            render_info["digest"] = content_digest(read_image_bytes(image))
+    if render_info["blank"]:
+        return "空白页（跳过）", "", None, render_info
+    
+    method = slide_data['deck'].method
+    route = f"视觉模型（{method}导出）" if method else "视觉模型（文本替代图像）"
+    return route, None, image, render_info
+
+
+async def process_single_slide_async(slide_data):
+    """
+    处理单个PPT幻灯片
+    
+    Args:
+        slide_data: 包含幻灯片处理所需数据的字典
         
-        img.save(image_path)
+    Returns:
+        包含幻灯片编号、处理结果、路由说明和渲染参数（复用结果时还有duplicate_of）的元组
+    """
+    slide_num = slide_data['slide_num']
+    api_key = slide_data['api_key']
+    
+    # 第一次渲染会导出整个演示文稿，渲染和签名计算都放到线程中执行
+    with get_run_metrics().stage("render"):
+        route, slide_markdown, image, render_info = await asyncio.to_thread(prepare_slide, slide_data)
+    if slide_markdown is not None:
+        return slide_num, f"\n\n{slide_markdown}\n\n", route, render_info
     
-    # 调用OpenAI视觉模型处理图像
-    slide_text = process_pdf_page(image_path, api_key)
+    # 与前面某张幻灯片相同（或开启近似重复时与其近似，例如逐条出现的动画页）时直接复用其结果
+    duplicates = slide_data.get('duplicates')
+    if duplicates is not None:
+        reused = await duplicates.reuse(slide_num, render_info['digest'], render_info['phash'])
+        if reused is not None:
+            original_num, slide_text = reused
+            duplicates.resolve(slide_num, slide_text)
+            render_info = dict(render_info, duplicate_of=original_num)
+            return slide_num, f"\n\n{slide_text}\n\n", f"重复幻灯片（复用第 {original_num + 1} 张）", render_info
     
-    # 返回幻灯片编号和处理结果
-    return slide_num, f"\n\n{slide_text}\n\n"
+    # 调用OpenAI视觉模型处理图像（优先使用缓存结果，开启打包时与其他幻灯片合并请求）
+    slide_text = await process_image_cached_async(image, api_key, slide_data.get('packer'))
+    if duplicates is not None:
+        duplicates.resolve(slide_num, slide_text)
+    
+    # 返回幻灯片编号、处理结果、路由说明和渲染参数
+    return slide_num, f"\n\n{slide_text}\n\n", route, render_info
 
 
-def process_image_file(image_path: str, output_path: str|None = None, api_key: str|None = None):
+def open_image_job(image_path: str, output_path: str|None = None, api_key: str|None = None) -> DocumentJob|None:
     """
-    将图片文件转换为Markdown格式
+    创建图片文件的转换任务
     
     Args:
         image_path: 图片文件路径
         output_path: 输出的Markdown文件路径，如果为None则使用图片文件名
         api_key: OpenAI API密钥
+        
+    Returns:
+        DocumentJob，图片文件不存在时返回None
     """
     # 检查图片文件是否存在
     if not os.path.exists(image_path):
         print(f"错误：图片文件 '{image_path}' 不存在")
-        return
+        return None
     
     # 如果未指定输出路径，则使用图片文件名
     if output_path is None:
@@ -144,218 +303,450 @@ def process_image_file(image_path: str, output_path: str|None = None, api_key: s
     
     print(f"处理图片文件: {image_path}...")
     
-    # 调用OpenAI视觉模型处理图像
-    image_text = process_pdf_page(image_path, api_key)
+    async def handler(task):
+        # 调用OpenAI视觉模型处理图像（优先使用缓存结果）
+        return await process_image_cached_async(image_path, api_key)
     
-    # 写入Markdown文件
-    with open(output_path, "w", encoding="utf-8") as md_file:
-        md_file.write(f"\n\n{image_text}\n\n")
+    def finalize(results, failures):
+        write_failure_report(output_path, [(1, error, attempts) for _, error, attempts in failures])
+        if failures:
+            return
+        
+        # 写入Markdown文件
+        with open(output_path, "w", encoding="utf-8") as md_file:
+            md_file.write(f"\n\n{results[0]}\n\n")
+        
+        print(f"转换完成！Markdown文件已保存到: {output_path}")
     
-    print(f"转换完成！Markdown文件已保存到: {output_path}")
+    return DocumentJob(
+        image_path,
+        [image_path],
+        handler,
+        finalize,
+        on_error=lambda task, e, delay: print(f"{str(e)}，{delay:.1f}秒后重试该图片 {image_path}")
+    )
 
 
-def convert_pdf_to_markdown(pdf_path: str, output_path: str|None = None, api_key: str|None = None, max_workers: int|None = None):
+def process_image_file(image_path: str, output_path: str|None = None, api_key: str|None = None):
     """
-    将PDF文件转换为Markdown格式
+    将图片文件转换为Markdown格式
+    
+    Args:
+        image_path: 图片文件路径
+        output_path: 输出的Markdown文件路径，如果为None则使用图片文件名
+        api_key: OpenAI API密钥
+    """
+    run_sync(run_jobs([open_image_job(image_path, output_path, api_key)], RequestScheduler(1)))
+
+
+def failed_page_placeholder(page_num: int, error: Exception) -> str:
+    """
+    为重试耗尽的页面生成Markdown注释占位，避免错误信息混入正文
+    
+    Args:
+        page_num: 从0开始的页码
+        error: 最后一次的异常
+        
+    Returns:
+        HTML注释形式的占位文本
+    """
+    return f"\n\n<!-- 第 {page_num + 1} 页转换失败: {type(error).__name__} -->\n\n"
+
+
+def write_failure_report(output_path: str, failures: list):
+    """
+    将重试耗尽的页面写入失败页面报告（<输出文件>.failed.json）并打印；
+    没有失败页面时删除旧报告
+    
+    Args:
+        output_path: 输出的Markdown文件路径
+        failures: (从1开始的页码, 异常, 尝试次数) 列表
+    """
+    report_path = output_path + ".failed.json"
+    if not failures:
+        if os.path.exists(report_path):
+            os.remove(report_path)
+        return
+    
+    report = []
+    for page_num, error, attempts in sorted(failures, key=lambda item: item[0]):
+        report.append({
+            'page': page_num,
+            'error_type': type(error).__name__,
+            'status_code': getattr(error, 'status_code', None),
+            'attempts': attempts,
+            'error': str(error),
+        })
+    with open(report_path, "w", encoding="utf-8") as report_file:
+        json.dump(report, report_file, ensure_ascii=False, indent=2)
+    
+    print(f"有 {len(report)} 页转换失败 [{format_page_ranges([item['page'] for item in report])}]，失败页面报告已保存到: {report_path}")
+
+
+def format_page_ranges(page_nums) -> str:
+    """
+    将页码列表压缩为区间表示，例如 [1, 2, 3, 5] -> "1-3, 5"
+    
+    Args:
+        page_nums: 从1开始的页码列表
+        
+    Returns:
+        区间字符串
+    """
+    ranges = []
+    for num in sorted(page_nums):
+        if ranges and num == ranges[-1][1] + 1:
+            ranges[-1][1] = num
+        else:
+            ranges.append([num, num])
+    return ", ".join(str(start) if start == end else f"{start}-{end}" for start, end in ranges)
+
+
+def print_route_summary(routes: dict):
+    """
+    打印每种路由决策对应的页面
+    
+    Args:
+        routes: 页码（从0开始）到路由说明的映射
+    """
+    pages_by_route = {}
+    for page_num, route in routes.items():
+        pages_by_route.setdefault(route, []).append(page_num + 1)
+    print("页面路由:")
+    for route, page_nums in sorted(pages_by_route.items(), key=lambda item: min(item[1])):
+        print(f"  {route}: {len(page_nums)} 页 [{format_page_ranges(page_nums)}]")
+
+
+def open_pdf_job(pdf_path: str, output_path: str|None = None, api_key: str|None = None, hybrid: bool = False, resume: bool = False) -> DocumentJob|None:
+    """
+    打开PDF文件并创建转换任务
     
     Args:
         pdf_path: PDF文件路径
         output_path: 输出的Markdown文件路径，如果为None则使用PDF文件名
         api_key: OpenAI API密钥
-        max_workers: 最大并发线程数，如果为None则从环境变量获取
+        hybrid: 是否启用混合模式，纯文本页面直接从PDF文本层转换，不调用视觉模型
+        resume: 是否从检查点日志恢复，只处理上次未完成的页面
+        
+    Returns:
+        DocumentJob，文件不存在或无法打开时返回None
     """
-    # 如果未指定max_workers，则从环境变量获取，默认为5
-    if max_workers is None:
-        max_workers = int(os.environ.get("MAX_WORKERS", 5))
-
     # 检查PDF文件是否存在
     if not os.path.exists(pdf_path):
         print(f"错误：PDF文件 '{pdf_path}' 不存在")
-        return
+        return None
 
     # 如果未指定输出路径，则使用PDF文件名
     if output_path is None:
         output_path = os.path.splitext(pdf_path)[0] + ".md"
     # 打开PDF文件
+    import fitz  # PyMuPDF
+    
     try:
         pdf_document = fitz.open(pdf_path)
     except Exception as e:
         print(f"打开PDF文件时出错: {str(e)}")
-        return
+        return None
+
+    # 每完成一页就追加到检查点日志，恢复时跳过已完成的页面
+    journal = CheckpointJournal(output_path, pdf_path)
+    completed = journal.open(resume)
+    if completed:
+        print(f"从检查点恢复 {len(completed)} 页，剩余 {pdf_document.page_count - len(completed)} 页: {pdf_path}")
+
+    # 准备未完成页面的任务：任务只记录页码，页面在处理时才加载（直接在内存中渲染，无需临时目录）
+    total_pages = len(pdf_document)
+    document_lock = threading.Lock()
+    # 空白页在渲染时跳过，重复的页面复用前面页面的结果
+    duplicates = get_duplicate_index()
+    filter_stats = FilterStats(get_filter_stats())
+    # 开启打包时，多个较小的页面合并为一次视觉模型请求
+    packer = get_page_packer(api_key)
+    page_tasks = []
+    for page_num in range(pdf_document.page_count):
+        if page_num in completed:
+            continue
+        page_tasks.append({
+            'page_num': page_num,
+            'document': pdf_document,
+            'document_lock': document_lock,
+            'api_key': api_key,
+            'total_pages': total_pages,
+            'hybrid': hybrid,
+            'duplicates': duplicates,
+            'packer': packer
+        })
+
+    # 渲染阶段与网络请求阶段分离：页面在进程池中提前渲染，最多领先已分配页面RENDER_AHEAD页
+    render_pool = get_render_pool()
+    renderer = None
+    if render_pool is not None:
+        renderer = DocumentRenderer(pdf_path, [task['page_num'] for task in page_tasks], hybrid, render_pool, get_render_ahead())
+        for task in page_tasks:
+            task['renderer'] = renderer
+
+    # 页面按顺序流式写入输出文件，已恢复的页面先放入重排缓冲
+    writer = OrderedMarkdownWriter(output_path, total_pages)
+    routes = {}
+    render_stats = RenderStats()
+    for page_num, (page_content, route) in completed.items():
+        writer.put(page_num, page_content)
+        routes[page_num] = route
+
+    async def handler(task):
+        page_num, page_content, route, render_info = await process_single_page_async(task)
+        if renderer is not None:
+            renderer.release(page_num)
+        journal.record(page_num, page_content, route)
+        writer.put(page_num, page_content)
+        routes[page_num] = route
+        render_stats.add(page_num, render_info)
+        filter_stats.record(render_info)
+        return page_num
+
+    def on_failure(task, error, attempts):
+        if renderer is not None:
+            renderer.release(task['page_num'])
+        if duplicates is not None:
+            duplicates.resolve(task['page_num'], None)
+        # 失败页面在原位置留下注释，详细信息写入失败页面报告
+        writer.put(task['page_num'], failed_page_placeholder(task['page_num'], error))
+
+    async def admit(task):
+        await writer.wait_for_slot(task['page_num'])
+        if renderer is not None:
+            renderer.admit(task['page_num'])
+
+    def finalize(page_results, failures):
+        write_failure_report(output_path, [(task['page_num'] + 1, error, attempts) for task, error, attempts in failures])
+
+        # 关闭PDF文件和输出文件；全部页面成功时删除检查点日志，否则保留供--resume使用
+        if renderer is not None:
+            renderer.close()
+        # 任务取消时可能还有页面在线程中渲染，在文档锁内关闭，等正在进行的渲染结束
+        with document_lock:
+            pdf_document.close()
+        writer.close()
+        journal.close(remove=not failures)
+
+        if hybrid:
+            print_route_summary(routes)
+        for summary in (render_stats.summary(), filter_stats.summary(), packer and packer.summary()):
+            if summary:
+                print(summary)
+        print(f"转换完成！Markdown文件已保存到: {output_path}")
 
-    # 创建临时目录存储页面图像
-    with tempfile.TemporaryDirectory() as temp_dir:
-        total_pages = len(pdf_document)
-        page_tasks = Queue()
-        for page_num in range(pdf_document.page_count):
-            page = pdf_document.load_page(page_num)
-            page_tasks.put({
-                'page_num': page_num,
-                'page': page,
-                'temp_dir': temp_dir,
-                'api_key': api_key,
-                'total_pages': total_pages
-            })
-
-        results = []
-        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
-            future_to_page = {}
-            while not page_tasks.empty() and len(future_to_page) < max_workers:
-                task = page_tasks.get()
-                future = executor.submit(process_single_page, task)
-                future_to_page[future] = task
-
-            processed_success = 0
-            with tqdm(total=total_pages, desc="页面处理进度", unit="页") as pbar:
-                while processed_success < total_pages:
-                    while not page_tasks.empty() and len(future_to_page) < max_workers:
-                        task = page_tasks.get()
-                        future = executor.submit(process_single_page, task)
-                        future_to_page[future] = task
-
-                    if not future_to_page and page_tasks.empty():
-                        break
-
-                    for future in concurrent.futures.as_completed(list(future_to_page.keys())):
-                        task = future_to_page.pop(future)
-                        try:
-                            page_num, page_content = future.result()
-                            results.append((page_num, page_content))
-                            processed_success += 1
-                            pbar.update(1)
-                        except Exception as e:
-                            print(f"处理页面时出错: {str(e)}，正在重试该页面 {task['page_num'] + 1}")
-                            page_tasks.put(task)
-
-                        while not page_tasks.empty() and len(future_to_page) < max_workers:
-                            next_task = page_tasks.get()
-                            next_future = executor.submit(process_single_page, next_task)
-                            future_to_page[next_future] = next_task
-        
-        # 按页码顺序组装Markdown内容
-        results.sort(key=lambda x: x[0])  # 按页码排序
-        markdown_content = ""
-        for _, content in results:
-            markdown_content += content
+    return DocumentJob(
+        pdf_path,
+        page_tasks,
+        handler,
+        finalize,
+        on_error=lambda task, e, delay: print(f"{str(e)}，{delay:.1f}秒后重试第 {task['page_num'] + 1} 页"),
+        on_failure=on_failure,
+        admit=admit,
+        page_number=lambda task: task['page_num']
+    )
 
-        # 关闭PDF文件
-        pdf_document.close()
 
-        # 写入Markdown文件
-        with open(output_path, "w", encoding="utf-8") as md_file:
-            md_file.write(markdown_content)
+async def convert_pdf_to_markdown_async(pdf_path: str, output_path: str|None = None, api_key: str|None = None, max_workers: int|None = None, hybrid: bool = False, resume: bool = False):
+    """
+    将PDF文件转换为Markdown格式（异步版本，可在已有的事件循环中调用）
+    
+    Args:
+        pdf_path: PDF文件路径
+        output_path: 输出的Markdown文件路径，如果为None则使用PDF文件名
+        api_key: OpenAI API密钥
+        max_workers: 最大并发请求数，如果为None则从环境变量获取
+        hybrid: 是否启用混合模式，纯文本页面直接从PDF文本层转换，不调用视觉模型
+        resume: 是否从检查点日志恢复，只处理上次未完成的页面
+    """
+    job = open_pdf_job(pdf_path, output_path, api_key, hybrid, resume)
+    if job is not None:
+        await run_document_jobs([job], max_workers)
 
-        print(f"转换完成！Markdown文件已保存到: {output_path}")
 
+def convert_pdf_to_markdown(pdf_path: str, output_path: str|None = None, api_key: str|None = None, max_workers: int|None = None, hybrid: bool = False, resume: bool = False):
+    """
+    将PDF文件转换为Markdown格式
+    
+    Args:
+        pdf_path: PDF文件路径
+        output_path: 输出的Markdown文件路径，如果为None则使用PDF文件名
+        api_key: OpenAI API密钥
+        max_workers: 最大并发请求数，如果为None则从环境变量获取
+        hybrid: 是否启用混合模式，纯文本页面直接从PDF文本层转换，不调用视觉模型
+        resume: 是否从检查点日志恢复，只处理上次未完成的页面
+    """
+    run_sync(convert_pdf_to_markdown_async(pdf_path, output_path, api_key, max_workers, hybrid, resume))
 
-def convert_ppt_to_markdown(ppt_path: str, output_path: str|None = None, api_key: str|None = None, max_workers: int|None = None):
+
+def open_ppt_job(ppt_path: str, output_path: str|None = None, api_key: str|None = None, hybrid: bool = False, resume: bool = False) -> DocumentJob|None:
     """
-    将PPT/PPTX文件转换为Markdown格式
+    打开PPT/PPTX文件并创建转换任务
     
     Args:
         ppt_path: PPT/PPTX文件路径
         output_path: 输出的Markdown文件路径，如果为None则使用PPT文件名
         api_key: OpenAI API密钥
-        max_workers: 最大并发线程数，如果为None则从环境变量获取
+        hybrid: 是否启用混合模式，没有图片和图示的幻灯片直接从形状转换，不调用视觉模型
+        resume: 是否从检查点日志恢复，只处理上次未完成的幻灯片
+        
+    Returns:
+        DocumentJob，文件不存在或无法打开时返回None
     """
-    # 如果未指定max_workers，则从环境变量获取，默认为5
-    if max_workers is None:
-        max_workers = int(os.environ.get("MAX_WORKERS", 5))
-
     # 检查PPT文件是否存在
     if not os.path.exists(ppt_path):
         print(f"错误：PPT文件 '{ppt_path}' 不存在")
-        return
+        return None
 
     # 如果未指定输出路径，则使用PPT文件名
     if output_path is None:
         output_path = os.path.splitext(ppt_path)[0] + ".md"
     
     # 打开PPT文件
+    from pptx import Presentation
+    from ppt_render import DeckRenderer, hidden_slide_flags
+    
     try:
         presentation = Presentation(ppt_path)
     except Exception as e:
         print(f"打开PPT文件时出错: {str(e)}")
-        return
+        return None
+
+    # 每完成一张幻灯片就追加到检查点日志，恢复时跳过已完成的幻灯片
+    journal = CheckpointJournal(output_path, ppt_path)
+    completed = journal.open(resume)
+    total_slides = len(presentation.slides)
+    if completed:
+        print(f"从检查点恢复 {len(completed)} 张幻灯片，剩余 {total_slides - len(completed)} 张: {ppt_path}")
+
+    # 创建临时目录存储整个演示文稿的导出结果，文档完成时清理；第一次需要图像时才导出
+    temp_dir = tempfile.TemporaryDirectory()
+    deck = DeckRenderer(ppt_path, temp_dir.name, hidden_slide_flags(presentation))
+    # 空白幻灯片直接跳过，重复的幻灯片复用前面幻灯片的结果
+    duplicates = get_duplicate_index()
+    filter_stats = FilterStats(get_filter_stats())
+    # 开启打包时，多张幻灯片合并为一次视觉模型请求
+    packer = get_page_packer(api_key)
+    slide_tasks = []
+    
+    # 准备未完成幻灯片的任务
+    for slide_num, slide in enumerate(presentation.slides):
+        if slide_num in completed:
+            continue
+        slide_tasks.append({
+            'slide_num': slide_num,
+            'slide': slide,
+            'deck': deck,
+            'api_key': api_key,
+            'total_slides': total_slides,
+            'ppt_path': ppt_path,
+            'hybrid': hybrid,
+            'duplicates': duplicates,
+            'packer': packer
+        })
+
+    # 幻灯片按顺序流式写入输出文件，已恢复的幻灯片先放入重排缓冲
+    writer = OrderedMarkdownWriter(output_path, total_slides)
+    routes = {}
+    render_stats = RenderStats()
+    for slide_num, (slide_content, route) in completed.items():
+        writer.put(slide_num, slide_content)
+        routes[slide_num] = route
+
+    async def handler(task):
+        slide_num, slide_content, route, render_info = await process_single_slide_async(task)
+        journal.record(slide_num, slide_content, route)
+        writer.put(slide_num, slide_content)
+        routes[slide_num] = route
+        render_stats.add(slide_num, render_info)
+        filter_stats.record(render_info)
+        return slide_num
+
+    def on_failure(task, error, attempts):
+        if duplicates is not None:
+            duplicates.resolve(task['slide_num'], None)
+        # 失败幻灯片在原位置留下注释，详细信息写入失败页面报告
+        writer.put(task['slide_num'], failed_page_placeholder(task['slide_num'], error))
+
+    def finalize(results, failures):
+        deck.close()
+        temp_dir.cleanup()
+        write_failure_report(output_path, [(task['slide_num'] + 1, error, attempts) for task, error, attempts in failures])
+
+        # 关闭输出文件；全部幻灯片成功时删除检查点日志，否则保留供--resume使用
+        writer.close()
+        journal.close(remove=not failures)
+
+        if hybrid:
+            print_route_summary(routes)
+        for summary in (render_stats.summary(), filter_stats.summary(), packer and packer.summary()):
+            if summary:
+                print(summary)
+        print(f"转换完成！Markdown文件已保存到: {output_path}")
 
-    # 创建临时目录存储幻灯片图像
-    with tempfile.TemporaryDirectory() as temp_dir:
-        total_slides = len(presentation.slides)
-        slide_tasks = Queue()
-        
-        # 准备所有幻灯片任务
-        for slide_num, slide in enumerate(presentation.slides):
-            slide_tasks.put({
-                'slide_num': slide_num,
-                'slide': slide,
-                'temp_dir': temp_dir,
-                'api_key': api_key,
-                'total_slides': total_slides,
-                'ppt_path': ppt_path
-            })
-
-        results = []
-        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
-            future_to_slide = {}
-            while not slide_tasks.empty() and len(future_to_slide) < max_workers:
-                task = slide_tasks.get()
-                future = executor.submit(process_single_slide, task)
-                future_to_slide[future] = task
-
-            processed_success = 0
-            with tqdm(total=total_slides, desc="幻灯片处理进度", unit="页") as pbar:
-                while processed_success < total_slides:
-                    while not slide_tasks.empty() and len(future_to_slide) < max_workers:
-                        task = slide_tasks.get()
-                        future = executor.submit(process_single_slide, task)
-                        future_to_slide[future] = task
-
-                    if not future_to_slide and slide_tasks.empty():
-                        break
-
-                    for future in concurrent.futures.as_completed(list(future_to_slide.keys())):
-                        task = future_to_slide.pop(future)
-                        try:
-                            slide_num, slide_content = future.result()
-                            results.append((slide_num, slide_content))
-                            processed_success += 1
-                            pbar.update(1)
-                        except Exception as e:
-                            print(f"处理幻灯片时出错: {str(e)}，正在重试该幻灯片 {task['slide_num'] + 1}")
-                            slide_tasks.put(task)
-
-                        while not slide_tasks.empty() and len(future_to_slide) < max_workers:
-                            next_task = slide_tasks.get()
-                            next_future = executor.submit(process_single_slide, next_task)
-                            future_to_slide[next_future] = next_task
-        
-        # 按幻灯片顺序组装Markdown内容
-        results.sort(key=lambda x: x[0])
-        markdown_content = ""
-        for _, content in results:
-            markdown_content += content
+    return DocumentJob(
+        ppt_path,
+        slide_tasks,
+        handler,
+        finalize,
+        on_error=lambda task, e, delay: print(f"{str(e)}，{delay:.1f}秒后重试第 {task['slide_num'] + 1} 张幻灯片"),
+        on_failure=on_failure,
+        admit=lambda task: writer.wait_for_slot(task['slide_num']),
+        page_number=lambda task: task['slide_num']
+    )
 
-        # 写入Markdown文件
-        with open(output_path, "w", encoding="utf-8") as md_file:
-            md_file.write(markdown_content)
 
-        print(f"转换完成！Markdown文件已保存到: {output_path}")
+async def convert_ppt_to_markdown_async(ppt_path: str, output_path: str|None = None, api_key: str|None = None, max_workers: int|None = None, hybrid: bool = False, resume: bool = False):
+    """
+    将PPT/PPTX文件转换为Markdown格式（异步版本，可在已有的事件循环中调用）
+    
+    Args:
+        ppt_path: PPT/PPTX文件路径
+        output_path: 输出的Markdown文件路径，如果为None则使用PPT文件名
+        api_key: OpenAI API密钥
+        max_workers: 最大并发请求数，如果为None则从环境变量获取
+        hybrid: 是否启用混合模式，没有图片和图示的幻灯片直接从形状转换，不调用视觉模型
+        resume: 是否从检查点日志恢复，只处理上次未完成的幻灯片
+    """
+    job = open_ppt_job(ppt_path, output_path, api_key, hybrid, resume)
+    if job is not None:
+        await run_document_jobs([job], max_workers)
 
 
-def process_file(file_path: str, output_path: str|None = None, api_key: str|None = None, max_workers: int|None = None):
+def convert_ppt_to_markdown(ppt_path: str, output_path: str|None = None, api_key: str|None = None, max_workers: int|None = None, hybrid: bool = False, resume: bool = False):
     """
-    处理单个文件（PDF、PPT或图片）
+    将PPT/PPTX文件转换为Markdown格式
+    
+    Args:
+        ppt_path: PPT/PPTX文件路径
+        output_path: 输出的Markdown文件路径，如果为None则使用PPT文件名
+        api_key: OpenAI API密钥
+        max_workers: 最大并发请求数，如果为None则从环境变量获取
+        hybrid: 是否启用混合模式，没有图片和图示的幻灯片直接从形状转换，不调用视觉模型
+        resume: 是否从检查点日志恢复，只处理上次未完成的幻灯片
+    """
+    run_sync(convert_ppt_to_markdown_async(ppt_path, output_path, api_key, max_workers, hybrid, resume))
+
+
+def open_file_job(file_path: str, output_path: str|None = None, api_key: str|None = None, hybrid: bool = False, resume: bool = False) -> DocumentJob|None:
+    """
+    根据文件类型（PDF、PPT或图片）创建转换任务
     
     Args:
         file_path: 文件路径
         output_path: 输出的Markdown文件路径
         api_key: OpenAI API密钥
-        max_workers: 最大并发线程数
+        hybrid: 是否启用混合模式（仅对PDF和PPT文件有效）
+        resume: 是否从检查点日志恢复（仅对PDF和PPT文件有效）
+        
+    Returns:
+        DocumentJob，文件不存在或类型不支持时返回None
     """
     # 检查文件是否存在
     if not os.path.exists(file_path):
         print(f"错误：文件 '{file_path}' 不存在")
-        return
+        return None
     
     # 检测文件类型
     file_ext = os.path.splitext(file_path)[1].lower()
@@ -368,21 +759,86 @@ def process_file(file_path: str, output_path: str|None = None, api_key: str|None
     
     # 根据文件类型调用相应的处理函数
     if file_ext == ".pdf":
-        convert_pdf_to_markdown(file_path, output_path, api_key, max_workers)
+        return open_pdf_job(file_path, output_path, api_key, hybrid, resume)
     elif file_ext in ppt_extensions:
-        convert_ppt_to_markdown(file_path, output_path, api_key, max_workers)
+        return open_ppt_job(file_path, output_path, api_key, hybrid, resume)
     elif file_ext in image_extensions:
-        process_image_file(file_path, output_path, api_key)
+        return open_image_job(file_path, output_path, api_key)
     else:
         # 尝试通过imghdr检测文件类型
         img_type = imghdr.what(file_path)
         if img_type:
-            process_image_file(file_path, output_path, api_key)
+            return open_image_job(file_path, output_path, api_key)
         else:
             print(f"错误：不支持的文件类型 '{file_ext}'")
+            return None
+
+
+async def run_document_jobs(jobs, max_workers: int|None = None):
+    """
+    用一个共享的调度器处理所有文档的页面，每个文档在最后一页完成时立即写出
+    
+    Args:
+        jobs: DocumentJob迭代器（可以是惰性生成器，文档会在需要时才打开）
+        max_workers: 最大并发请求数，如果为None则从环境变量获取
+    """
+    # 如果未指定max_workers，则从环境变量获取，默认为5
+    if max_workers is None:
+        max_workers = int(os.environ.get("MAX_WORKERS", 5))
+    
+    from tqdm import tqdm
+    
+    scheduler = RequestScheduler(max_workers)
+    with tqdm(total=0, desc="页面处理进度", unit="页") as pbar:
+        await run_jobs(jobs, scheduler, pbar)
+
+
+def process_file(file_path: str, output_path: str|None = None, api_key: str|None = None, max_workers: int|None = None, hybrid: bool = False, resume: bool = False):
+    """
+    处理单个文件（PDF、PPT或图片）
+    
+    Args:
+        file_path: 文件路径
+        output_path: 输出的Markdown文件路径
+        api_key: OpenAI API密钥
+        max_workers: 最大并发请求数
+        hybrid: 是否启用混合模式（仅对PDF和PPT文件有效）
+        resume: 是否从检查点日志恢复（仅对PDF和PPT文件有效）
+    """
+    job = open_file_job(file_path, output_path, api_key, hybrid, resume)
+    if job is not None:
+        run_sync(run_document_jobs([job], max_workers))
 
 
-def process_files(file_paths, output_dir=None, api_key=None, max_workers=None):
+async def process_files_async(file_paths, output_dir=None, api_key=None, max_workers=None, hybrid=False, resume=False):
+    """
+    批量处理多个文件（异步版本）
+    
+    所有文件的页面进入同一个全局工作队列，共享一个并发上限，
+    文件按需依次打开，每个文件的最后一页完成后立即写出Markdown文件。
+    
+    Args:
+        file_paths: 文件路径列表
+        output_dir: 输出目录，如果为None则输出到与输入文件相同的目录
+        api_key: OpenAI API密钥
+        max_workers: 最大并发请求数
+        hybrid: 是否启用混合模式（仅对PDF和PPT文件有效）
+        resume: 是否从检查点日志恢复（仅对PDF和PPT文件有效）
+    """
+    def jobs():
+        for file_path in file_paths:
+            # 如果指定了输出目录，则在该目录下创建输出文件
+            output_path = None
+            if output_dir:
+                output_filename = os.path.splitext(os.path.basename(file_path))[0] + ".md"
+                output_path = os.path.join(output_dir, output_filename)
+            
+            yield open_file_job(file_path, output_path, api_key, hybrid, resume)
+    
+    await run_document_jobs(jobs(), max_workers)
+
+
+def process_files(file_paths, output_dir=None, api_key=None, max_workers=None, hybrid=False, resume=False):
     """
     批量处理多个文件
     
@@ -390,31 +846,98 @@ def process_files(file_paths, output_dir=None, api_key=None, max_workers=None):
         file_paths: 文件路径列表
         output_dir: 输出目录，如果为None则输出到与输入文件相同的目录
         api_key: OpenAI API密钥
-        max_workers: 最大并发线程数
-    """
-    for file_path in file_paths:
-        # 如果指定了输出目录，则在该目录下创建输出文件
-        output_path = None
-        if output_dir:
-            output_filename = os.path.splitext(os.path.basename(file_path))[0] + ".md"
-            output_path = os.path.join(output_dir, output_filename)
-        
-        # 处理单个文件
-        process_file(file_path, output_path, api_key, max_workers)
+        max_workers: 最大并发请求数
+        hybrid: 是否启用混合模式（仅对PDF和PPT文件有效）
+        resume: 是否从检查点日志恢复（仅对PDF和PPT文件有效）
+    """
+    run_sync(process_files_async(file_paths, output_dir, api_key, max_workers, hybrid, resume))
+
+
+def save_run_metrics(report_path: str|None = None, prometheus_path: str|None = None):
+    """
+    写出本次运行的JSON报告和Prometheus指标文件（路径为None时跳过）
+    
+    Args:
+        report_path: JSON报告路径
+        prometheus_path: Prometheus文本格式文件路径
+    """
+    metrics = get_run_metrics()
+    if report_path:
+        metrics.write_report(report_path)
+        print(f"运行报告已保存到: {report_path}")
+    if prometheus_path:
+        metrics.write_prometheus(prometheus_path)
 
 
 def main():
     # 解析命令行参数
     parser = argparse.ArgumentParser(description="将PDF、PPT文件或图片转换为Markdown格式")
-    parser.add_argument("file_paths", nargs="+", help="文件路径，支持PDF、PPT/PPTX和常见图片格式（jpg, png等）")
+    parser.add_argument("file_paths", nargs="*", help="文件路径，支持PDF、PPT/PPTX和常见图片格式（jpg, png等）")
     parser.add_argument("-o", "--output-dir", help="输出目录，默认与输入文件相同目录")
     parser.add_argument("-k", "--api-key", help="OpenAI API密钥")
-    parser.add_argument("-w", "--workers", type=int, help="最大并发线程数，仅对PDF和PPT文件有效")
+    parser.add_argument("-w", "--workers", type=int, help="最大并发请求数，仅对PDF和PPT文件有效")
+    parser.add_argument("--hybrid", action="store_true", help="混合模式：PDF中的纯文本页面直接从文本层转换，PPT中没有图片和图示的幻灯片直接从形状转换，其余页面调用视觉模型")
+    parser.add_argument("--no-cache", action="store_true", help="跳过页面结果缓存，所有页面都重新调用视觉模型")
+    parser.add_argument("--clear-cache", action="store_true", help="清空页面结果缓存")
+    parser.add_argument("--resume", action="store_true", help="从检查点日志（<输出文件>.journal.jsonl）恢复中断的转换，只处理未完成的页面")
+    parser.add_argument("--pack", type=int, metavar="N", help="多页打包：每次视觉模型请求最多包含N个较小的页面或幻灯片（覆盖环境变量PACK_PAGES，1表示关闭）")
+    metrics_group = parser.add_argument_group("运行统计")
+    metrics_group.add_argument("--report", metavar="PATH", help="运行结束时把各阶段耗时的百分位、逐页耗时、重试次数、token用量和费用写入JSON报告")
+    metrics_group.add_argument("--prometheus", metavar="PATH", help="运行结束时把指标写入Prometheus文本格式文件（可供node_exporter的textfile收集器读取）")
+    metrics_group.add_argument("--metrics-port", type=int, metavar="PORT", help="运行期间在 http://127.0.0.1:PORT/metrics 提供Prometheus格式的指标")
+    batch_group = parser.add_argument_group("离线批处理")
+    batch_group.add_argument("--batch-export", metavar="BATCH", help="只渲染页面，把视觉模型请求写入批处理请求文件（JSONL），同时写出<BATCH>.manifest.json清单")
+    batch_group.add_argument("--batch-ingest", nargs="+", metavar=("MANIFEST", "RESULTS"), help="读取清单和批处理结果文件（可以有多个，包括错误文件），组装Markdown输出")
+    batch_group.add_argument("--batch-run", nargs=2, metavar=("BATCH", "RESULTS"), help="批处理接口的本地替身：逐个发送批处理请求文件中的请求并写出结果文件")
 
     args = parser.parse_args()
 
+    cache = get_page_cache()
+    if args.clear_cache:
+        cache.clear()
+        print("页面缓存已清空")
+    if args.no_cache:
+        cache.enabled = False
+    metrics = get_run_metrics()
+    if args.metrics_port:
+        metrics.serve(args.metrics_port)
+
+    # 离线批处理的各个步骤（按需导入）
+    if args.batch_run or args.batch_ingest:
+        from batch_job import run_batch_locally, ingest_batch
+        if args.batch_run:
+            run_batch_locally(args.batch_run[0], args.batch_run[1], args.api_key, args.workers)
+        if args.batch_ingest:
+            if len(args.batch_ingest) < 2:
+                parser.error("--batch-ingest 需要清单文件和至少一个结果文件")
+            ingest_batch(args.batch_ingest[0], args.batch_ingest[1:])
+        save_run_metrics(args.report, args.prometheus)
+        return
+    if not args.file_paths:
+        if not args.clear_cache:
+            parser.error("请至少指定一个文件路径")
+        return
+    if args.batch_export:
+        from batch_job import export_batch
+        export_batch(args.file_paths, args.batch_export, args.output_dir, args.hybrid)
+        return
+    if args.pack is not None:
+        configure_packing(args.pack)
+
     # 调用处理函数
-    process_files(args.file_paths, args.output_dir, args.api_key, args.workers)
+    process_files(args.file_paths, args.output_dir, args.api_key, args.workers, args.hybrid, args.resume)
+
+    filter_summary = get_filter_stats().summary()
+    if filter_summary:
+        print(f"全部文件{filter_summary}")
+    stream_summary = get_stream_stats().summary()
+    if stream_summary:
+        print(stream_summary)
+    if cache.enabled:
+        stats = cache.stats()
+        print(f"页面缓存: 命中 {stats['hits']} 次，未命中 {stats['misses']} 次，"
+              f"共 {stats['entries']} 条（{stats['bytes'] / 1024:.1f} KB）")
+    save_run_metrics(args.report, args.prometheus)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,311 @@
+import os
+import shutil
+import threading
+import subprocess
+from pathlib import Path
+
+import fitz  # PyMuPDF
+from dotenv import load_dotenv
+from pptx.enum.shapes import MSO_SHAPE_TYPE, PP_PLACEHOLDER
+from pptx.shapes.graphfrm import GraphicFrame
+
+from render_policy import get_render_policy
+
+# 加载环境变量
+load_dotenv()
+
+# 需要视觉模型才能理解的形状类型
+VISUAL_SHAPE_TYPES = {
+    MSO_SHAPE_TYPE.PICTURE, MSO_SHAPE_TYPE.LINKED_PICTURE, MSO_SHAPE_TYPE.CHART, MSO_SHAPE_TYPE.DIAGRAM,
+    MSO_SHAPE_TYPE.MEDIA, MSO_SHAPE_TYPE.WEB_VIDEO, MSO_SHAPE_TYPE.EMBEDDED_OLE_OBJECT,
+    MSO_SHAPE_TYPE.LINKED_OLE_OBJECT, MSO_SHAPE_TYPE.INK, MSO_SHAPE_TYPE.CANVAS,
+}
+# 没有文字的图形（箭头、连接线、色块等）超过该数量时，幻灯片视为图示，交给视觉模型
+MAX_DRAWING_SHAPES = 4
+# 标题占位符类型
+TITLE_PLACEHOLDERS = {PP_PLACEHOLDER.TITLE, PP_PLACEHOLDER.CENTER_TITLE}
+# 正文占位符类型，其中的段落按项目符号列表输出
+BODY_PLACEHOLDERS = {PP_PLACEHOLDER.BODY, PP_PLACEHOLDER.OBJECT, PP_PLACEHOLDER.SUBTITLE}
+# 导出PDF时包含隐藏的幻灯片（LibreOffice默认跳过，PDF页码会与幻灯片编号错位）；
+# JSON格式的过滤器选项需要LibreOffice 7.4以上，较早的版本忽略该选项，由DeckRenderer按可见幻灯片对应页码
+PDF_EXPORT_FILTER = 'pdf:impress_pdf_Export:{"ExportHiddenSlides":{"type":"boolean","value":"true"}}'
+# Windows上LibreOffice的默认安装位置
+WINDOWS_SOFFICE_PATHS = [
+    r"C:\Program Files\LibreOffice\program\soffice.exe",
+    r"C:\Program Files (x86)\LibreOffice\program\soffice.exe",
+]
+
+
+def _iter_shapes(shapes):
+    """
+    展开组合形状，依次返回所有形状
+    """
+    for shape in shapes:
+        if shape.shape_type == MSO_SHAPE_TYPE.GROUP:
+            yield from _iter_shapes(shape.shapes)
+        else:
+            yield shape
+
+
+def _placeholder_type(shape):
+    if not shape.is_placeholder:
+        return None
+    try:
+        return shape.placeholder_format.type
+    except ValueError:
+        return None
+
+
+def _table_to_markdown(table) -> str:
+    """
+    将PPT表格转换为Markdown表格，第一行作为表头
+    """
+    rows = []
+    for row in table.rows:
+        cells = [cell.text.replace("|", "\\|").replace("\n", " ").strip() for cell in row.cells]
+        rows.append("| " + " | ".join(cells) + " |")
+    if not rows:
+        return ""
+    column_count = len(table.columns)
+    rows.insert(1, "| " + " | ".join(["---"] * column_count) + " |")
+    return "\n".join(rows)
+
+
+def _text_frame_to_markdown(shape) -> str:
+    """
+    将形状中的文字转换为Markdown：标题占位符输出为一级标题，正文占位符和有缩进的段落输出为列表
+    """
+    placeholder_type = _placeholder_type(shape)
+    lines = []
+    for paragraph in shape.text_frame.paragraphs:
+        text = "".join(run.text for run in paragraph.runs).strip()
+        if not text:
+            continue
+        if placeholder_type in TITLE_PLACEHOLDERS:
+            lines.append(f"# {text}")
+        elif placeholder_type in BODY_PLACEHOLDERS or paragraph.level > 0:
+            lines.append("  " * paragraph.level + f"- {text}")
+        else:
+            lines.append(text)
+    return "\n".join(lines)
+
+
+def slide_to_markdown(slide) -> str|None:
+    """
+    直接从python-pptx的形状生成幻灯片的Markdown，不调用视觉模型
+
+    只处理由文本框、占位符和表格组成的幻灯片；含有图片、图表、SmartArt、媒体、
+    嵌入对象或较多无文字图形的幻灯片需要视觉模型，返回None。
+
+    Args:
+        slide: python-pptx幻灯片对象
+
+    Returns:
+        幻灯片的Markdown文本，需要视觉模型时返回None
+    """
+    shapes = list(_iter_shapes(slide.shapes))
+    drawing_shapes = 0
+    for shape in shapes:
+        if shape.shape_type in VISUAL_SHAPE_TYPES or hasattr(shape, "image"):
+            return None
+        if isinstance(shape, GraphicFrame) and not shape.has_table:
+            return None
+        if not shape.has_text_frame and not getattr(shape, "has_table", False):
+            drawing_shapes += 1
+        elif shape.has_text_frame and not shape.text_frame.text.strip():
+            drawing_shapes += 1
+    if drawing_shapes > MAX_DRAWING_SHAPES:
+        return None
+
+    # 按从上到下、从左到右的阅读顺序输出
+    parts = []
+    for shape in sorted(shapes, key=lambda item: (item.top or 0, item.left or 0)):
+        if getattr(shape, "has_table", False) and shape.has_table:
+            parts.append(_table_to_markdown(shape.table))
+        elif shape.has_text_frame:
+            parts.append(_text_frame_to_markdown(shape))
+    return "\n\n".join(part for part in parts if part)
+
+
+def hidden_slide_flags(presentation) -> list:
+    """
+    返回每张幻灯片是否隐藏（放映时跳过）
+
+    Args:
+        presentation: python-pptx的Presentation对象
+
+    Returns:
+        按幻灯片顺序排列的布尔值列表
+    """
+    return [slide._element.get("show") == "0" for slide in presentation.slides]
+
+
+def find_soffice() -> str|None:
+    """
+    查找LibreOffice的命令行程序，优先使用环境变量LIBREOFFICE_PATH
+
+    Returns:
+        soffice可执行文件路径，找不到时返回None
+    """
+    configured = os.environ.get("LIBREOFFICE_PATH")
+    if configured:
+        return configured if os.path.exists(configured) else shutil.which(configured)
+    for name in ("soffice", "libreoffice"):
+        found = shutil.which(name)
+        if found:
+            return found
+    for path in WINDOWS_SOFFICE_PATHS:
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def export_deck_pdf(ppt_path: str, output_dir: str) -> str|None:
+    """
+    用LibreOffice无界面模式一次性把整个演示文稿转换为PDF
+
+    每次转换使用独立的用户配置目录，多个文档可以同时转换。
+
+    Args:
+        ppt_path: PPT/PPTX文件路径
+        output_dir: PDF的输出目录
+
+    Returns:
+        生成的PDF路径，没有安装LibreOffice或转换失败时返回None
+    """
+    soffice = find_soffice()
+    if soffice is None:
+        return None
+
+    profile_dir = Path(output_dir, "lo_profile").resolve().as_uri()
+    command = [
+        soffice, "--headless", "--norestore", f"-env:UserInstallation={profile_dir}",
+        "--convert-to", PDF_EXPORT_FILTER, "--outdir", output_dir, os.path.abspath(ppt_path),
+    ]
+    try:
+        subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True,
+                       timeout=float(os.environ.get("PPT_EXPORT_TIMEOUT", 300)))
+    except (OSError, subprocess.SubprocessError) as e:
+        print(f"LibreOffice转换PPT文件时出错: {str(e)}")
+        return None
+
+    pdf_path = os.path.join(output_dir, os.path.splitext(os.path.basename(ppt_path))[0] + ".pdf")
+    return pdf_path if os.path.exists(pdf_path) else None
+
+
+def export_deck_images_powerpoint(ppt_path: str, output_dir: str) -> list|None:
+    """
+    在同一个PowerPoint会话中导出所有幻灯片的图像（仅Windows）
+
+    Args:
+        ppt_path: PPT/PPTX文件路径
+        output_dir: 图像的输出目录
+
+    Returns:
+        按幻灯片顺序排列的图像路径列表，PowerPoint不可用或导出失败时返回None
+    """
+    try:
+        import win32com.client
+        import pythoncom
+    except ImportError:
+        return None
+
+    pythoncom.CoInitialize()
+    powerpoint = None
+    presentation = None
+    try:
+        powerpoint = win32com.client.Dispatch("PowerPoint.Application")
+        presentation = powerpoint.Presentations.Open(os.path.abspath(ppt_path), WithWindow=False)
+        image_paths = []
+        for index in range(1, presentation.Slides.Count + 1):
+            image_path = os.path.join(os.path.abspath(output_dir), f"slide_{index}.png")
+            presentation.Slides(index).Export(image_path, "PNG")
+            image_paths.append(image_path)
+        return image_paths
+    except Exception as e:
+        print(f"PowerPoint导出幻灯片时出错: {str(e)}")
+        return None
+    finally:
+        if presentation is not None:
+            presentation.Close()
+        if powerpoint is not None:
+            powerpoint.Quit()
+        pythoncom.CoUninitialize()
+
+
+class DeckRenderer:
+    """
+    整个演示文稿的渲染器：第一次需要幻灯片图像时一次性导出全部幻灯片
+
+    优先用LibreOffice把演示文稿转换为PDF，再按渲染策略渲染对应页面；
+    没有LibreOffice时在Windows上用一个PowerPoint会话导出全部幻灯片。
+    较早版本的LibreOffice导出时跳过隐藏的幻灯片，此时按可见幻灯片的顺序对应PDF页码，隐藏的幻灯片返回None。
+    两者都不可用时render返回None，由调用方使用备用渲染方法。
+    线程安全：导出只进行一次，PDF页面的渲染在锁内串行进行。
+    """
+
+    def __init__(self, ppt_path: str, output_dir: str, hidden: list|None = None):
+        """
+        Args:
+            ppt_path: PPT/PPTX文件路径
+            output_dir: 导出文件的临时目录
+            hidden: 每张幻灯片是否隐藏（见hidden_slide_flags），None表示没有隐藏的幻灯片
+        """
+        self.ppt_path = ppt_path
+        self.output_dir = output_dir
+        self.hidden = hidden or []
+        self.method = None
+        self._exported = False
+        self._document = None
+        # 幻灯片编号到PDF页码的映射，None表示一一对应
+        self._page_map = None
+        self._image_paths = None
+        self._lock = threading.Lock()
+
+    def _export(self):
+        self._exported = True
+        pdf_path = export_deck_pdf(self.ppt_path, self.output_dir)
+        if pdf_path is not None:
+            self._document = fitz.open(pdf_path)
+            self.method = "LibreOffice"
+            visible = [slide_num for slide_num, hidden in enumerate(self.hidden) if not hidden]
+            if len(visible) < len(self.hidden) and self._document.page_count == len(visible):
+                self._page_map = {slide_num: page_num for page_num, slide_num in enumerate(visible)}
+            return
+        self._image_paths = export_deck_images_powerpoint(self.ppt_path, self.output_dir)
+        if self._image_paths is not None:
+            self.method = "PowerPoint"
+
+    def render(self, slide_num: int):
+        """
+        获取一张幻灯片的图像
+
+        Args:
+            slide_num: 从0开始的幻灯片编号
+
+        Returns:
+            (图像, 渲染参数) 元组：图像为内存中的字节或导出的图像路径，
+            渲染参数只有经PDF渲染时才有（格式同RenderPolicy.render）；无法导出时返回None
+        """
+        with self._lock:
+            if not self._exported:
+                self._export()
+            if self._document is not None:
+                page_num = slide_num if self._page_map is None else self._page_map.get(slide_num)
+                if page_num is not None and page_num < self._document.page_count:
+                    return get_render_policy().render(self._document.load_page(page_num))
+                return None
+            if self._image_paths is not None and slide_num < len(self._image_paths):
+                return self._image_paths[slide_num], None
+            return None
+
+    def close(self):
+        """
+        关闭导出的PDF；关闭后不再导出，任务取消后仍在排队的渲染直接返回None
+        """
+        with self._lock:
+            self._exported = True
+            self._image_paths = None
+            if self._document is not None:
+                self._document.close()
+                self._document = None
@@ -0,0 +1,255 @@
+import os
+import time
+import asyncio
+import threading
+from typing import Optional
+
+from dotenv import load_dotenv
+
+# 加载环境变量
+load_dotenv()
+
+# 视为服务端限流或过载的HTTP状态码
+THROTTLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    """
+    令牌桶限速器（线程安全），按每分钟速率匀速补充令牌
+
+    采用预约方式：reserve()立即扣除令牌（允许透支），并返回调用方需要等待的秒数，
+    不同线程中的事件循环可以共享同一个桶。
+    """
+
+    def __init__(self, per_minute: float, capacity: Optional[float] = None):
+        self.rate = per_minute / 60.0
+        self.capacity = capacity if capacity is not None else per_minute
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self, amount: float) -> float:
+        """
+        预约指定数量的令牌
+
+        Args:
+            amount: 需要的令牌数
+
+        Returns:
+            获得令牌前需要等待的秒数
+        """
+        with self._lock:
+            self._refill()
+            self._tokens -= amount
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.rate
+
+    def adjust(self, amount: float):
+        """
+        修正已预约的令牌数（正数表示多扣，负数表示退还）
+
+        Args:
+            amount: 需要额外扣除的令牌数
+        """
+        with self._lock:
+            self._refill()
+            self._tokens = min(self.capacity, self._tokens - amount)
+
+
+class AdaptiveConcurrency:
+    """
+    AIMD（加性增、乘性减）自适应并发控制
+
+    请求成功时并发上限缓慢增加（每完成约limit个请求加1），
+    遇到429/5xx时上限减半，并在冷却时间内不再重复减半，避免一次突发把上限降到底。
+
+    限速器按API密钥全局共享，可能先后（或同时）被多个事件循环使用，
+    因此状态由线程锁保护，等待名额的协程各自登记一个所在事件循环的future，释放名额时被唤醒。
+    """
+
+    def __init__(self, initial: int, min_limit: int = 1, max_limit: int = 256,
+                 decrease_factor: float = 0.5, cooldown: float = 2.0):
+        self.min_limit = min_limit
+        self.max_limit = max(max_limit, min_limit)
+        self.limit = float(min(max(initial, min_limit), self.max_limit))
+        self.decrease_factor = decrease_factor
+        self.cooldown = cooldown
+        self.in_flight = 0
+        self._last_decrease = 0.0
+        self._lock = threading.Lock()
+        # 等待名额的 (事件循环, future) 列表
+        self._waiters = []
+
+    def try_acquire(self) -> bool:
+        """
+        尝试占用一个并发名额，不阻塞
+        """
+        with self._lock:
+            if self.in_flight < int(self.limit):
+                self.in_flight += 1
+                return True
+            return False
+
+    async def acquire_async(self):
+        """
+        占用一个并发名额，没有名额时等待（不阻塞事件循环）；等待期间被取消不会占用名额
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            # 检查名额和登记等待在同一把锁内完成，不会错过两者之间的释放
+            with self._lock:
+                if self.in_flight < int(self.limit):
+                    self.in_flight += 1
+                    return
+                waiter = loop.create_future()
+                self._waiters.append((loop, waiter))
+            try:
+                await waiter
+            finally:
+                with self._lock:
+                    if (loop, waiter) in self._waiters:
+                        self._waiters.remove((loop, waiter))
+
+    @staticmethod
+    def _wake(waiter: asyncio.Future):
+        if not waiter.done():
+            waiter.set_result(None)
+
+    def release(self, throttled: bool = False, succeeded: bool = True):
+        """
+        释放并发名额，并根据请求结果调整上限
+
+        Args:
+            throttled: 请求是否被限流或服务端过载（429/5xx）
+            succeeded: 请求是否成功
+        """
+        with self._lock:
+            self.in_flight -= 1
+            now = time.monotonic()
+            if throttled:
+                if now - self._last_decrease >= self.cooldown:
+                    self.limit = max(self.min_limit, self.limit * self.decrease_factor)
+                    self._last_decrease = now
+            elif succeeded:
+                self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+            # 唤醒所有等待者重新争抢名额（上限增加时可能同时空出多个名额）
+            waiters, self._waiters = self._waiters, []
+        for loop, waiter in waiters:
+            if not loop.is_closed():
+                loop.call_soon_threadsafe(self._wake, waiter)
+
+
+class RateLimiter:
+    """
+    单个API密钥的请求预算：每分钟请求数、每分钟token数，以及可选的自适应并发控制
+
+    所有入口（PDF、PPT、图片、process_images）的请求都经过post_chat_completion_async，
+    它在发送请求前调用acquire_async，收到响应后调用release，从而共享同一份预算。
+    """
+
+    def __init__(self,
+                 rpm: Optional[float] = None,
+                 tpm: Optional[float] = None,
+                 adaptive: Optional[AdaptiveConcurrency] = None):
+        self.rpm_bucket = TokenBucket(rpm) if rpm else None
+        self.tpm_bucket = TokenBucket(tpm) if tpm else None
+        self.adaptive = adaptive
+        self.throttled_count = 0
+
+    def _reserve(self, estimated_tokens: int) -> float:
+        wait = 0.0
+        if self.rpm_bucket is not None:
+            wait = max(wait, self.rpm_bucket.reserve(1))
+        if self.tpm_bucket is not None:
+            wait = max(wait, self.tpm_bucket.reserve(estimated_tokens))
+        return wait
+
+    def _refund(self, estimated_tokens: int):
+        if self.rpm_bucket is not None:
+            self.rpm_bucket.adjust(-1)
+        if self.tpm_bucket is not None:
+            self.tpm_bucket.adjust(-estimated_tokens)
+
+    async def acquire_async(self, estimated_tokens: int):
+        """
+        在发送请求前等待并发名额和限速令牌
+
+        等待令牌期间被取消（例如任务被取消）时归还已占用的并发名额和预约的令牌，
+        调用方只需在本方法正常返回后调用release。
+
+        Args:
+            estimated_tokens: 预估本次请求消耗的token数
+        """
+        if self.adaptive is not None:
+            await self.adaptive.acquire_async()
+        try:
+            wait = self._reserve(estimated_tokens)
+            if wait > 0:
+                await asyncio.sleep(wait)
+        except BaseException:
+            self._refund(estimated_tokens)
+            if self.adaptive is not None:
+                self.adaptive.release(succeeded=False)
+            raise
+
+    def release(self, status_code: Optional[int], estimated_tokens: int, used_tokens: Optional[int] = None):
+        """
+        请求结束后归还并发名额，并用实际token用量修正预算
+
+        Args:
+            status_code: HTTP状态码，网络错误等没有响应时为None
+            estimated_tokens: acquire时预估的token数
+            used_tokens: 响应中usage字段给出的实际token数
+        """
+        throttled = status_code in THROTTLE_STATUS_CODES
+        if throttled:
+            self.throttled_count += 1
+        if self.tpm_bucket is not None and used_tokens is not None:
+            self.tpm_bucket.adjust(used_tokens - estimated_tokens)
+        if self.adaptive is not None:
+            self.adaptive.release(throttled=throttled, succeeded=status_code == 200)
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def _env_float(name: str) -> Optional[float]:
+    value = os.environ.get(name)
+    return float(value) if value else None
+
+
+def get_rate_limiter(api_key: str) -> RateLimiter:
+    """
+    获取指定API密钥共享的限速器，配置从环境变量读取
+
+    环境变量:
+        RATE_LIMIT_RPM: 每分钟最大请求数（留空表示不限制）
+        RATE_LIMIT_TPM: 每分钟最大token数（留空表示不限制）
+        ADAPTIVE_CONCURRENCY: 设为true时启用AIMD自适应并发控制
+        ADAPTIVE_MAX_CONCURRENCY: 自适应并发上限的最大值（默认256）
+
+    Args:
+        api_key: API密钥
+
+    Returns:
+        RateLimiter实例
+    """
+    with _limiters_lock:
+        limiter = _limiters.get(api_key)
+        if limiter is None:
+            adaptive = None
+            if os.environ.get("ADAPTIVE_CONCURRENCY", "").lower() in ("1", "true", "yes"):
+                adaptive = AdaptiveConcurrency(
+                    initial=int(os.environ.get("MAX_WORKERS", 5)),
+                    max_limit=int(os.environ.get("ADAPTIVE_MAX_CONCURRENCY", 256)),
+                )
+            limiter = RateLimiter(_env_float("RATE_LIMIT_RPM"), _env_float("RATE_LIMIT_TPM"), adaptive)
+            _limiters[api_key] = limiter
+        return limiter
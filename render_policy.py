@@ -0,0 +1,312 @@
+import os
+import io
+
+from typing import TYPE_CHECKING
+
+from dotenv import load_dotenv
+
+from text_layer import text_metrics, MIN_TEXT_CHARS, MAX_MATH_RATIO
+from page_filter import page_signature, content_digest
+
+if TYPE_CHECKING:
+    from PIL import Image
+
+# 加载环境变量
+load_dotenv()
+
+# 支持的图像编码格式
+IMAGE_FORMATS = {"png": "PNG", "jpeg": "JPEG", "jpg": "JPEG", "webp": "WEBP"}
+# 用于判断颜色和空白边距的预览图分辨率
+PREVIEW_DPI = 24
+# 灰度值不低于该值的像素视为空白
+WHITE_LEVEL = 245
+# 饱和度和亮度都高于该值的像素视为彩色
+COLOR_LEVEL = 48
+# 彩色像素占比低于该值时转为灰度
+MAX_COLOR_RATIO = 0.002
+# 裁剪空白边距后四周保留的宽度（点）
+CROP_PADDING = 12
+# 每平方英寸字符数超过该值时视为密集排版
+DENSE_TEXT_DENSITY = 40
+# 最低的JPEG/WebP质量，超出字节上限时逐步降低质量但不低于该值
+MIN_QUALITY = 40
+
+
+class RenderPolicy:
+    """
+    单页渲染策略：按页面内容选择分辨率、颜色模式、裁剪范围和图像编码
+
+    - 分辨率：有文本层时按较小字号换算，使小字在图像中至少有glyph_px像素高；
+      公式较多或排版密集的页面再适当提高；扫描页使用默认分辨率
+    - 颜色：预览图中几乎没有彩色像素时渲染为灰度图
+    - 裁剪：去掉四周的空白边距
+    - 编码：默认使用有损JPEG，可以设置字节上限，超出时逐步降低质量；
+      灰度文字页用PNG往往更小，此时改用PNG
+    """
+
+    def __init__(self,
+                 adaptive: bool = True,
+                 dpi: int = 150,
+                 min_dpi: int = 96,
+                 max_dpi: int = 300,
+                 glyph_px: float = 20,
+                 max_side: int = 2048,
+                 image_format: str = "jpeg",
+                 quality: int = 85,
+                 max_bytes: int|None = None):
+        """
+        Args:
+            adaptive: 是否启用自适应策略，False时按固定分辨率渲染彩色整页
+            dpi: 默认分辨率（扫描页或未启用自适应时使用）
+            min_dpi: 自适应分辨率下限
+            max_dpi: 自适应分辨率上限
+            glyph_px: 较小字号在图像中的目标像素高度
+            max_side: 图像长边的最大像素数
+            image_format: 图像编码格式（png、jpeg或webp）
+            quality: JPEG/WebP编码质量（1~100）
+            max_bytes: 单页图像的字节上限，None表示不限制
+        """
+        if image_format.lower() not in IMAGE_FORMATS:
+            raise ValueError(f"不支持的图像格式: {image_format}")
+        self.adaptive = adaptive
+        self.dpi = dpi
+        self.min_dpi = min_dpi
+        self.max_dpi = max(max_dpi, min_dpi)
+        self.glyph_px = glyph_px
+        self.max_side = max_side
+        self.image_format = image_format.lower()
+        self.quality = quality
+        self.max_bytes = max_bytes
+
+    @classmethod
+    def from_env(cls) -> "RenderPolicy":
+        """
+        从环境变量读取渲染策略
+
+        环境变量:
+            ADAPTIVE_RENDER: 设为false时关闭自适应策略（默认开启）
+            RENDER_DPI / RENDER_MIN_DPI / RENDER_MAX_DPI: 默认分辨率及自适应分辨率上下限
+            RENDER_GLYPH_PX: 较小字号的目标像素高度
+            RENDER_MAX_SIDE: 图像长边的最大像素数
+            IMAGE_FORMAT: png、jpeg或webp
+            IMAGE_QUALITY: JPEG/WebP编码质量
+            IMAGE_MAX_KB: 单页图像的大小上限（KB，留空表示不限制）
+        """
+        max_kb = os.environ.get("IMAGE_MAX_KB")
+        return cls(
+            adaptive=os.environ.get("ADAPTIVE_RENDER", "true").lower() not in ("0", "false", "no"),
+            dpi=int(os.environ.get("RENDER_DPI", 150)),
+            min_dpi=int(os.environ.get("RENDER_MIN_DPI", 96)),
+            max_dpi=int(os.environ.get("RENDER_MAX_DPI", 300)),
+            glyph_px=float(os.environ.get("RENDER_GLYPH_PX", 20)),
+            max_side=int(os.environ.get("RENDER_MAX_SIDE", 2048)),
+            image_format=os.environ.get("IMAGE_FORMAT", "jpeg"),
+            quality=int(os.environ.get("IMAGE_QUALITY", 85)),
+            max_bytes=int(float(max_kb) * 1024) if max_kb else None,
+        )
+
+    def choose_dpi(self, page) -> tuple[int, str]:
+        """
+        根据文本层的字号、公式占比和文字密度选择分辨率
+
+        Args:
+            page: PyMuPDF页面对象
+
+        Returns:
+            (分辨率, 原因) 元组
+        """
+        if not self.adaptive:
+            return self.dpi, "固定分辨率"
+
+        metrics = text_metrics(page)
+        if metrics["chars"] < MIN_TEXT_CHARS or metrics["small_size"] <= 0:
+            dpi, reason = self.dpi, "无文本层"
+        else:
+            dpi, reason = self.glyph_px * 72 / metrics["small_size"], f"小字号{metrics['small_size']:.1f}pt"
+            if metrics["math_ratio"] > MAX_MATH_RATIO:
+                dpi, reason = dpi * 1.5, reason + "，公式较多"
+            elif metrics["density"] > DENSE_TEXT_DENSITY:
+                dpi, reason = dpi * 1.25, reason + "，排版密集"
+        return int(min(max(dpi, self.min_dpi), self.max_dpi)), reason
+
+    def preview(self, page) -> "Image.Image":
+        """
+        渲染低分辨率预览图，用于判断颜色和空白边距
+
+        Args:
+            page: PyMuPDF页面对象
+
+        Returns:
+            RGB预览图
+        """
+        from PIL import Image
+
+        preview = page.get_pixmap(dpi=PREVIEW_DPI, alpha=False)
+        return Image.frombytes("RGB", (preview.width, preview.height), preview.samples)
+
+    def inspect(self, page, image: "Image.Image") -> tuple[bool, object]:
+        """
+        根据预览图判断页面是否需要彩色，并找出内容区域
+
+        Args:
+            page: PyMuPDF页面对象
+            image: preview()生成的预览图
+
+        Returns:
+            (是否渲染为灰度, 裁剪区域) 元组，裁剪区域为None表示不裁剪
+        """
+        if not self.adaptive:
+            return False, None
+
+        width, height = image.size
+
+        colored = sum(1 for _, s, v in image.convert("HSV").getdata() if s > COLOR_LEVEL and v > COLOR_LEVEL)
+        grayscale = colored <= MAX_COLOR_RATIO * width * height
+
+        # 旋转页面的像素坐标与页面坐标不一致，不裁剪
+        clip = None
+        bbox = image.convert("L").point(lambda v: 255 if v < WHITE_LEVEL else 0).getbbox()
+        if bbox is not None and page.rotation == 0:
+            import fitz  # PyMuPDF
+
+            scale = 72 / PREVIEW_DPI
+            rect = fitz.Rect(bbox[0] * scale - CROP_PADDING, bbox[1] * scale - CROP_PADDING,
+                             bbox[2] * scale + CROP_PADDING, bbox[3] * scale + CROP_PADDING) & page.rect
+            if abs(rect) < abs(page.rect) * 0.95:
+                clip = rect
+        return grayscale, clip
+
+    def encode(self, pix) -> tuple[bytes, str, int|None]:
+        """
+        按配置的格式编码渲染结果，超过字节上限时逐步降低质量
+
+        Args:
+            pix: PyMuPDF像素图（不含透明通道）
+
+        Returns:
+            (图像字节, 实际使用的格式, 实际使用的质量) 元组，PNG的质量为None
+        """
+        if self.image_format == "png":
+            return pix.tobytes("png"), "png", None
+
+        from PIL import Image
+
+        image = Image.frombytes("L" if pix.n == 1 else "RGB", (pix.width, pix.height), pix.samples)
+        quality = self.quality
+        while True:
+            buffer = io.BytesIO()
+            image.save(buffer, format=IMAGE_FORMATS[self.image_format], quality=quality, optimize=True)
+            data = buffer.getvalue()
+            if self.max_bytes is None or len(data) <= self.max_bytes or quality <= MIN_QUALITY:
+                break
+            quality = max(MIN_QUALITY, quality - 10)
+
+        # 灰度文字页的无损PNG通常比有损编码更小也更清晰
+        if pix.n == 1:
+            png_data = pix.tobytes("png")
+            if len(png_data) < len(data):
+                return png_data, "png", None
+        return data, self.image_format, quality
+
+    def render(self, page) -> tuple[bytes, dict]:
+        """
+        按策略渲染并编码一页
+
+        空白页判定和感知哈希使用实际渲染的图像；文本层不为空的页面不会被判为空白。
+
+        Args:
+            page: PyMuPDF页面对象
+
+        Returns:
+            (图像字节, 渲染参数) 元组，渲染参数包含blank、phash、digest、dpi、reason、grayscale、
+            cropped、format、quality、width、height和bytes；空白页不编码，图像字节为空，
+            渲染参数只有blank和phash
+        """
+        image = self.preview(page)
+        dpi, reason = self.choose_dpi(page)
+        grayscale, clip = self.inspect(page, image)
+
+        # 限制图像长边，避免大幅面页面生成过大的图像
+        area = clip if clip is not None else page.rect
+        longest = max(area.width, area.height)
+        if longest > 0:
+            dpi = max(1, min(dpi, int(self.max_side * 72 / longest)))
+
+        import fitz  # PyMuPDF
+        from PIL import Image
+
+        pix = page.get_pixmap(dpi=dpi, clip=clip, colorspace=fitz.csGRAY if grayscale else fitz.csRGB, alpha=False)
+        rendered = Image.frombytes("L" if pix.n == 1 else "RGB", (pix.width, pix.height), pix.samples)
+        # 裁剪过边距时按整页的像素数计算墨迹比例
+        total_pixels = int(abs(page.rect) * (dpi / 72) ** 2)
+        blank, phash = page_signature(rendered, total_pixels)
+        if blank and not page.get_text("text").strip():
+            return b"", {"blank": True, "phash": phash}
+
+        data, image_format, quality = self.encode(pix)
+        return data, {
+            "blank": False,
+            "phash": phash,
+            "digest": content_digest(data),
+            "dpi": dpi,
+            "reason": reason,
+            "grayscale": grayscale,
+            "cropped": clip is not None,
+            "format": image_format,
+            "quality": quality,
+            "width": pix.width,
+            "height": pix.height,
+            "bytes": len(data),
+        }
+
+
+_render_policy = None
+
+
+def get_render_policy() -> RenderPolicy:
+    """
+    获取当前进程共享的渲染策略（渲染进程各自从环境变量读取）
+    """
+    global _render_policy
+    if _render_policy is None:
+        _render_policy = RenderPolicy.from_env()
+    return _render_policy
+
+
+class RenderStats:
+    """
+    单个文档的渲染统计：每页的渲染参数和发送的字节数
+    """
+
+    def __init__(self):
+        self.pages = {}
+
+    def add(self, page_num: int, info: dict|None):
+        """
+        记录一页的渲染参数，本地转换的页面、空白页、复用结果的重复页面和
+        未经渲染策略处理的图像（如PPT的替代图像）没有完整参数，忽略
+
+        Args:
+            page_num: 从0开始的页码
+            info: RenderPolicy.render返回的渲染参数
+        """
+        if info is not None and "bytes" in info and info.get("duplicate_of") is None:
+            self.pages[page_num] = info
+
+    def summary(self) -> str|None:
+        """
+        生成一行渲染统计，没有渲染任何页面时返回None
+        """
+        if not self.pages:
+            return None
+        infos = list(self.pages.values())
+        total_bytes = sum(info["bytes"] for info in infos)
+        dpis = [info["dpi"] for info in infos]
+        grayscale = sum(1 for info in infos if info["grayscale"])
+        cropped = sum(1 for info in infos if info["cropped"])
+        formats = {}
+        for info in infos:
+            formats[info["format"]] = formats.get(info["format"], 0) + 1
+        format_text = "、".join(f"{name} {count} 页" for name, count in sorted(formats.items()))
+        return (f"渲染: {len(infos)} 页，共发送 {total_bytes / 1024:.1f} KB（平均 {total_bytes / len(infos) / 1024:.1f} KB/页），"
+                f"DPI {min(dpis)}-{max(dpis)}，灰度 {grayscale} 页，裁剪边距 {cropped} 页，{format_text}")
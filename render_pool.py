@@ -0,0 +1,256 @@
+import os
+import asyncio
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+
+from dotenv import load_dotenv
+
+from text_layer import analyze_page, page_to_markdown, ROUTE_TEXT
+from render_policy import get_render_policy
+
+# 加载环境变量
+load_dotenv()
+
+# 每个渲染进程最多保持打开的文档数
+MAX_WORKER_DOCUMENTS = 4
+
+
+def render_page(page) -> bytes:
+    """
+    按渲染策略将PDF页面直接渲染为内存中的图像，不经过临时文件
+
+    Args:
+        page: PyMuPDF页面对象
+
+    Returns:
+        编码后的图像字节
+    """
+    return get_render_policy().render(page)[0]
+
+
+def prepare_loaded_page(page, hybrid: bool = False):
+    """
+    对已加载的页面做路由分析并渲染
+
+    Args:
+        page: PyMuPDF页面对象
+        hybrid: 是否启用混合模式，纯文本页面直接从文本层生成Markdown
+
+    Returns:
+        (路由说明, 本地生成的Markdown, 渲染的图像字节, 渲染参数) 元组。
+        本地文本层转换时后两项为None；空白页的Markdown为空字符串，图像字节为None；
+        其余页面的Markdown为None
+    """
+    # 混合模式：纯文本页面直接从文本层生成Markdown，不调用视觉模型
+    route = "视觉模型"
+    if hybrid:
+        route_type, reason = analyze_page(page)
+        if route_type == ROUTE_TEXT:
+            return f"本地文本层（{reason}）", page_to_markdown(page), None, None
+        route = f"视觉模型（{reason}）"
+
+    image_bytes, render_info = get_render_policy().render(page)
+    if render_info["blank"]:
+        return "空白页（跳过）", "", None, render_info
+    return route, None, image_bytes, render_info
+
+
+# 渲染进程内的文档句柄，每个进程独立打开，不与其他进程或线程共享
+_worker_documents = OrderedDict()
+
+
+def _worker_document(pdf_path: str):
+    document = _worker_documents.pop(pdf_path, None)
+    if document is None:
+        import fitz  # PyMuPDF
+        document = fitz.open(pdf_path)
+    _worker_documents[pdf_path] = document
+    while len(_worker_documents) > MAX_WORKER_DOCUMENTS:
+        _, oldest = _worker_documents.popitem(last=False)
+        oldest.close()
+    return document
+
+
+def render_pdf_page(pdf_path: str, page_num: int, hybrid: bool = False):
+    """
+    在渲染进程中加载并处理一页（进程池的任务入口）
+
+    Args:
+        pdf_path: PDF文件路径
+        page_num: 从0开始的页码
+        hybrid: 是否启用混合模式
+
+    Returns:
+        同prepare_loaded_page
+    """
+    page = _worker_document(pdf_path).load_page(page_num)
+    return prepare_loaded_page(page, hybrid)
+
+
+class RenderPool:
+    """
+    PDF页面渲染进程池
+
+    渲染是CPU密集操作且会占用GIL，放到独立进程中执行，不会拖慢等待API响应的事件循环。
+    进程在第一次渲染时才启动，使用spawn方式创建，Windows和Linux行为一致。
+    spawn方式的子进程会重新执行启动脚本，入口脚本应在__main__判断内创建界面或服务。
+    """
+
+    def __init__(self, workers: int):
+        """
+        Args:
+            workers: 渲染进程数
+        """
+        self.workers = max(1, workers)
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn")
+                )
+            return self._executor
+
+    def warm_up(self):
+        """
+        提前启动全部渲染进程（子进程启动时导入PyMuPDF），常驻服务启动时调用，第一个文档不必等待进程启动
+        """
+        executor = self._get_executor()
+        for future in [executor.submit(os.getpid) for _ in range(self.workers)]:
+            future.result()
+
+    async def render(self, pdf_path: str, page_num: int, hybrid: bool = False):
+        """
+        在进程池中渲染一页
+
+        Args:
+            pdf_path: PDF文件路径
+            page_num: 从0开始的页码
+            hybrid: 是否启用混合模式
+
+        Returns:
+            同prepare_loaded_page
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._get_executor(), render_pdf_page, pdf_path, page_num, hybrid)
+
+    def shutdown(self):
+        """
+        关闭渲染进程
+        """
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True, cancel_futures=True)
+                self._executor = None
+
+
+class DocumentRenderer:
+    """
+    单个PDF文档的渲染阶段，负责在网络请求之前提前渲染页面
+
+    每当调度器分配一个页面，就确保其后最多ahead个页面已经开始渲染；
+    渲染结果在页面处理完成（或最终失败）后释放。调度器只在有空闲请求名额时才分配页面，
+    因此渲染始终只领先网络几页，内存中的渲染结果数量有上限。
+    """
+
+    def __init__(self, pdf_path: str, page_nums: list, hybrid: bool, pool: RenderPool, ahead: int):
+        """
+        Args:
+            pdf_path: PDF文件路径
+            page_nums: 按分配顺序排列的待处理页码
+            hybrid: 是否启用混合模式
+            pool: 渲染进程池
+            ahead: 领先于已分配页面的最大预渲染页数
+        """
+        self.pdf_path = pdf_path
+        self.hybrid = hybrid
+        self.pool = pool
+        self.ahead = max(0, ahead)
+        self._order = list(page_nums)
+        self._position = {page_num: index for index, page_num in enumerate(self._order)}
+        self._started = 0
+        self._futures = {}
+
+    def _start(self, page_num: int):
+        if page_num not in self._futures:
+            self._futures[page_num] = asyncio.ensure_future(self.pool.render(self.pdf_path, page_num, self.hybrid))
+
+    def admit(self, page_num: int):
+        """
+        页面即将分配给调度器时调用，启动该页及其后ahead页的渲染
+
+        Args:
+            page_num: 从0开始的页码
+        """
+        limit = min(len(self._order), self._position[page_num] + self.ahead + 1)
+        while self._started < limit:
+            self._start(self._order[self._started])
+            self._started += 1
+
+    async def get(self, page_num: int):
+        """
+        获取一页的渲染结果，尚未开始渲染时立即开始
+
+        Args:
+            page_num: 从0开始的页码
+
+        Returns:
+            同prepare_loaded_page
+        """
+        self._start(page_num)
+        return await asyncio.shield(self._futures[page_num])
+
+    def release(self, page_num: int):
+        """
+        释放一页的渲染结果
+
+        Args:
+            page_num: 从0开始的页码
+        """
+        future = self._futures.pop(page_num, None)
+        if future is not None and not future.done():
+            future.cancel()
+
+    def close(self):
+        """
+        取消所有尚未使用的渲染
+        """
+        for page_num in list(self._futures):
+            self.release(page_num)
+
+
+_render_pool = None
+_render_pool_lock = threading.Lock()
+
+
+def get_render_pool() -> RenderPool|None:
+    """
+    获取全局共享的渲染进程池，配置从环境变量读取
+
+    环境变量:
+        RENDER_WORKERS: 渲染进程数（默认为CPU核数减1，最多4个，给事件循环留出一个核）；
+            设为0时在事件循环的线程池中渲染
+
+    Returns:
+        RenderPool实例，RENDER_WORKERS为0时返回None
+    """
+    global _render_pool
+    with _render_pool_lock:
+        if _render_pool is None:
+            workers = int(os.environ.get("RENDER_WORKERS", min(4, (os.cpu_count() or 1) - 1)))
+            if workers <= 0:
+                return None
+            _render_pool = RenderPool(workers)
+        return _render_pool
+
+
+def get_render_ahead() -> int:
+    """
+    从环境变量RENDER_AHEAD读取预渲染页数（默认为4）
+    """
+    return int(os.environ.get("RENDER_AHEAD", 4))
@@ -0,0 +1,355 @@
+import operator
+import unicodedata
+from collections import Counter
+
+# 行内短重复单元的最大长度和最少重复次数（与原正则 (.{1,20})\1{4,} 一致）
+MAX_UNIT_CHARS = 20
+MIN_REPEATS = 5
+# 行内长重复单元（例如整句反复输出）的最大长度和最少重复次数
+MAX_LONG_UNIT_CHARS = 200
+LONG_MIN_REPEATS = 3
+# 查找长重复单元候选周期时使用的子串长度（不超过最短的长重复单元）
+KGRAM_CHARS = 16
+# 整行或多行段落作为重复单元时的最大行数和最少重复次数
+MAX_BLOCK_LINES = 8
+LINE_MIN_REPEATS = 4
+# 重复部分至少覆盖的字符数：退化的输出通常一直重复到max_tokens，
+# 正常内容中的短重复（例如矩阵中的"0 & 0 & 0 & 0 & 0"）不会达到这个长度
+MIN_REPEAT_CHARS = 100
+# 流式检测：每收到STREAM_CHECK_CHARS个字符，检查一次最近STREAM_WINDOW_CHARS个字符
+STREAM_CHECK_CHARS = 256
+STREAM_WINDOW_CHARS = 2048
+# 乱码检测：至少GARBLED_MIN_CHARS个字符中乱码字符（替换符、控制字符、私用区和未分配码位）
+# 的比例超过MAX_GARBLED_RATIO时视为乱码
+MAX_GARBLED_RATIO = 0.3
+GARBLED_MIN_CHARS = 64
+GARBLED_CATEGORIES = {"Cc", "Co", "Cn", "Cs"}
+
+
+class Repetition:
+    """
+    检测到的一处连续重复：重复单元、重复次数及其在文本中的位置
+    """
+
+    def __init__(self, kind: str, start: int, end: int, unit: str, count: int, line: int):
+        """
+        Args:
+            kind: 重复单元的类型（"字符"或"行"）
+            start: 重复部分在文本中的起始偏移
+            end: 重复部分在文本中的结束偏移（不含）
+            unit: 重复单元
+            count: 连续重复次数
+            line: 重复部分起始位置所在的行号（从1开始）
+        """
+        self.kind = kind
+        self.start = start
+        self.end = end
+        self.unit = unit
+        self.count = count
+        self.line = line
+
+    def __str__(self):
+        unit = self.unit if len(self.unit) <= 40 else self.unit[:40] + "…"
+        size = f"{self.unit.count(chr(10)) + 1}行" if self.kind == "行" else f"{len(self.unit)}个字符"
+        return f"第 {self.line} 行起，{unit!r}（{size}）连续重复 {self.count} 次"
+
+    def __repr__(self):
+        return f"Repetition({self.kind!r}, start={self.start}, end={self.end}, count={self.count}, unit={self.unit!r})"
+
+
+class GarbledText:
+    """
+    检测到的一段乱码：乱码字符数及其所在的文本范围
+    """
+
+    def __init__(self, start: int, end: int, garbled: int, line: int):
+        """
+        Args:
+            start: 检测范围在文本中的起始偏移
+            end: 检测范围在文本中的结束偏移（不含）
+            garbled: 范围内的乱码字符数
+            line: 检测范围起始位置所在的行号（从1开始）
+        """
+        self.start = start
+        self.end = end
+        self.garbled = garbled
+        self.line = line
+
+    def __str__(self):
+        return f"第 {self.line} 行起，{self.end - self.start} 个字符中有 {self.garbled} 个乱码字符"
+
+    def __repr__(self):
+        return f"GarbledText(start={self.start}, end={self.end}, garbled={self.garbled})"
+
+
+def is_structural(unit: str) -> bool:
+    """
+    重复单元是否只由标点、符号和空白组成
+
+    Markdown的表格分隔行（| --- | --- |）、填空横线（____）、目录引导点（.....）和分隔线
+    都由这样的单元重复构成，属于正常的排版结构，不视为退化输出。
+    """
+    return not any(char.isalnum() for char in unit)
+
+
+def _periodic_run(sequence, period: int, repeats: int, accept=None) -> tuple[int, int]|None:
+    """
+    查找序列中第一段以period为周期、至少重复repeats次（且被accept接受）的区间
+
+    逐元素比较sequence[i]与sequence[i+period]（在C层完成），
+    连续(repeats-1)*period个位置相等即说明存在repeats个连续相同的单元。
+
+    Args:
+        sequence: 字符串或编号列表
+        period: 周期
+        repeats: 最少重复次数
+        accept: 可选的过滤函数，参数为区间的起始和结束下标，返回False时继续查找后面的区间
+
+    Returns:
+        (起始下标, 结束下标) 元组，不存在时返回None
+    """
+    need = (repeats - 1) * period
+    if need <= 0 or len(sequence) - period < need:
+        return None
+    equal = bytes(map(operator.eq, sequence, sequence[period:]))
+    pattern = b"\x01" * need
+    start = equal.find(pattern)
+    while start >= 0:
+        end = equal.find(b"\x00", start)
+        if end < 0:
+            end = len(equal)
+        if accept is None or accept(start, end + period):
+            return start, end + period
+        start = equal.find(pattern, end)
+    return None
+
+
+def _required_repeats(repeats: int, period: int, min_chars: int) -> int:
+    """
+    周期为period的单元至少要重复的次数，使重复部分覆盖min_chars个字符
+    """
+    return max(repeats, -(-min_chars // period))
+
+
+def _line_repetition(line: str, offset: int, min_repeats: int, max_period: int,
+                     long_repeats: int|None, max_long_period: int,
+                     min_chars: int = 0, ignore_structural: bool = False) -> tuple[int, int, int]|None:
+    """
+    在单行内查找最早出现的连续重复（原正则中的"."不匹配换行，重复单元不会跨行）
+
+    短单元逐个周期扫描；长单元先用定长子串的上一次出现距离找出候选周期，再逐个验证，
+    整体为线性时间。
+
+    Returns:
+        (起始偏移, 结束偏移, 周期) 元组，不存在时返回None
+    """
+    def acceptor(period):
+        if not ignore_structural:
+            return None
+        return lambda start, end: not is_structural(line[start:start + period])
+
+    best = None
+    for period in range(1, max_period + 1):
+        repeats = _required_repeats(min_repeats, period, min_chars)
+        if len(line) < repeats * period:
+            if repeats == min_repeats:
+                break
+            continue
+        run = _periodic_run(line, period, repeats, acceptor(period))
+        if run is not None and (best is None or run[0] < best[0]):
+            best = (run[0], run[1], period)
+
+    if long_repeats and len(line) >= long_repeats * (max_period + 1):
+        # 重复区域内，每个子串上一次出现的位置恰好在一个周期之前
+        last_seen = {}
+        distances = Counter()
+        for index in range(len(line) - KGRAM_CHARS + 1):
+            kgram = line[index:index + KGRAM_CHARS]
+            previous = last_seen.get(kgram)
+            last_seen[kgram] = index
+            if previous is not None and max_period < index - previous <= max_long_period:
+                distances[index - previous] += 1
+        for period in sorted(distances):
+            repeats = _required_repeats(long_repeats, period, min_chars)
+            if distances[period] * 2 < period or len(line) < repeats * period:
+                continue
+            run = _periodic_run(line, period, repeats, acceptor(period))
+            if run is not None and (best is None or run[0] < best[0]):
+                best = (run[0], run[1], period)
+
+    if best is None:
+        return None
+    return offset + best[0], offset + best[1], best[2]
+
+
+def find_repetition(text: str,
+                    min_repeats: int = MIN_REPEATS,
+                    max_period: int = MAX_UNIT_CHARS,
+                    long_repeats: int|None = LONG_MIN_REPEATS,
+                    max_long_period: int = MAX_LONG_UNIT_CHARS,
+                    line_repeats: int|None = LINE_MIN_REPEATS,
+                    max_block_lines: int = MAX_BLOCK_LINES,
+                    min_chars: int = MIN_REPEAT_CHARS,
+                    ignore_structural: bool = True) -> Repetition|None:
+    """
+    查找模型输出中最早出现的连续重复（退化输出），时间与文本长度成线性关系
+
+    依次检查三种重复单元：
+    - 行内1~max_period个字符的单元连续出现min_repeats次（min_chars=0且ignore_structural=False时
+      与原正则 (.{1,20})\\1{4,} 等价）
+    - 行内更长（不超过max_long_period个字符）的单元连续出现long_repeats次，例如整句反复
+    - 1~max_block_lines个非空行组成的段落连续出现line_repeats次（忽略空行和行首尾空白）
+
+    重复部分不足min_chars个字符、或重复单元只由标点符号和空白组成（表格分隔行、填空横线、
+    目录引导点等排版结构）时不视为退化输出。
+
+    Args:
+        text: 要检测的文本
+        min_repeats: 短单元的最少重复次数
+        max_period: 短单元的最大长度
+        long_repeats: 长单元的最少重复次数，None表示不检查
+        max_long_period: 长单元的最大长度
+        line_repeats: 行或段落的最少重复次数，None表示不检查
+        max_block_lines: 段落单元的最大行数
+        min_chars: 重复部分至少覆盖的字符数
+        ignore_structural: 是否忽略只由标点符号和空白组成的重复单元
+
+    Returns:
+        最早出现的Repetition，没有重复时返回None
+    """
+    candidates = []
+    offset = 0
+    lines = text.split("\n")
+    line_starts = []
+    for line in lines:
+        line_starts.append(offset)
+        found = _line_repetition(line, offset, min_repeats, max_period, long_repeats, max_long_period,
+                                 min_chars, ignore_structural)
+        if found is not None:
+            start, end, period = found
+            candidates.append(Repetition("字符", start, end, text[start:start + period], (end - start) // period, len(line_starts)))
+            # 只需要最早的一处：之后的行不可能更早
+            break
+        offset += len(line) + 1
+
+    if line_repeats:
+        # 非空行按内容编号，在编号序列上查找周期重复
+        numbers = {}
+        sequence = []
+        positions = []
+        for line_index, line in enumerate(lines):
+            content = line.strip()
+            if content:
+                sequence.append(numbers.setdefault(content, len(numbers)))
+                positions.append(line_index)
+        structural = [is_structural(content) for content in numbers] if ignore_structural else None
+
+        def acceptor(period):
+            def accept(first, last):
+                if structural is not None and all(structural[sequence[index]] for index in range(first, first + period)):
+                    return False
+                end_line = positions[last - 1]
+                return line_starts[end_line] + len(lines[end_line]) - line_starts[positions[first]] >= min_chars
+            return accept
+
+        best = None
+        for period in range(1, max_block_lines + 1):
+            run = _periodic_run(sequence, period, line_repeats, acceptor(period))
+            if run is not None and (best is None or run[0] < best[0]):
+                best = (run[0], run[1], period)
+        if best is not None:
+            first, last, period = best
+            start = line_starts[positions[first]]
+            end_line = positions[last - 1]
+            end = line_starts[end_line] + len(lines[end_line])
+            unit = "\n".join(lines[positions[index]].strip() for index in range(first, first + period))
+            candidates.append(Repetition("行", start, end, unit, (last - first) // period, positions[first] + 1))
+
+    if not candidates:
+        return None
+    return min(candidates, key=lambda repetition: repetition.start)
+
+
+def _is_garbled(char: str) -> bool:
+    if char in "\t\n\r":
+        return False
+    return char == "\ufffd" or unicodedata.category(char) in GARBLED_CATEGORIES
+
+
+def find_garbled(text: str, max_ratio: float = MAX_GARBLED_RATIO, min_chars: int = GARBLED_MIN_CHARS) -> GarbledText|None:
+    """
+    检查文本中乱码字符（解码失败的替换符、控制字符、私用区和未分配码位）的比例
+
+    Args:
+        text: 要检测的文本
+        max_ratio: 乱码字符的最大比例
+        min_chars: 参与检测的最少字符数，文本更短时不判断
+
+    Returns:
+        乱码比例超过max_ratio时返回GarbledText，否则返回None
+    """
+    if len(text) < min_chars:
+        return None
+    garbled = sum(map(_is_garbled, text))
+    if garbled <= max_ratio * len(text):
+        return None
+    return GarbledText(0, len(text), garbled, 1)
+
+
+class DegenerationMonitor:
+    """
+    流式输出的增量退化检测：逐段追加模型输出，定期检查最近的输出中是否出现连续重复或乱码
+
+    每次只检查最近window_chars个字符，总耗时与输出长度成线性关系。
+    跨度超过窗口的重复留给输出完成后对全文的检查。
+    """
+
+    def __init__(self, check_chars: int = STREAM_CHECK_CHARS, window_chars: int = STREAM_WINDOW_CHARS):
+        """
+        Args:
+            check_chars: 两次检查之间至少新增的字符数
+            window_chars: 每次检查的最近字符数
+        """
+        self.check_chars = check_chars
+        self.window_chars = window_chars
+        self.text = ""
+        self.chunks = 0
+        self._checked = 0
+
+    def feed(self, chunk: str) -> Repetition|GarbledText|None:
+        """
+        追加一段输出，距上次检查新增足够多的字符时检查最近的输出
+
+        Args:
+            chunk: 新收到的输出片段
+
+        Returns:
+            发现退化时返回Repetition或GarbledText（偏移和行号相对于全部输出），否则返回None
+        """
+        self.text += chunk
+        self.chunks += 1
+        if len(self.text) - self._checked < self.check_chars:
+            return None
+        self._checked = len(self.text)
+
+        base = max(0, len(self.text) - self.window_chars)
+        if base:
+            # 窗口从完整的一行开始，避免被截断的行参与整行重复的比较
+            base = min(self.text.find("\n", base) + 1 or base, len(self.text))
+        window = self.text[base:]
+        # 最后一行可能还没有输出完整，只检查行内重复
+        last_newline = window.rfind("\n") + 1
+        found = find_repetition(window[:last_newline]) if last_newline else None
+        if found is None:
+            found = find_repetition(window[last_newline:], line_repeats=None)
+            if found is not None:
+                found.start += last_newline
+                found.end += last_newline
+                found.line += window.count("\n", 0, last_newline)
+        if found is None:
+            found = find_garbled(window)
+        if found is not None:
+            found.start += base
+            found.end += base
+            found.line += self.text.count("\n", 0, base)
+        return found
@@ -0,0 +1,301 @@
+"""
+常驻转换服务：通过本地HTTP接口提交文档、查询状态和获取Markdown
+
+服务进程只启动一次，视觉模型的HTTP连接、渲染进程池和页面缓存在所有任务之间保持可用，
+所有任务的页面共享一个并发上限（MAX_WORKERS或--max-workers）。
+
+接口:
+    POST   /jobs?name=文件名[&hybrid=1]   请求体为文件内容；或Content-Type为application/json，
+                                          请求体为 {"path": "本机文件路径", "name": ..., "hybrid": ...}
+                                          （路径提交需要用--path-root或SERVER_PATH_ROOT指定允许读取的目录）
+    GET    /jobs                          所有任务的状态
+    GET    /jobs/<任务ID>                  任务状态和页面进度
+    GET    /jobs/<任务ID>/markdown         转换结果（任务未结束时返回409）
+    DELETE /jobs/<任务ID>                  取消任务
+    GET    /health                        服务状态
+    GET    /metrics                       Prometheus文本格式的运行指标
+
+用法:
+    python server.py [--port 端口] [--max-workers 并发数] [--path-root 目录] [--stub]
+"""
+import os
+import sys
+import json
+import uuid
+import argparse
+from urllib.parse import urlsplit, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from dotenv import load_dotenv
+
+from job_manager import JobManager, store_upload, submit_document, STATUS_LABELS, DONE, PARTIAL, UPLOAD_DIR, MARKDOWN_DIR
+from metrics import get_run_metrics
+
+# 加载环境变量
+load_dotenv()
+
+# 上传文件的最大字节数
+MAX_UPLOAD_BYTES = int(float(os.environ.get("MAX_UPLOAD_MB", 200)) * 1024 * 1024)
+
+
+def job_to_dict(job) -> dict:
+    """
+    把任务转换为接口返回的JSON对象
+    """
+    return {
+        "id": job.id,
+        "name": job.name,
+        "status": job.status,
+        "status_label": STATUS_LABELS[job.status],
+        "pages": {"done": job.done_pages, "total": job.total_pages},
+        "reused": job.reused,
+        "error": job.error,
+        "submitted": job.submitted,
+        "finished": job.finished,
+        "markdown": f"/jobs/{job.id}/markdown" if job.status in (DONE, PARTIAL) else None,
+    }
+
+
+def is_enabled(value) -> bool:
+    return str(value).lower() in ("1", "true", "yes")
+
+
+def is_under(path: str, root: str) -> bool:
+    """
+    判断路径（解析符号链接后）是否位于指定目录下
+    """
+    path = os.path.realpath(path)
+    root = os.path.realpath(root)
+    return os.path.commonpath([path, root]) == root
+
+
+def create_server(manager: JobManager, host: str = "127.0.0.1", port: int = 8000,
+                  upload_dir: str = UPLOAD_DIR, markdown_dir: str = MARKDOWN_DIR,
+                  path_root: str|None = None) -> ThreadingHTTPServer:
+    """
+    创建转换服务的HTTP服务器（调用serve_forever开始处理请求）
+
+    Args:
+        manager: 所有请求共享的任务管理器
+        host: 监听地址
+        port: 监听端口，0表示随机选择
+        upload_dir: 上传文件目录
+        markdown_dir: 转换结果目录
+        path_root: 允许以本机路径提交的文件所在目录，为None时不接受路径提交
+
+    Returns:
+        HTTP服务器
+    """
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def send_body(self, status: int, body: bytes, content_type: str):
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def send_json(self, status: int, payload):
+            self.send_body(status, json.dumps(payload, ensure_ascii=False).encode("utf-8"), "application/json; charset=utf-8")
+
+        def send_error_json(self, status: int, message: str):
+            self.send_json(status, {"error": message})
+
+        def route(self):
+            """
+            解析请求路径，返回 (路径段列表, 查询参数)
+            """
+            url = urlsplit(self.path)
+            parts = [part for part in url.path.split("/") if part]
+            query = {name: values[-1] for name, values in parse_qs(url.query).items()}
+            return parts, query
+
+        def find_job(self, job_id: str):
+            job = manager.get(job_id)
+            if job is None:
+                self.send_error_json(404, f"任务 {job_id} 不存在")
+            return job
+
+        def do_GET(self):
+            parts, _ = self.route()
+            if parts == ["health"]:
+                counts = {}
+                for job in list(manager.jobs.values()):
+                    counts[job.status] = counts.get(job.status, 0) + 1
+                self.send_json(200, {"status": "ok", "max_workers": manager.max_workers, "jobs": counts})
+            elif parts == ["metrics"]:
+                self.send_body(200, get_run_metrics().prometheus().encode("utf-8"), "text/plain; version=0.0.4; charset=utf-8")
+            elif parts == ["jobs"]:
+                self.send_json(200, [job_to_dict(job) for job in list(manager.jobs.values())])
+            elif len(parts) == 2 and parts[0] == "jobs":
+                job = self.find_job(parts[1])
+                if job is not None:
+                    self.send_json(200, job_to_dict(job))
+            elif len(parts) == 3 and parts[0] == "jobs" and parts[2] == "markdown":
+                job = self.find_job(parts[1])
+                if job is None:
+                    return
+                if job.status not in (DONE, PARTIAL):
+                    self.send_json(409, {"error": f"任务{STATUS_LABELS[job.status]}，没有可用的转换结果", **job_to_dict(job)})
+                    return
+                with open(job.output_path, "rb") as markdown_file:
+                    content = markdown_file.read()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/markdown; charset=utf-8")
+                self.send_header("Content-Length", str(len(content)))
+                self.send_header("X-Job-Status", job.status)
+                self.end_headers()
+                self.wfile.write(content)
+            else:
+                self.send_error_json(404, "接口不存在")
+
+        def do_POST(self):
+            parts, query = self.route()
+            if parts != ["jobs"]:
+                self.send_error_json(404, "接口不存在")
+                return
+            length = self.headers.get("Content-Length")
+            if length is None:
+                self.send_error_json(411, "缺少Content-Length")
+                return
+            try:
+                length = int(length)
+            except ValueError:
+                length = -1
+            if length < 0:
+                self.send_error_json(400, f"Content-Length格式错误: {self.headers.get('Content-Length')}")
+                self.close_connection = True
+                return
+            if length > MAX_UPLOAD_BYTES:
+                self.send_error_json(413, f"文件超过上传上限 {MAX_UPLOAD_BYTES // (1024 * 1024)} MB")
+                # 没有读取请求体，关闭连接
+                self.close_connection = True
+                return
+            body = self.rfile.read(length)
+
+            try:
+                if self.headers.get("Content-Type", "").startswith("application/json"):
+                    # 提交本机上的文件路径，不经过HTTP传输文件内容
+                    request = json.loads(body or b"{}")
+                    if not isinstance(request, dict):
+                        self.send_error_json(400, "请求格式错误: 请求体应为JSON对象")
+                        return
+                    if path_root is None:
+                        self.send_error_json(403, "服务未开启本机路径提交（启动时用--path-root指定允许读取的目录）")
+                        return
+                    source_path = request.get("path")
+                    name = request.get("name")
+                    if not isinstance(source_path, str) or not isinstance(name, (str, type(None))):
+                        self.send_error_json(400, "请求格式错误: path和name应为字符串")
+                        return
+                    if not is_under(source_path, path_root):
+                        self.send_error_json(403, f"只能提交 {path_root} 下的文件: {source_path}")
+                        return
+                    if not os.path.isfile(source_path):
+                        self.send_error_json(400, f"文件不存在: {source_path}")
+                        return
+                    name = name or os.path.basename(source_path)
+                    file_path = store_upload(source_path, name, upload_dir)
+                    hybrid = is_enabled(request.get("hybrid", query.get("hybrid")))
+                else:
+                    name = query.get("name")
+                    if not name:
+                        self.send_error_json(400, "上传文件内容时需要用name参数给出文件名（用于判断文件类型）")
+                        return
+                    os.makedirs(upload_dir, exist_ok=True)
+                    temp_path = os.path.join(upload_dir, f"{uuid.uuid4().hex}.tmp")
+                    try:
+                        with open(temp_path, "wb") as temp_file:
+                            temp_file.write(body)
+                        file_path = store_upload(temp_path, os.path.basename(name), upload_dir)
+                    finally:
+                        os.remove(temp_path)
+                    hybrid = is_enabled(query.get("hybrid"))
+                job = submit_document(file_path, os.path.basename(name), hybrid, markdown_dir, manager)
+            except ValueError as e:
+                self.send_error_json(400, f"请求格式错误: {str(e)}")
+                return
+            # 已有完成结果时返回200，否则返回202，客户端轮询任务状态
+            self.send_json(200 if job.status == DONE else 202, job_to_dict(job))
+
+        def do_DELETE(self):
+            parts, _ = self.route()
+            if len(parts) != 2 or parts[0] != "jobs":
+                self.send_error_json(404, "接口不存在")
+                return
+            job = self.find_job(parts[1])
+            if job is not None:
+                cancelled = manager.cancel(job.id)
+                self.send_json(200, {"cancelled": cancelled, **job_to_dict(job)})
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    return server
+
+
+def warm_up():
+    """
+    预先导入各类文档的处理模块并启动渲染进程，第一个任务不必承担这些开销
+    """
+    # 转换模块按需导入PyMuPDF和python-pptx，常驻服务在启动时一次性导入
+    import fitz  # noqa: F401
+    import pptx  # noqa: F401
+    import pdf_to_markdown  # noqa: F401
+    from page_cache import get_page_cache
+    from render_pool import get_render_pool
+
+    get_page_cache()
+    render_pool = get_render_pool()
+    if render_pool is not None:
+        render_pool.warm_up()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="常驻转换服务，通过HTTP接口提交文档、查询状态和获取Markdown")
+    parser.add_argument("--host", default="127.0.0.1", help="监听地址")
+    parser.add_argument("--port", type=int, default=8000, help="监听端口")
+    parser.add_argument("-w", "--max-workers", type=int, help="所有任务共享的最大并发请求数，默认从环境变量MAX_WORKERS获取")
+    parser.add_argument("--upload-dir", default=UPLOAD_DIR, help="上传文件目录")
+    parser.add_argument("--markdown-dir", default=MARKDOWN_DIR, help="转换结果目录")
+    parser.add_argument("--path-root", default=os.environ.get("SERVER_PATH_ROOT") or None,
+                        help="允许以本机路径提交的文件所在目录（默认从环境变量SERVER_PATH_ROOT获取，留空时只接受上传文件内容）")
+    parser.add_argument("--stub", action="store_true", help="使用本地替身模型服务（benchmarks/stub_server.py），用于本地测试，不消耗API额度")
+    parser.add_argument("--stub-latency", default="0.5", help="替身服务的延迟分布，格式见benchmarks/stub_server.py")
+    args = parser.parse_args()
+
+    stub = None
+    if args.stub:
+        sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmarks"))
+        from stub_server import StubVisionServer
+
+        stub = StubVisionServer(latency=args.stub_latency, response_chars=1500).start()
+        os.environ["ZHIPUAI_BASE_URL"] = stub.base_url
+        os.environ.setdefault("OPENAI_API_KEY", "stub.key")
+        print(f"使用替身模型服务: {stub.base_url}")
+
+    warm_up()
+    manager = JobManager(args.max_workers)
+    server = create_server(manager, args.host, args.port, args.upload_dir, args.markdown_dir, args.path_root)
+    host, port = server.server_address[:2]
+    print(f"转换服务已启动: http://{host}:{port}（最大并发请求数: {manager.max_workers}）")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("正在停止转换服务...")
+    finally:
+        server.server_close()
+        from render_pool import get_render_pool
+        render_pool = get_render_pool()
+        if render_pool is not None:
+            render_pool.shutdown()
+        if stub is not None:
+            stub.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+import os
+import sys
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+sys.path.insert(0, os.path.join(ROOT_DIR, "benchmarks"))
+
+import pytest
+
+import page_cache
+from stub_server import StubVisionServer
+
+
+@pytest.fixture
+def stub(monkeypatch, tmp_path):
+    """
+    启动本地替身模型服务并让视觉模型请求指向它，返回启动函数（参数同StubVisionServer）
+
+    每个测试使用独立的页面缓存目录，重试的退避时间缩短到几毫秒。
+    """
+    servers = []
+
+    def start(**options):
+        server = StubVisionServer(**options).start()
+        servers.append(server)
+        monkeypatch.setenv("ZHIPUAI_BASE_URL", server.base_url)
+        return server
+
+    monkeypatch.setenv("OPENAI_API_KEY", "test.key")
+    monkeypatch.setenv("PAGE_CACHE_DIR", str(tmp_path / "cache"))
+    monkeypatch.setenv("RETRY_BASE_DELAY", "0.01")
+    monkeypatch.setenv("RETRY_JITTER", "0")
+    monkeypatch.setenv("RENDER_WORKERS", "0")
+    # 页面缓存是进程内单例，重新按本测试的缓存目录创建
+    monkeypatch.setattr(page_cache, "_page_cache", None)
+    yield start
+    for server in servers:
+        server.stop()
+
+
+@pytest.fixture
+def make_pdf(tmp_path):
+    """
+    返回生成测试PDF的函数：每页一段不同的文字（包含文件名，不同文件名的内容不同），参数为页数和文件名；
+    给出text时每页都是相同的文字，text为列表时依次作为每页的文字
+    """
+    import fitz
+
+    def make(pages: int = 3, name: str = "document.pdf", directory=None, text: str|list|None = None) -> str:
+        path = os.path.join(str(directory or tmp_path), name)
+        document = fitz.open()
+        for index in range(pages):
+            page = document.new_page()
+            if text is not None:
+                page.insert_text((72, 72), text[index] if isinstance(text, list) else text, fontsize=14)
+            else:
+                page.insert_text((72, 72 + index * 40), f"{name} page {index + 1}: " + "lorem ipsum " * (index + 3), fontsize=14)
+        document.save(path)
+        document.close()
+        return path
+
+    return make
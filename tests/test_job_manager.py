@@ -0,0 +1,85 @@
+import os
+import time
+
+import page_cache
+from job_manager import JobManager, submit_document, store_upload, DONE
+
+
+def wait_finished(job, timeout=20):
+    deadline = time.time() + timeout
+    while not job.is_finished:
+        assert time.time() < deadline, f"任务 {job.id} 没有在{timeout}秒内结束"
+        time.sleep(0.02)
+    return job
+
+
+def test_uploads_are_stored_by_content(make_pdf, tmp_path):
+    upload_dir = str(tmp_path / "upload")
+    (tmp_path / "a").mkdir()
+    (tmp_path / "b").mkdir()
+    first = make_pdf(1, "handout.pdf", tmp_path / "a")
+    other = make_pdf(2, "handout.pdf", tmp_path / "b")
+    stored = store_upload(first, upload_dir=upload_dir)
+    # 同名的不同文件不会互相覆盖，相同内容只保存一份并沿用第一次的文件名
+    assert store_upload(other, upload_dir=upload_dir) != stored
+    assert store_upload(first, "copy.pdf", upload_dir=upload_dir) == stored
+    assert os.path.basename(stored) == "handout.pdf"
+
+
+def test_concurrent_submissions_of_same_document_share_one_conversion(stub, make_pdf, tmp_path):
+    model = stub(latency=0.1)
+    manager = JobManager(max_workers=2)
+    markdown_dir = str(tmp_path / "markdown")
+    path = make_pdf(3)
+    jobs = [submit_document(path, f"user{index}.pdf", markdown_dir=markdown_dir, manager=manager) for index in range(3)]
+    assert len({job.id for job in jobs}) == 1 and jobs[0].refs == 3
+    wait_finished(jobs[0])
+    assert jobs[0].status == DONE and model.requests == 3
+
+    # 已完成的文档再次提交时立即返回已有结果
+    again = submit_document(path, markdown_dir=markdown_dir, manager=manager)
+    assert again.status == DONE and again.output_path == jobs[0].output_path
+    assert model.requests == 3
+
+
+def test_finished_jobs_are_pruned(stub, make_pdf, tmp_path):
+    model = stub()
+    manager = JobManager(max_workers=2, max_finished=2)
+    markdown_dir = str(tmp_path / "markdown")
+    paths = [make_pdf(1, f"doc{index}.pdf") for index in range(4)]
+    jobs = [wait_finished(submit_document(path, markdown_dir=markdown_dir, manager=manager)) for path in paths]
+    assert all(job.status == DONE for job in jobs)
+    # 提交第4个任务时最早结束的任务被移除
+    assert set(manager.jobs) == {job.id for job in jobs[1:]}
+    assert jobs[0].key not in manager._by_key
+
+    # 被移除的文档再次提交时按磁盘上的输出文件直接返回结果
+    again = submit_document(paths[0], markdown_dir=markdown_dir, manager=manager)
+    assert again.status == DONE and again.reused
+    assert model.requests == 4
+    assert set(manager.jobs) == {jobs[2].id, jobs[3].id, again.id}
+
+
+def test_resubmit_after_cancel_resumes_from_journal(stub, make_pdf, tmp_path, monkeypatch):
+    model = stub(latency=0.1)
+    manager = JobManager(max_workers=1)
+    markdown_dir = str(tmp_path / "markdown")
+    path = make_pdf(10)
+    job = submit_document(path, markdown_dir=markdown_dir, manager=manager)
+    deadline = time.time() + 20
+    while job.done_pages < 2:
+        assert time.time() < deadline, "前两页没有在超时时间内完成"
+        time.sleep(0.02)
+    assert manager.cancel(job.id)
+    wait_finished(job)
+    requested = model.requests
+    # 换用空的页面缓存，已完成的页面只能从检查点日志恢复
+    monkeypatch.setenv("PAGE_CACHE_DIR", str(tmp_path / "empty-cache"))
+    monkeypatch.setattr(page_cache, "_page_cache", None)
+
+    # 再次提交时从检查点日志继续，只请求取消时未完成的页面
+    again = wait_finished(submit_document(path, markdown_dir=markdown_dir, manager=manager))
+    assert again.status == DONE
+    assert model.requests - requested <= 10 - 2
+    with open(again.output_path, "r", encoding="utf-8") as output_file:
+        assert output_file.read().count("页面内容") == 10
@@ -0,0 +1,63 @@
+from metrics import RunMetrics, StageSamples
+
+
+def test_stage_samples_are_bounded():
+    samples = StageSamples(capacity=100)
+    for value in range(10000):
+        samples.add(float(value))
+    summary = samples.summary()
+    assert len(samples.samples) == 100
+    assert summary["count"] == 10000
+    assert summary["total"] == sum(range(10000))
+    assert summary["max"] == 9999
+
+
+def test_page_timings_keep_most_recent_finished_pages():
+    metrics = RunMetrics(max_pages=5)
+    for page in range(1, 21):
+        with metrics.page("doc.pdf", page):
+            metrics.record("request", 0.01)
+    metrics.record_failure("doc.pdf", 21)
+
+    report = metrics.report()
+    assert report["pages"]["completed"] == 20
+    assert report["pages"]["failed"] == 1
+    assert [timing["page"] for timing in report["page_timings"]] == [17, 18, 19, 20, 21]
+    assert report["dropped_page_timings"] == 16
+    assert report["stages"]["page"]["count"] == 21
+
+
+def test_running_pages_are_not_evicted():
+    metrics = RunMetrics(max_pages=2)
+    with metrics.page("doc.pdf", 1):
+        for page in range(2, 6):
+            with metrics.page("doc.pdf", page):
+                pass
+        assert ("doc.pdf", 1, "") in metrics.pages
+    assert len(metrics.pages) == 2
+
+
+def test_same_named_documents_are_kept_apart_by_job():
+    metrics = RunMetrics()
+    for run in ("job1", "job2"):
+        with metrics.page("report.pdf", 1, run):
+            metrics.record("request", 0.5)
+    metrics.record_retry("report.pdf", 1, 2.0, "job2")
+
+    timings = {timing["job"]: timing for timing in metrics.report()["page_timings"]}
+    assert set(timings) == {"job1", "job2"}
+    assert timings["job1"]["stages"] == {"request": 0.5}
+    assert timings["job2"]["stages"] == {"request": 0.5, "retry_wait": 2.0}
+    assert metrics.report()["pages"]["completed"] == 2
+
+
+def test_eviction_bookkeeping_stays_bounded():
+    metrics = RunMetrics(max_pages=1000)
+    with metrics.page("big.pdf", 0):
+        for page in range(1, 5001):
+            with metrics.page("big.pdf", page):
+                pass
+    # 已结束页面的登记随页面一起丢弃，不会无限增长
+    assert len(metrics.pages) == 1000 and len(metrics._finished) == 1000
+    assert metrics.dropped_pages == 4001
+    assert ("big.pdf", 0, "") in metrics.pages
@@ -0,0 +1,510 @@
+import os
+import json
+import time
+import asyncio
+import threading
+
+from async_engine import DocumentJob, RequestScheduler, run_jobs
+from batch_job import export_batch, run_batch_locally, ingest_batch
+from job_manager import JobManager, CANCELLED
+from metrics import get_run_metrics
+from pdf_to_markdown import convert_pdf_to_markdown
+from rate_limiter import get_rate_limiter
+
+CONTENT = "# 测试页面\n\n页面内容"
+
+
+def convert(pdf_path, output_path, max_workers=2, timeout=30):
+    """
+    在线程中转换PDF，超时未结束时判为死锁
+    """
+    thread = threading.Thread(target=convert_pdf_to_markdown, args=(pdf_path, output_path, None, max_workers), daemon=True)
+    thread.start()
+    thread.join(timeout)
+    assert not thread.is_alive(), "转换没有在超时时间内结束"
+    with open(output_path, "r", encoding="utf-8") as output_file:
+        return output_file.read()
+
+
+def test_entry_points_do_not_import_heavy_dependencies():
+    from bench_import import BUDGETS, measure_import, check_image_conversion
+
+    # 只检查提前导入的依赖，导入耗时的预算由benchmarks/bench_import.py检查
+    for module, budget in BUDGETS.items():
+        _, loaded = measure_import(module)
+        assert not set(loaded) & set(budget["forbidden"]), f"导入{module}时加载了{loaded}"
+    assert check_image_conversion() == []
+
+
+def test_render_workers_do_not_rebuild_the_gradio_app():
+    import sys
+    import subprocess
+    from conftest import ROOT_DIR
+
+    # spawn方式的渲染进程以__mp_main__的名字重新执行启动脚本
+    code = ("import runpy, sys; runpy.run_path('app.py', run_name='__mp_main__'); "
+            "print(','.join(name for name in ('gradio', 'gradio_ui') if name in sys.modules))")
+    completed = subprocess.run([sys.executable, "-c", code], cwd=ROOT_DIR, capture_output=True, text=True)
+    assert completed.returncode == 0, completed.stderr
+    assert completed.stdout.strip() == ""
+
+
+def test_retryable_errors_are_retried(stub, make_pdf, tmp_path):
+    server = stub(content=CONTENT, fail_first=2)
+    retries = get_run_metrics().retries
+    output = convert(make_pdf(1), str(tmp_path / "out.md"))
+    assert output.count("页面内容") == 1
+    assert server.requests == 3 and server.errors == 2
+    assert get_run_metrics().retries == retries + 2
+
+
+def test_throttled_responses_are_counted_by_shared_limiter(stub, make_pdf, tmp_path):
+    stub(content=CONTENT, fail_first=2)
+    limiter = get_rate_limiter(os.environ["OPENAI_API_KEY"])
+    throttled = limiter.throttled_count
+    convert(make_pdf(1), str(tmp_path / "out.md"))
+    assert limiter.throttled_count == throttled + 2
+
+
+def test_adaptive_concurrency_halves_on_throttle_and_grows_back():
+    from rate_limiter import AdaptiveConcurrency
+
+    adaptive = AdaptiveConcurrency(initial=8, cooldown=60)
+    assert all(adaptive.try_acquire() for _ in range(8))
+    assert not adaptive.try_acquire()
+    adaptive.release(throttled=True)
+    # 冷却时间内的第二次限流不再减半
+    adaptive.release(throttled=True)
+    assert adaptive.limit == 4
+    for _ in range(6):
+        adaptive.release()
+    assert adaptive.in_flight == 0
+    assert 5 < adaptive.limit < 6
+
+
+def test_token_bucket_reserves_ahead_and_refunds():
+    from rate_limiter import TokenBucket
+
+    bucket = TokenBucket(60)
+    assert bucket.reserve(60) == 0
+    assert 1.9 < bucket.reserve(2) <= 2
+    bucket.adjust(-2)
+    assert 0.9 < bucket.reserve(1) <= 1
+
+
+def test_exhausted_retries_leave_placeholder_and_report(stub, make_pdf, tmp_path, monkeypatch):
+    monkeypatch.setenv("RETRY_MAX_ATTEMPTS", "2")
+    server = stub(content=CONTENT, error_rate=1.0)
+    output_path = str(tmp_path / "out.md")
+    output = convert(make_pdf(2), output_path)
+    assert "第 1 页转换失败" in output and "第 2 页转换失败" in output
+    assert server.requests == 4
+    with open(output_path + ".failed.json", "r", encoding="utf-8") as report_file:
+        report = json.load(report_file)
+    assert [(item["page"], item["status_code"], item["attempts"]) for item in report] == [(1, 503, 2), (2, 503, 2)]
+
+
+def test_duplicate_pages_reuse_result_while_original_retries(stub, make_pdf, tmp_path):
+    # 相同的页面等待第一页的结果；第一页遇到503退避时，等待的页面不能占住全部并发名额
+    server = stub(content=CONTENT, fail_first=1)
+    output = convert(make_pdf(6, text="Identical page " * 5), str(tmp_path / "out.md"), max_workers=2)
+    assert output.count("页面内容") == 6
+    assert server.requests == 2
+
+
+def test_pages_differing_in_one_number_are_not_reused(stub, make_pdf, tmp_path):
+    server = stub(content=CONTENT)
+    pages = ["Quarterly revenue: 42 million", "Quarterly revenue: 47 million"]
+    output = convert(make_pdf(2, text=pages), str(tmp_path / "out.md"))
+    assert output.count("页面内容") == 2
+    assert server.requests == 2
+
+
+def test_near_duplicate_reuse_is_opt_in(stub, make_pdf, tmp_path, monkeypatch):
+    monkeypatch.setenv("DUPLICATE_THRESHOLD", "0.05")
+    server = stub(content=CONTENT)
+    pages = ["Quarterly revenue: 42 million", "Quarterly revenue: 47 million"]
+    output = convert(make_pdf(2, text=pages), str(tmp_path / "out.md"))
+    assert output.count("页面内容") == 2
+    assert server.requests == 1
+
+
+def test_page_with_short_formula_is_not_blank(stub, tmp_path):
+    import fitz
+    from render_policy import RenderPolicy
+
+    pdf_path = str(tmp_path / "formula.pdf")
+    with fitz.open() as document:
+        document.new_page().insert_text((300, 400), "x = 1", fontsize=11)
+        document.save(pdf_path)
+    with fitz.open(pdf_path) as document:
+        image, info = RenderPolicy().render(document.load_page(0))
+    assert not info["blank"] and image
+
+    server = stub(content=CONTENT)
+    assert convert(pdf_path, str(tmp_path / "out.md")).count("页面内容") == 1
+    assert server.requests == 1
+
+
+def test_render_policy_adapts_resolution_colour_crop_and_size():
+    import fitz
+    from render_policy import RenderPolicy, RenderStats
+
+    policy = RenderPolicy()
+    with fitz.open() as document:
+        page = document.new_page()
+        for line in range(20):
+            page.insert_text((72, 72 + line * 10), "Dense footnote text in a very small font size.", fontsize=6)
+        page = document.new_page()
+        for line in range(6):
+            page.insert_text((72, 72 + line * 30), "Large body text for a slide.", fontsize=20)
+        document.new_page().draw_rect(fitz.Rect(100, 100, 500, 500), color=(1, 0, 0), fill=(1, 0, 0))
+        small, large, colour = document[0], document[1], document[2]
+
+        small_dpi, _ = policy.choose_dpi(small)
+        large_dpi, _ = policy.choose_dpi(large)
+        assert small_dpi > large_dpi >= policy.min_dpi
+        assert policy.choose_dpi(colour) == (policy.dpi, "无文本层")
+
+        # 黑白文字页渲染为灰度并裁掉边距，彩色页保留颜色
+        _, small_info = policy.render(small)
+        assert small_info["grayscale"] and small_info["cropped"] and small_info["dpi"] == small_dpi
+        _, colour_info = policy.render(colour)
+        assert not colour_info["grayscale"]
+
+        # 超过字节上限时降低JPEG质量
+        data, info = RenderPolicy(max_bytes=1).render(colour)
+        assert info["format"] == "jpeg" and info["quality"] < policy.quality and info["bytes"] == len(data)
+
+    stats = RenderStats()
+    stats.add(0, small_info)
+    stats.add(1, colour_info)
+    assert stats.summary().startswith("渲染: 2 页")
+
+
+def test_hybrid_mode_converts_text_pages_locally(stub, tmp_path, capsys):
+    import io
+    import fitz
+    from PIL import Image, ImageDraw
+
+    server = stub(content=CONTENT)
+    pdf_path = str(tmp_path / "hybrid.pdf")
+    # 第二页是一张柱状图图片，没有文本层
+    chart = Image.new("RGB", (400, 300), "white")
+    draw = ImageDraw.Draw(chart)
+    for index, height in enumerate((120, 200, 80, 260)):
+        draw.rectangle((40 + index * 90, 290 - height, 100 + index * 90, 290), fill=(30, 60, 200))
+    buffer = io.BytesIO()
+    chart.save(buffer, "PNG")
+    with fitz.open() as document:
+        page = document.new_page()
+        page.insert_text((72, 72), "Introduction", fontsize=20)
+        for line in range(12):
+            page.insert_text((72, 110 + line * 16), f"Line {line + 1} of a born-digital paragraph with plain text.", fontsize=11)
+        document.new_page().insert_image(fitz.Rect(72, 72, 520, 720), stream=buffer.getvalue())
+        document.save(pdf_path)
+
+    output_path = str(tmp_path / "hybrid.md")
+    convert_pdf_to_markdown(pdf_path, output_path, None, 2, True)
+    with open(output_path, "r", encoding="utf-8") as output_file:
+        output = output_file.read()
+    # 纯文本页面在本地转换，只有图片页请求视觉模型
+    assert server.requests == 1
+    assert "Introduction" in output and "Line 12 of a born-digital paragraph" in output
+    assert output.count("页面内容") == 1
+    summary = capsys.readouterr().out
+    assert "页面路由:" in summary and "[1]" in summary and "[2]" in summary
+
+
+def test_deck_is_exported_once_and_hidden_slides_are_skipped(make_pdf, tmp_path, monkeypatch):
+    import fitz
+    import ppt_render
+    from render_policy import get_render_policy
+
+    # 较早版本的LibreOffice导出时跳过隐藏的幻灯片：3张幻灯片只有2页
+    pdf_path = make_pdf(2, "deck.pdf")
+    exports = []
+
+    def export_deck_pdf(ppt_path, output_dir):
+        exports.append(ppt_path)
+        return pdf_path
+
+    monkeypatch.setattr(ppt_render, "export_deck_pdf", export_deck_pdf)
+    deck = ppt_render.DeckRenderer("deck.pptx", str(tmp_path), [False, True, False])
+    assert deck.render(1) is None
+    rendered = [deck.render(0), deck.render(2)]
+    deck.close()
+    assert exports == ["deck.pptx"] and deck.method == "LibreOffice"
+    with fitz.open(pdf_path) as document:
+        expected = [get_render_policy().render(document[page_num])[1]["digest"] for page_num in range(2)]
+    assert [info["digest"] for _, info in rendered] == expected
+
+
+def test_picture_free_slides_are_converted_locally(stub, tmp_path):
+    import io
+    from pptx import Presentation
+    from pptx.util import Inches
+    from PIL import Image
+    from pdf_to_markdown import convert_ppt_to_markdown
+    from ppt_render import slide_to_markdown
+
+    server = stub(content=CONTENT)
+    presentation = Presentation()
+    slide = presentation.slides.add_slide(presentation.slide_layouts[1])
+    slide.shapes.title.text = "Agenda"
+    slide.placeholders[1].text = "First topic"
+    slide = presentation.slides.add_slide(presentation.slide_layouts[5])
+    slide.shapes.title.text = "Results"
+    table = slide.shapes.add_table(2, 2, Inches(1), Inches(2), Inches(4), Inches(1)).table
+    for row, values in enumerate((("Name", "Score"), ("A", "42"))):
+        for col, value in enumerate(values):
+            table.cell(row, col).text = value
+    ppt_path = str(tmp_path / "deck.pptx")
+    presentation.save(ppt_path)
+
+    output_path = str(tmp_path / "deck.md")
+    convert_ppt_to_markdown(ppt_path, output_path, None, 2, True)
+    with open(output_path, "r", encoding="utf-8") as output_file:
+        output = output_file.read()
+    assert server.requests == 0
+    assert "Agenda" in output and "First topic" in output
+    assert "| Name | Score |" in output and "| A | 42 |" in output
+
+    # 含有图片的幻灯片需要视觉模型
+    buffer = io.BytesIO()
+    Image.new("RGB", (32, 32), "red").save(buffer, "PNG")
+    slide = presentation.slides.add_slide(presentation.slide_layouts[6])
+    slide.shapes.add_picture(buffer, Inches(1), Inches(1))
+    assert slide_to_markdown(slide) is None
+
+
+def make_images(directory, count):
+    from PIL import Image
+
+    paths = []
+    for index in range(count):
+        path = os.path.join(str(directory), f"image{index + 1}.png")
+        Image.new("RGB", (64, 64), (index * 60, 255, 255)).save(path)
+        paths.append(path)
+    return paths
+
+
+def test_failed_images_keep_their_position_and_are_reported(stub, tmp_path, monkeypatch):
+    import vision_api
+
+    monkeypatch.setenv("RETRY_MAX_ATTEMPTS", "2")
+    monkeypatch.setenv("PACK_PAGES", "1")
+    stub(content=CONTENT, error_rate=1.0)
+    paths = make_images(tmp_path, 3) + [str(tmp_path / "missing.png")]
+    results, failures = vision_api.process_images(paths, max_workers=2)
+    assert results == [None, None, None, None]
+    assert sorted((path, attempts) for path, _, attempts in failures) == sorted([(path, 2) for path in paths[:3]] + [(paths[3], 0)])
+
+
+def test_repeated_image_output_is_retried(stub, tmp_path, monkeypatch):
+    import vision_api
+
+    monkeypatch.setenv("PACK_PAGES", "1")
+    server = stub(content=CONTENT)
+    calls = []
+    handle_text_content = vision_api.handle_text_content
+
+    def repeat_once(text):
+        calls.append(text)
+        if len(calls) == 1:
+            raise vision_api.Translate_Error("重复内容")
+        return handle_text_content(text)
+
+    monkeypatch.setattr(vision_api, "handle_text_content", repeat_once)
+    results, failures = vision_api.process_images(make_images(tmp_path, 1))
+    assert results == [CONTENT] and failures == []
+    assert server.requests == 2
+
+
+def test_cached_pages_are_not_requested_again(stub, make_pdf, tmp_path):
+    server = stub(content=CONTENT)
+    pdf_path = make_pdf(3)
+    convert(pdf_path, str(tmp_path / "first.md"))
+    assert server.requests == 3
+    output = convert(pdf_path, str(tmp_path / "second.md"))
+    assert output.count("页面内容") == 3
+    assert server.requests == 3
+
+
+def test_page_cache_keeps_running_size_and_evicts_least_recently_used(tmp_path):
+    from page_cache import PageCache
+
+    cache = PageCache(str(tmp_path / "cache"), max_bytes=25)
+    cache.put("a", "x" * 10)
+    cache.put("b", "x" * 10)
+    # 覆盖已有条目不重复计入大小
+    cache.put("a", "y" * 10)
+    assert cache.stats()["bytes"] == cache._total == 20
+    assert asyncio.run(cache.get_async("b")) == "x" * 10
+    asyncio.run(cache.put_async("c", "z" * 10))
+    # 超出上限时淘汰最久未使用的a
+    assert cache.get("a") is None and cache.get("b") is not None
+    assert cache.stats()["bytes"] == cache._total == 20
+
+    # 重新打开时从数据库统计已有的大小
+    reopened = PageCache(str(tmp_path / "cache"), max_bytes=25)
+    reopened.put("d", "w" * 10)
+    assert reopened.stats() == {"hits": 0, "misses": 0, "entries": 2, "bytes": 20}
+
+
+def test_resume_after_torn_journal_line_keeps_later_records(make_pdf, tmp_path):
+    from checkpoint import CheckpointJournal
+
+    pdf_path = make_pdf(4)
+    output_path = str(tmp_path / "out.md")
+    journal = CheckpointJournal(output_path, pdf_path)
+    journal.open(False)
+    journal.record(0, "第一页")
+    journal.close()
+    # 模拟写到一半时崩溃
+    with open(journal.path, "a", encoding="utf-8") as journal_file:
+        journal_file.write('{"type": "page", "page": 1, "sha')
+
+    journal = CheckpointJournal(output_path, pdf_path)
+    assert set(journal.open(True)) == {0}
+    journal.record(1, "第二页")
+    journal.record(2, "第三页")
+    journal.close()
+
+    pages = CheckpointJournal(output_path, pdf_path).load()
+    assert {page: content for page, (content, _) in pages.items()} == {0: "第一页", 1: "第二页", 2: "第三页"}
+
+
+def test_packed_results_are_not_served_to_single_page_runs(stub, make_pdf, tmp_path, monkeypatch):
+    server = stub(content="===PAGE 1===\n第一页\n===PAGE 2===\n第二页")
+    pdf_path = make_pdf(2)
+    monkeypatch.setenv("PACK_PAGES", "2")
+    monkeypatch.setenv("PACK_LINGER", "5")
+    output = convert(pdf_path, str(tmp_path / "packed.md"))
+    assert "第一页" in output and "第二页" in output
+    assert server.requests == 1
+
+    # 不打包时打包请求拆出的结果不命中缓存，按单页提示词重新请求
+    monkeypatch.setenv("PACK_PAGES", "1")
+    convert(pdf_path, str(tmp_path / "single.md"))
+    assert server.requests == 3
+
+    # 再次打包时命中单页请求的结果
+    monkeypatch.setenv("PACK_PAGES", "2")
+    convert(pdf_path, str(tmp_path / "packed-again.md"))
+    assert server.requests == 3
+
+
+def test_cancel_marks_pending_pages_and_releases_slots(stub, make_pdf, tmp_path, monkeypatch):
+    monkeypatch.setenv("ADAPTIVE_CONCURRENCY", "true")
+    stub(content=CONTENT, latency=0.2)
+    api_key = "cancel.key"
+    manager = JobManager(max_workers=1, api_key=api_key)
+    output_path = str(tmp_path / "out.md")
+    job = manager.submit(make_pdf(20), output_path)
+
+    deadline = time.time() + 20
+    while job.done_pages < 1:
+        assert time.time() < deadline, "第一页没有在超时时间内完成"
+        time.sleep(0.02)
+    assert manager.cancel(job.id)
+    while not job.is_finished:
+        assert time.time() < deadline, "任务没有在超时时间内结束"
+        time.sleep(0.02)
+
+    assert job.status == CANCELLED
+    assert job.done_pages == job.total_pages == 20
+    with open(output_path + ".failed.json", "r", encoding="utf-8") as report_file:
+        report = json.load(report_file)
+    assert report and all(item["error_type"] == "JobCancelledError" for item in report)
+    # 取消时正在等待或发送的请求归还了自适应并发名额
+    adaptive = get_rate_limiter(api_key).adaptive
+    while adaptive.in_flight:
+        assert time.time() < deadline, "自适应并发名额没有被归还"
+        time.sleep(0.02)
+
+
+def test_batch_export_run_and_ingest(stub, make_pdf, tmp_path):
+    server = stub(content=CONTENT)
+    pdf_path = make_pdf(3)
+    batch_path = str(tmp_path / "batch.jsonl")
+    results_path = str(tmp_path / "results.jsonl")
+    output_dir = tmp_path / "markdown"
+    output_dir.mkdir()
+
+    manifest_path = export_batch([pdf_path], batch_path, str(output_dir))
+    with open(batch_path, "r", encoding="utf-8") as batch_file:
+        custom_ids = [json.loads(line)["custom_id"] for line in batch_file]
+    assert len(custom_ids) == len(set(custom_ids)) == 3
+    assert server.requests == 0
+
+    run_batch_locally(batch_path, results_path)
+    assert server.requests == 3
+    assert ingest_batch(manifest_path, [results_path]) == 0
+    with open(output_dir / "document.md", "r", encoding="utf-8") as output_file:
+        assert output_file.read().count("页面内容") == 3
+
+    # 再次导出时custom_id不变，页面已写入缓存，不再需要请求
+    os.remove(batch_path)
+    export_batch([pdf_path], batch_path, str(output_dir))
+    with open(batch_path, "r", encoding="utf-8") as batch_file:
+        assert [json.loads(line)["custom_id"] for line in batch_file] == []
+
+
+def test_ordered_writer_flushes_pages_in_order_within_window(tmp_path):
+    from markdown_writer import OrderedMarkdownWriter
+
+    async def scenario():
+        output_path = str(tmp_path / "out.md")
+        writer = OrderedMarkdownWriter(output_path, 4, window=2)
+
+        def written():
+            with open(output_path, "r", encoding="utf-8") as output_file:
+                return output_file.read()
+
+        writer.put(1, "B")
+        assert written() == "" and writer.buffered == 1
+        # 第0页未完成时，第2页超出窗口需要等待
+        waiting = asyncio.ensure_future(writer.wait_for_slot(2))
+        await asyncio.sleep(0)
+        assert not waiting.done()
+        writer.put(0, "A")
+        # 前面的页面到齐后立即写出，不必等到转换结束
+        assert written() == "AB" and writer.buffered == 0
+        await asyncio.wait_for(waiting, 1)
+        writer.put(3, "D")
+        writer.put(2, "C")
+        writer.close()
+        assert written() == "ABCD"
+
+    asyncio.run(scenario())
+
+
+def test_blocked_document_does_not_stall_other_documents():
+    # 第一个文档的后续页面在admit中等待（例如重排窗口已满），第二个文档的页面应照常分配
+    gate = asyncio.Event()
+    done = {"a": [], "b": []}
+
+    def document(name, blocked):
+        async def handler(task):
+            done[name].append(task)
+            return task
+
+        async def admit(task):
+            if blocked and task > 0:
+                await gate.wait()
+
+        return DocumentJob(name, [0, 1, 2], handler, lambda results, failures: None, admit=admit)
+
+    async def main():
+        run = asyncio.ensure_future(run_jobs([document("a", True), document("b", False)], RequestScheduler(2)))
+        for _ in range(100):
+            if len(done["b"]) == 3:
+                break
+            await asyncio.sleep(0.01)
+        assert done == {"a": [0], "b": [0, 1, 2]}
+        gate.set()
+        await asyncio.wait_for(run, 5)
+        assert sorted(done["a"]) == [0, 1, 2]
+
+    asyncio.run(main())
@@ -0,0 +1,83 @@
+import re
+
+import pytest
+
+from repetition import find_repetition, is_structural, DegenerationMonitor
+from vision_api import has_repeated_substring, check_repetition, RepeatedOutputError
+
+LEGACY_PATTERN = re.compile(r"(.{1,20})\1{4,}")
+
+# 正常的Markdown排版结构，不应被判为退化输出
+STRUCTURAL_TEXTS = {
+    "五列表格": "| 年份 | 收入 | 支出 | 结余 | 备注 |\n| --- | --- | --- | --- | --- |\n| 2020 | 10 | 8 | 2 | 无 |\n",
+    "十二列表格": "|" + "|".join(f" 列{index} " for index in range(12)) + "|\n|" + " :---: |" * 12 + "\n",
+    "填空横线": "姓名：________________________ 学号：________________________\n",
+    "目录引导点": "第一章 引言 " + "." * 80 + " 1\n第二章 方法 " + "." * 80 + " 5\n",
+    "分隔线": "上文\n\n" + "-" * 120 + "\n\n下文\n\n" + "*" * 60 + "\n",
+    "空白表格行": "| 题号 | 答案 |\n|---|---|\n" + "|      |      |\n" * 8,
+    "零矩阵": "$$\\begin{pmatrix} 0 & 0 & 0 & 0 & 0 \\\\ 0 & 0 & 0 & 0 & 0 \\end{pmatrix}$$",
+}
+
+# 退化的输出：短单元、整句和整行反复出现直到输出上限
+DEGENERATE_TEXTS = {
+    "短单元": "正文开始。" + "的的" * 200,
+    "整句": "开头。" + "这是一句被模型反复输出的长句子，没有换行。" * 10,
+    "整行": "开头\n" + "模型陷入循环输出同一行内容\n" * 12,
+    "多行段落": "开头\n" + "第一行内容\n第二行内容\n" * 10,
+}
+
+
+@pytest.mark.parametrize("name", STRUCTURAL_TEXTS)
+def test_structural_markdown_is_not_degenerate(name):
+    text = STRUCTURAL_TEXTS[name]
+    assert find_repetition(text) is None
+    assert check_repetition(text) == text
+
+
+@pytest.mark.parametrize("name", DEGENERATE_TEXTS)
+def test_degenerate_output_is_detected(name):
+    with pytest.raises(RepeatedOutputError):
+        check_repetition(DEGENERATE_TEXTS[name])
+
+
+def test_structural_run_does_not_hide_later_repetition():
+    text = "| a | b | c | d | e | f |\n" + "|---" * 6 + "|\n" + "循环" * 100
+    repetition = find_repetition(text)
+    assert repetition is not None and repetition.unit == "循环"
+
+
+def test_short_repetition_below_min_chars_is_allowed():
+    assert find_repetition("哈哈哈哈哈哈，真有意思。") is None
+    assert find_repetition("哈" * 100) is not None
+
+
+def test_is_structural():
+    assert is_structural(" --- |")
+    assert is_structural("._")
+    assert not is_structural(" 0 &")
+    assert not is_structural("的")
+
+
+@pytest.mark.parametrize("text", [
+    "abababababab", "| --- | --- | --- | --- | --- |", "________", "正常的文本，没有重复。", "ab\nab\nab\nab\nab",
+    "x" + "一二三" * 5 + "y", "一二三" * 4,
+])
+def test_has_repeated_substring_matches_legacy_regex(text):
+    assert has_repeated_substring(text) == (LEGACY_PATTERN.search(text) is not None)
+
+
+def test_stream_monitor_accepts_wide_table():
+    header = "|" + "|".join(f" 列{index} " for index in range(10)) + "|\n"
+    rows = "".join("|" + "|".join(f" {row * 10 + col} " for col in range(10)) + "|\n" for row in range(40))
+    text = header + "|" + " --- |" * 10 + "\n" + rows
+    monitor = DegenerationMonitor()
+    for index in range(0, len(text), 7):
+        assert monitor.feed(text[index:index + 7]) is None
+
+
+def test_stream_monitor_aborts_on_loop():
+    monitor = DegenerationMonitor()
+    found = None
+    for _ in range(200):
+        found = found or monitor.feed("反复输出")
+    assert found is not None
@@ -0,0 +1,138 @@
+import json
+import time
+import threading
+import http.client
+
+import pytest
+
+from job_manager import JobManager
+from server import create_server
+
+
+@pytest.fixture
+def service(stub, tmp_path):
+    """
+    启动连接替身模型服务的转换服务，返回 (替身服务, 发送请求的函数, 允许路径提交的目录)
+    """
+    model = stub(content="# 转换结果\n\n页面内容")
+    path_root = tmp_path / "shared"
+    path_root.mkdir()
+    server = create_server(JobManager(max_workers=4), port=0,
+                           upload_dir=str(tmp_path / "upload"), markdown_dir=str(tmp_path / "markdown"),
+                           path_root=str(path_root))
+    threading.Thread(target=server.serve_forever, args=(0.05,), daemon=True).start()
+    host, port = server.server_address[:2]
+
+    def request(method, path, body=None, headers=None):
+        connection = http.client.HTTPConnection(host, port, timeout=10)
+        try:
+            connection.request(method, path, body=body, headers=headers or {})
+            response = connection.getresponse()
+            content = response.read()
+            if response.getheader("Content-Type", "").startswith("application/json"):
+                content = json.loads(content)
+            return response.status, content
+        finally:
+            connection.close()
+
+    yield model, request, path_root
+    server.shutdown()
+    server.server_close()
+
+
+def wait_finished(request, job_id, timeout=20):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        status, job = request("GET", f"/jobs/{job_id}")
+        assert status == 200
+        if job["status"] not in ("queued", "running"):
+            return job
+        time.sleep(0.05)
+    raise AssertionError(f"任务 {job_id} 没有在{timeout}秒内结束")
+
+
+def test_upload_convert_and_fetch_markdown(service, make_pdf):
+    model, request, _ = service
+    with open(make_pdf(3), "rb") as pdf_file:
+        status, job = request("POST", "/jobs?name=report.pdf", pdf_file.read())
+    assert status == 202
+
+    job = wait_finished(request, job["id"])
+    assert job["status"] == "done"
+    assert job["pages"] == {"done": 3, "total": 3}
+    status, markdown = request("GET", job["markdown"])
+    assert status == 200
+    assert markdown.decode("utf-8").count("页面内容") == 3
+    assert model.requests == 3
+
+    status, jobs = request("GET", "/jobs")
+    assert status == 200 and [item["id"] for item in jobs] == [job["id"]]
+    status, health = request("GET", "/health")
+    assert health["jobs"] == {"done": 1}
+    status, metrics = request("GET", "/metrics")
+    assert status == 200 and b"md_pages_total" in metrics
+
+
+def test_same_document_is_converted_once(service, make_pdf):
+    model, request, _ = service
+    with open(make_pdf(2), "rb") as pdf_file:
+        content = pdf_file.read()
+    _, first = request("POST", "/jobs?name=a.pdf", content)
+    wait_finished(request, first["id"])
+    status, second = request("POST", "/jobs?name=b.pdf", content)
+    # 已有完成结果，直接返回200且不再请求模型
+    assert status == 200
+    assert second["reused"] or second["id"] == first["id"]
+    assert model.requests == 2
+
+
+@pytest.mark.parametrize("headers, body, status", [
+    ({"Content-Length": "abc"}, None, 400),
+    ({"Content-Length": "-5"}, None, 400),
+    ({"Content-Type": "application/json"}, b"[]", 400),
+    ({"Content-Type": "application/json"}, b"{not json", 400),
+    ({"Content-Type": "application/json"}, b'{"path": 1}', 400),
+    ({}, b"%PDF", 400),
+])
+def test_malformed_requests_are_rejected(service, headers, body, status):
+    _, request, _ = service
+    # 请求头中已有Content-Length时，http.client不再按请求体计算
+    assert request("POST", "/jobs", body, headers)[0] == status
+
+
+def test_path_submission_is_limited_to_root(service, make_pdf, tmp_path):
+    _, request, path_root = service
+    headers = {"Content-Type": "application/json"}
+    outside = make_pdf(1, "outside.pdf")
+    status, error = request("POST", "/jobs", json.dumps({"path": outside}), headers)
+    assert status == 403
+    status, _ = request("POST", "/jobs", json.dumps({"path": str(path_root / ".." / "outside.pdf")}), headers)
+    assert status == 403
+
+    inside = make_pdf(1, "inside.pdf", path_root)
+    status, job = request("POST", "/jobs", json.dumps({"path": inside}), headers)
+    assert status == 202
+    assert wait_finished(request, job["id"])["status"] == "done"
+
+
+def test_path_submission_is_disabled_by_default(stub, make_pdf, tmp_path):
+    stub()
+    server = create_server(JobManager(max_workers=1), port=0, upload_dir=str(tmp_path / "upload"),
+                           markdown_dir=str(tmp_path / "markdown"))
+    threading.Thread(target=server.serve_forever, args=(0.05,), daemon=True).start()
+    try:
+        connection = http.client.HTTPConnection(*server.server_address[:2], timeout=10)
+        connection.request("POST", "/jobs", json.dumps({"path": make_pdf(1)}), {"Content-Type": "application/json"})
+        assert connection.getresponse().status == 403
+        connection.close()
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_unknown_routes_and_jobs(service):
+    _, request, _ = service
+    assert request("GET", "/nothing")[0] == 404
+    assert request("GET", "/jobs/missing")[0] == 404
+    assert request("DELETE", "/jobs/missing")[0] == 404
+    assert request("POST", "/other", b"x")[0] == 404
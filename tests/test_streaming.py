@@ -0,0 +1,70 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from async_engine import run_sync
+from vision_api import process_pdf_page, process_pdf_page_async, get_stream_stats, split_packed_response, RepeatedOutputError
+
+PNG = bytes.fromhex(
+    "89504e470d0a1a0a0000000d4948445200000001000000010802000000907753de"
+    "0000000c4944415408d763f8ffff3f0005fe02fea7d66a880000000049454e44ae426082")
+
+
+def wide_table(columns: int = 12, rows: int = 30) -> str:
+    header = "|" + "|".join(f" 列{index} " for index in range(columns)) + "|\n"
+    rule = "|" + " --- |" * columns + "\n"
+    body = "".join("|" + "|".join(f" {row}.{col} " for col in range(columns)) + "|\n" for row in range(rows))
+    return "## 表格\n\n" + header + rule + body
+
+
+def test_streamed_wide_table_is_not_aborted(stub):
+    content = wide_table()
+    server = stub(content=content)
+    aborted = get_stream_stats().aborted
+    assert run_sync(process_pdf_page_async(PNG)) == content
+    # 没有提前中止，也没有用采样参数重新请求
+    assert server.requests == 1
+    assert get_stream_stats().aborted == aborted
+
+
+def test_degenerate_stream_is_aborted_and_resampled(stub):
+    server = stub(content="开头。" + "循环输出" * 2000)
+    aborted = get_stream_stats().aborted
+    try:
+        run_sync(process_pdf_page_async(PNG))
+    except RepeatedOutputError:
+        pass
+    else:
+        raise AssertionError("退化输出应该抛出RepeatedOutputError")
+    # 第一次请求中止后立即用采样参数重新请求一次
+    assert server.requests == 2
+    assert get_stream_stats().aborted == aborted + 2
+
+
+def test_sync_calls_from_threads_share_connections(stub):
+    server = stub()
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        results = list(executor.map(lambda _: process_pdf_page(PNG), range(20)))
+    assert results == [server.content] * 20
+    assert server.requests == 20
+    # 各线程共用后台事件循环中的客户端，连接数不超过并发线程数
+    assert server.connections <= 4
+
+
+def test_sync_call_inside_running_loop(stub):
+    server = stub()
+
+    async def caller():
+        return process_pdf_page(PNG)
+
+    assert asyncio.run(caller()) == server.content
+
+
+def test_split_packed_response():
+    text = "前言\n===PAGE 1===\n第一页\n=== PAGE 2 ===\n第二页\n===PAGE 3===\n第三页"
+    assert split_packed_response(text, 3) == ["第一页", "第二页", "第三页"]
+    # 缺少标记或内容为空的页面无法拆分
+    assert split_packed_response("===PAGE 1===\n第一页\n===PAGE 3===\n", 3) == ["第一页", None, None]
+    # 序号回退或超出页数的标记视为正文
+    assert split_packed_response("===PAGE 2===\n第二页\n===PAGE 1===\n===PAGE 9===", 2) == [None, "第二页\n===PAGE 1===\n===PAGE 9==="]
+    # 截断时最后一页不完整
+    assert split_packed_response("===PAGE 1===\n第一页\n===PAGE 2===\n第二", 2, truncated=True) == ["第一页", None]
@@ -0,0 +1,183 @@
+import re
+from collections import Counter
+
+# 文本层少于该字符数的页面视为扫描页或空白页
+MIN_TEXT_CHARS = 80
+# 图片或矢量图形覆盖页面面积的比例超过该值时视为图片主导页面
+MAX_GRAPHIC_COVERAGE = 0.25
+# 数学字体或数学符号字符占比超过该值时视为公式较多的页面
+MAX_MATH_RATIO = 0.03
+# 页面上矢量路径数量超过该值时（公式分数线、表格线、图表等）交给视觉模型
+MAX_DRAWINGS = 40
+
+# 常见的数学排版字体名称片段（TeX的Computer Modern/AMS字体、STIX、Cambria Math等）
+MATH_FONT_PATTERN = re.compile(r"CMMI|CMSY|CMEX|MSAM|MSBM|EUFM|RSFS|Math|Symbol|STIX|Cambria", re.IGNORECASE)
+# 数学运算符、希腊字母及上下标等字符
+MATH_CHAR_PATTERN = re.compile(r"[Ͱ-Ͽ⁰-₟∀-⋿←-⇿⟀-⟯⦀-⫿\U0001d400-\U0001d7ff]")
+
+ROUTE_TEXT = "text"
+ROUTE_VISION = "vision"
+
+
+def _text_spans(text_dict: dict):
+    """
+    遍历PyMuPDF文本字典中的所有文本片段
+    """
+    for block in text_dict.get("blocks", []):
+        if block.get("type") != 0:
+            continue
+        for line in block.get("lines", []):
+            for span in line.get("spans", []):
+                yield span
+
+
+def _coverage(rects, page_rect) -> float:
+    """
+    计算一组矩形覆盖页面面积的比例（重叠部分按近似处理，结果不超过1）
+    """
+    page_area = abs(page_rect)
+    if page_area <= 0:
+        return 0.0
+    covered = sum(abs(rect & page_rect) for rect in rects)
+    return min(covered / page_area, 1.0)
+
+
+def analyze_page(page) -> tuple[str, str]:
+    """
+    检查PDF页面的文本层，决定该页面是否需要交给视觉模型
+
+    Args:
+        page: PyMuPDF页面对象
+
+    Returns:
+        (路由, 原因) 元组，路由为ROUTE_TEXT或ROUTE_VISION
+    """
+    text_dict = page.get_text("dict")
+    spans = list(_text_spans(text_dict))
+    text = "".join(span["text"] for span in spans)
+    char_count = len(text.strip())
+
+    if char_count < MIN_TEXT_CHARS:
+        return ROUTE_VISION, "扫描页或文本层为空"
+
+    garbled = sum(1 for ch in text if ch == "\ufffd" or (ord(ch) < 32 and not ch.isspace()))
+    if garbled > char_count * 0.01:
+        return ROUTE_VISION, "文本层存在乱码"
+
+    image_rects = [page.rect & info["bbox"] for info in page.get_image_info()]
+    if _coverage(image_rects, page.rect) > MAX_GRAPHIC_COVERAGE:
+        return ROUTE_VISION, "图片占比较高"
+
+    drawings = page.get_drawings()
+    if len(drawings) > MAX_DRAWINGS or _coverage([d["rect"] for d in drawings], page.rect) > MAX_GRAPHIC_COVERAGE:
+        return ROUTE_VISION, "矢量图形较多"
+
+    math_chars = sum(len(span["text"]) for span in spans if MATH_FONT_PATTERN.search(span.get("font", "")))
+    math_chars += len(MATH_CHAR_PATTERN.findall(text))
+    if math_chars > char_count * MAX_MATH_RATIO:
+        return ROUTE_VISION, "数学公式较多"
+
+    return ROUTE_TEXT, "纯文本页面"
+
+
+def text_metrics(page) -> dict:
+    """
+    统计PDF页面文本层的字符数、小字号、公式占比和文字密度，用于选择渲染分辨率
+
+    Args:
+        page: PyMuPDF页面对象
+
+    Returns:
+        包含chars（字符数）、small_size（按字符数加权的第20百分位字号，单位为点）、
+        math_ratio（公式字符占比）和density（每平方英寸字符数）的字典
+    """
+    spans = [span for span in _text_spans(page.get_text("dict")) if span["text"].strip()]
+    char_count = sum(len(span["text"].strip()) for span in spans)
+
+    small_size = 0.0
+    if char_count:
+        remaining = char_count * 0.2
+        for span in sorted(spans, key=lambda item: item["size"]):
+            remaining -= len(span["text"].strip())
+            if remaining <= 0:
+                small_size = span["size"]
+                break
+
+    math_chars = sum(len(span["text"]) for span in spans if MATH_FONT_PATTERN.search(span.get("font", "")))
+    math_chars += sum(len(MATH_CHAR_PATTERN.findall(span["text"])) for span in spans)
+    area_sq_in = abs(page.rect) / (72 * 72)
+
+    return {
+        "chars": char_count,
+        "small_size": small_size,
+        "math_ratio": math_chars / char_count if char_count else 0.0,
+        "density": char_count / area_sq_in if area_sq_in else 0.0,
+    }
+
+
+def _join_lines(lines: list) -> str:
+    """
+    将同一文本块内的多行合并为一个段落，处理英文断词连字符，中文行间不插入空格
+    """
+    merged = ""
+    for line in lines:
+        if not merged:
+            merged = line
+        elif merged.endswith("-") and line[:1].islower():
+            merged = merged[:-1] + line
+        elif ord(merged[-1]) > 0x2E7F or ord(line[0]) > 0x2E7F:
+            merged += line
+        else:
+            merged += " " + line
+    return merged
+
+
+def page_to_markdown(page) -> str:
+    """
+    直接从PDF文本层生成Markdown，不调用视觉模型
+
+    根据字号推断标题层级，忽略只包含页码的文本块，保留段落与列表结构。
+
+    Args:
+        page: PyMuPDF页面对象
+
+    Returns:
+        页面的Markdown文本
+    """
+    text_dict = page.get_text("dict")
+
+    # 按字符数加权统计正文字号
+    size_counter = Counter()
+    for span in _text_spans(text_dict):
+        size_counter[round(span["size"], 1)] += len(span["text"])
+    body_size = size_counter.most_common(1)[0][0] if size_counter else 0
+
+    paragraphs = []
+    for block in text_dict.get("blocks", []):
+        if block.get("type") != 0:
+            continue
+        lines = []
+        max_size = 0
+        for line in block.get("lines", []):
+            line_text = "".join(span["text"] for span in line.get("spans", [])).strip()
+            if line_text:
+                lines.append(line_text)
+                max_size = max([max_size] + [span["size"] for span in line.get("spans", []) if span["text"].strip()])
+        if not lines:
+            continue
+
+        block_text = _join_lines(lines)
+        # 忽略页码
+        if re.fullmatch(r"[-–—\s]*\d+[-–—\s]*", block_text):
+            continue
+
+        if body_size and max_size >= body_size * 1.5:
+            paragraphs.append(f"# {block_text}")
+        elif body_size and max_size >= body_size * 1.2:
+            paragraphs.append(f"## {block_text}")
+        elif all(re.match(r"^[•●▪◦·\-–]\s*", line) for line in lines):
+            paragraphs.append("\n".join(re.sub(r"^[•●▪◦·\-–]\s*", "- ", line) for line in lines))
+        else:
+            paragraphs.append(block_text)
+
+    return "\n\n".join(paragraphs)
@@ -1,54 +1,33 @@
 import os
+import re
+import json
+import time
 import base64
-from typing import Optional, List
-from zhipuai import ZhipuAI
+import asyncio
+import weakref
+import threading
+from typing import Optional, List, Tuple, Union, BinaryIO
+import httpx
 from dotenv import load_dotenv
-import concurrent.futures
-from pathlib import Path
+from async_engine import RequestScheduler, run_shared
+from rate_limiter import get_rate_limiter
+from repetition import find_repetition, Repetition, GarbledText, DegenerationMonitor
+from metrics import get_run_metrics
 
 # 加载.env文件中的环境变量
 load_dotenv()
 
-class Translate_Error(Exception):
-    """
-    翻译错误异常类
-    """
-    pass
+# 视觉模型名称及请求参数（修改这些值会使页面缓存自动失效）
+MODEL_NAME = "glm-4v-plus-0111"
+TEMPERATURE = 0.0
+MAX_TOKENS = 4096
+# 单张图像大约消耗的输入token数，仅用于限速预估
+ESTIMATED_IMAGE_TOKENS = 1600
+# 输出退化后立即重新请求时使用的解码参数：开启采样，跳出确定性解码的重复循环
+RESAMPLE_TEMPERATURE = 0.7
+RESAMPLE_TOP_P = 0.9
 
-def process_pdf_page(image_path: str, api_key: Optional[str] = None) -> str:
-    """
-    使用OpenAI视觉模型处理图像文件（PDF页面或其他图像格式）
-    
-    Args:
-        image_path: 图像文件路径
-        api_key: OpenAI API密钥，如果为None则从环境变量获取
-        
-    Returns:
-        视觉模型的文本输出
-    """
-    # 设置API密钥
-    api_key = api_key or os.environ.get("OPENAI_API_KEY")
-        
-    if not api_key:
-        raise ValueError("OpenAI API密钥未提供，请通过参数传入或设置OPENAI_API_KEY环境变量")
-    
-    try:
-        # 创建ZhipuAI客户端
-        client = ZhipuAI(api_key=api_key)
-        
-        # 打开并读取图像文件
-        with open(image_path, "rb") as image_file:
-            # 将图像编码为base64
-            base64_image = base64.b64encode(image_file.read()).decode('utf-8')
-            
-            # 调用ZhipuAI视觉模型API
-            response = client.chat.completions.create(
-                temperature=0.0,  # 控制输出的随机性，0.0为确定输出，1.0为最大随机性
-                model="glm-4v-plus-0111",  # 使用支持视觉的模型
-                messages=[
-                    {
-                        "role": "system",
-                        "content": r"""
+SYSTEM_PROMPT = r"""
                         # 专业数学翻译规范
 你是一名专业数学翻译专家，精通英中双语数学术语、符号体系及概念框架，专业覆盖纯数学、应用数学及数学教育领域。
 
@@ -132,28 +111,647 @@ def process_pdf_page(image_path: str, api_key: Optional[str] = None) -> str:
 - 对于字母公式，使用latex语法进行翻译。比如$\lambda$,$$x+y=1$$
 
 翻译数学内容时，应始终以数学准确性为首要原则，同时确保译文符合中文数学工作者与学习者的阅读习惯。若遇到模糊记法、不明确假设或需结合语境的专业术语，应主动寻求澄清。核心目标是产出兼具数学精确性、教育价值与中文数学社群文化适配性的译文。"""
-                    },
-                    {
-                        "role": "user",
-                        "content": [
-                            {
-                                "type": "image_url",
-                                "image_url": {
-                                    "url": base64_image
-                                }
-                            },
-                            {"type": "text", "text": "请翻译图片中的内容。注意忽略页眉、页脚以及页码"}
-                        ]
+
+USER_PROMPT = "请翻译图片中的内容。注意忽略页眉、页脚以及页码"
+
+# 多页打包请求的分隔标记：模型在每一页的译文前单独输出一行标记，据此拆回各页结果
+PAGE_MARKER = "===PAGE {index}==="
+PAGE_MARKER_PATTERN = re.compile(r"^[ \t]*=+[ \t]*PAGE[ \t]+(\d+)[ \t]*=+[ \t]*$", re.MULTILINE)
+PACKED_FORMAT_PROMPT = (
+    "每一页的译文之前单独占一行写出分隔标记" + PAGE_MARKER.format(index="k") +
+    "（k为页序号，从1开始），不要合并或省略任何一页，也不要输出其他说明。"
+)
+# 多张图片放在同一个请求中
+BUNDLED_USER_PROMPT = "下面共有{count}张图片，依次是文档中连续的{count}页。请按顺序分别翻译每一页的内容，注意忽略页眉、页脚以及页码。" + PACKED_FORMAT_PROMPT
+# 多页拼接成一张图片
+TILED_USER_PROMPT = "图片中按从左到右、从上到下的顺序拼接了文档中连续的{count}页，每页左上角标有页序号，页与页之间用灰线分隔。请按顺序分别翻译每一页的内容，注意忽略页眉、页脚以及页码。" + PACKED_FORMAT_PROMPT
+
+
+def request_fingerprint() -> dict:
+    """
+    返回决定模型输出的全部请求参数，用于构造页面缓存键
+    
+    Returns:
+        包含模型名称、提示词和解码参数的字典
+    """
+    return {
+        'model': MODEL_NAME,
+        'system_prompt': SYSTEM_PROMPT,
+        'user_prompt': USER_PROMPT,
+        'temperature': TEMPERATURE,
+        'max_tokens': MAX_TOKENS,
+    }
+
+
+# 异步客户端绑定在创建它的事件循环上，因此按事件循环分别缓存
+_async_clients = weakref.WeakKeyDictionary()
+
+DEFAULT_BASE_URL = "https://open.bigmodel.cn/api/paas/v4"
+
+
+def get_async_client(api_key: str) -> httpx.AsyncClient:
+    """
+    获取当前事件循环中指定API密钥对应的共享异步HTTP客户端，复用keep-alive连接，避免每页重新建立连接和TLS握手
+    
+    连接数上限取自环境变量HTTP_POOL_SIZE；留空时不限制，并发上限由调度器的信号量控制。
+    
+    Args:
+        api_key: API密钥
+        
+    Returns:
+        httpx.AsyncClient实例
+    """
+    base_url = os.environ.get("ZHIPUAI_BASE_URL") or DEFAULT_BASE_URL
+    loop_clients = _async_clients.setdefault(asyncio.get_running_loop(), {})
+    client = loop_clients.get((api_key, base_url))
+    if client is None:
+        pool_size = int(os.environ.get("HTTP_POOL_SIZE") or 0) or None
+        client = httpx.AsyncClient(
+            base_url=base_url.rstrip("/") + "/",
+            headers={"Authorization": f"Bearer {api_key}"},
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+            timeout=httpx.Timeout(timeout=300.0, connect=8.0),
+        )
+        loop_clients[(api_key, base_url)] = client
+    return client
+
+
+async def close_async_clients():
+    """
+    关闭当前事件循环中创建的所有异步HTTP客户端
+    """
+    loop_clients = _async_clients.pop(asyncio.get_running_loop(), {})
+    for client in loop_clients.values():
+        await client.aclose()
+
+
+class Translate_Error(Exception):
+    """
+    翻译错误异常类
+    """
+    pass
+
+
+class VisionAPIError(Exception):
+    """
+    视觉模型调用失败的基类
+    
+    retryable属性告诉调度器的重试策略该错误是否值得重试。
+    """
+    retryable = False
+
+    def __init__(self, message: str, status_code: Optional[int] = None, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+class RetryableAPIError(VisionAPIError):
+    """
+    可重试的错误：限流（429）、服务端错误（5xx）、网络连接失败或超时、响应格式异常
+    """
+    retryable = True
+
+
+class FatalAPIError(VisionAPIError):
+    """
+    不可重试的错误：认证失败、请求参数错误等其他4xx错误
+    """
+    retryable = False
+
+
+class DegenerateOutputError(RetryableAPIError):
+    """
+    模型输出退化（连续重复或乱码），结果不可用，可以重试
+    """
+
+
+class RepeatedOutputError(DegenerateOutputError):
+    """
+    模型输出退化为连续重复的内容
+    """
+
+    def __init__(self, repetition: Repetition):
+        super().__init__(f"检测到模型输出重复: {repetition}")
+        self.repetition = repetition
+
+
+class GarbledOutputError(DegenerateOutputError):
+    """
+    模型输出退化为乱码
+    """
+
+    def __init__(self, garbled: GarbledText):
+        super().__init__(f"检测到模型输出乱码: {garbled}")
+        self.garbled = garbled
+
+
+def check_repetition(text: str) -> str:
+    """
+    检查模型输出是否退化为连续重复
+
+    Args:
+        text: 模型的文本输出
+
+    Returns:
+        原文本
+
+    Raises:
+        RepeatedOutputError: 检测到连续重复
+    """
+    repetition = find_repetition(text)
+    if repetition is not None:
+        raise RepeatedOutputError(repetition)
+    return text
+
+
+def stream_enabled() -> bool:
+    """
+    是否以流式方式请求模型输出（环境变量STREAM_OUTPUT，默认开启，设为0时关闭）
+    
+    流式请求可以在输出退化时立即中止，不必等模型输出到max_tokens。
+    """
+    return os.environ.get("STREAM_OUTPUT", "1") != "0"
+
+
+class StreamStats:
+    """
+    流式请求的统计：完成的请求数、因输出退化提前中止的请求数，以及中止节省的输出token数
+    
+    中止时已输出的片段数近似为已生成的token数；退化的输出通常会一直重复到max_tokens，
+    因此按MAX_TOKENS减去已生成的token数估计节省的token数。
+    """
+
+    def __init__(self):
+        self.completed = 0
+        self.aborted = 0
+        self.generated_tokens = 0
+        self.saved_tokens = 0
+        self._lock = threading.Lock()
+
+    def record_complete(self):
+        with self._lock:
+            self.completed += 1
+
+    def record_abort(self, generated_tokens: int):
+        """
+        记录一次提前中止
+
+        Args:
+            generated_tokens: 中止前已生成的token数
+        """
+        with self._lock:
+            self.aborted += 1
+            self.generated_tokens += generated_tokens
+            self.saved_tokens += max(0, MAX_TOKENS - generated_tokens)
+
+    def summary(self) -> str|None:
+        """
+        生成一行提前中止统计，没有中止过请求时返回None
+        """
+        if not self.aborted:
+            return None
+        return f"流式输出: 提前中止 {self.aborted} 次退化输出，节省约 {self.saved_tokens} 个输出token"
+
+
+_stream_stats = StreamStats()
+
+
+def get_stream_stats() -> StreamStats:
+    """
+    获取整个运行期间的流式请求统计
+    """
+    return _stream_stats
+
+
+class StreamedCompletion:
+    """
+    把流式响应的增量片段拼接为与非流式响应结构相同的结果，并在输出退化时提前中止
+    """
+
+    def __init__(self):
+        self.monitor = DegenerationMonitor()
+        self.finish_reason = None
+        self.usage = None
+        self.first_content_at = None
+
+    def add(self, content: Optional[str], finish_reason: Optional[str] = None, usage: Optional[dict] = None):
+        """
+        追加一个增量片段
+
+        Raises:
+            DegenerateOutputError: 输出出现连续重复或乱码，调用方应立即关闭连接
+        """
+        if usage:
+            self.usage = usage
+        if finish_reason:
+            self.finish_reason = finish_reason
+        if not content:
+            return
+        if self.first_content_at is None:
+            self.first_content_at = time.perf_counter()
+        found = self.monitor.feed(content)
+        if found is not None:
+            get_stream_stats().record_abort(self.monitor.chunks)
+            if isinstance(found, GarbledText):
+                raise GarbledOutputError(found)
+            raise RepeatedOutputError(found)
+
+    def final_usage(self, estimated_tokens: int) -> dict:
+        """
+        实际的token用量：有usage时以其为准（提前中止时没有），否则按预估的输入token数和已生成的片段数估计
+        """
+        if self.usage and self.usage.get("total_tokens") is not None:
+            return self.usage
+        prompt_tokens = estimated_tokens - MAX_TOKENS // 2
+        return {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": self.monitor.chunks,
+            "total_tokens": prompt_tokens + self.monitor.chunks,
+        }
+
+    def record_timings(self, headers_at: float):
+        """
+        把收到响应头之后的耗时分为等待第一个输出片段和生成输出两个阶段计入运行统计
+
+        Args:
+            headers_at: 收到响应头时的time.perf_counter()
+        """
+        end = time.perf_counter()
+        first_content_at = self.first_content_at or end
+        metrics = get_run_metrics()
+        metrics.record("first_token", first_content_at - headers_at)
+        metrics.record("generation", end - first_content_at)
+
+    def result(self) -> dict:
+        """
+        返回与非流式响应结构相同的结果
+        """
+        get_stream_stats().record_complete()
+        return {
+            "choices": [{
+                "index": 0,
+                "finish_reason": self.finish_reason,
+                "message": {"role": "assistant", "content": self.monitor.text},
+            }],
+            "usage": self.usage,
+        }
+
+
+def classify_error(error: Exception) -> VisionAPIError:
+    """
+    将httpx或响应解析抛出的异常转换为可重试/致命的类型化异常
+    
+    Args:
+        error: 原始异常
+        
+    Returns:
+        RetryableAPIError或FatalAPIError
+    """
+    if isinstance(error, VisionAPIError):
+        return error
+    
+    response = getattr(error, "response", None)
+    status_code = getattr(error, "status_code", None)
+    if status_code is None and response is not None:
+        status_code = response.status_code
+    
+    retry_after = None
+    if response is not None:
+        try:
+            retry_after = float(response.headers.get("Retry-After", ""))
+        except ValueError:
+            pass
+    
+    detail = str(error)
+    if isinstance(error, httpx.HTTPStatusError):
+        # 与SDK的错误信息格式保持一致
+        detail = f"Error code: {status_code}, with error text {response.text}"
+    message = f"处理图像时出错: {detail}"
+    if status_code is not None:
+        if status_code in (408, 429) or status_code >= 500:
+            return RetryableAPIError(message, status_code, retry_after)
+        return FatalAPIError(message, status_code)
+    if isinstance(error, httpx.TransportError):
+        return RetryableAPIError(message)
+    # 响应缺少choices等字段，通常是网关返回了不完整的数据
+    if isinstance(error, (KeyError, IndexError, TypeError, ValueError)):
+        return RetryableAPIError(message)
+    return FatalAPIError(message)
+
+
+ImageInput = Union[str, os.PathLike, bytes, bytearray, memoryview, BinaryIO]
+
+
+def encode_image(image: ImageInput) -> str:
+    """
+    将图像编码为base64字符串
+    
+    Args:
+        image: 图像文件路径、内存中的图像字节，或可读取的二进制文件对象
+        
+    Returns:
+        base64编码的图像
+    """
+    if isinstance(image, (str, os.PathLike)):
+        with open(image, "rb") as image_file:
+            data = image_file.read()
+    elif isinstance(image, (bytes, bytearray, memoryview)):
+        data = image
+    else:
+        data = image.read()
+    return base64.b64encode(data).decode('utf-8')
+
+
+def build_messages(base64_image: str|List[str], user_prompt: str = USER_PROMPT) -> list:
+    """
+    构造视觉模型请求的消息列表
+    
+    Args:
+        base64_image: base64编码的图像，打包请求时为多张图像的列表
+        user_prompt: 用户提示词
+        
+    Returns:
+        包含系统提示词和图像的消息列表
+    """
+    base64_images = [base64_image] if isinstance(base64_image, str) else base64_image
+    return [
+        {
+            "role": "system",
+            "content": SYSTEM_PROMPT
+        },
+        {
+            "role": "user",
+            "content": [
+                {
+                    "type": "image_url",
+                    "image_url": {
+                        "url": image
                     }
-                ],
-                max_tokens=4096
-            )
+                }
+                for image in base64_images
+            ] + [{"type": "text", "text": user_prompt}]
+        }
+    ]
+
+
+def build_request_body(base64_image: str|List[str], user_prompt: str = USER_PROMPT, resample: bool = False) -> dict:
+    """
+    构造chat-completions接口的完整请求体
+    
+    Args:
+        base64_image: base64编码的图像，打包请求时为多张图像的列表
+        user_prompt: 用户提示词
+        resample: 是否使用输出退化后重新请求的采样参数
+        
+    Returns:
+        请求体字典
+    """
+    body = {
+        "model": MODEL_NAME,
+        "messages": build_messages(base64_image, user_prompt),
+        "temperature": TEMPERATURE,
+        "max_tokens": MAX_TOKENS,
+    }
+    if resample:
+        body["temperature"] = RESAMPLE_TEMPERATURE
+        body["top_p"] = RESAMPLE_TOP_P
+    # SDK对temperature<=0的处理：关闭采样并使用最小温度
+    elif TEMPERATURE <= 0:
+        body["do_sample"] = False
+        body["temperature"] = 0.01
+    return body
+
+
+def estimate_request_tokens(image_tokens: int = ESTIMATED_IMAGE_TOKENS, user_prompt: str = USER_PROMPT) -> int:
+    """
+    预估单次请求消耗的token数，用于每分钟token数限速（收到响应后按实际用量修正）
+    
+    Args:
+        image_tokens: 请求中所有图像的预估token数
+        user_prompt: 用户提示词
+        
+    Returns:
+        提示词（按每字符约1个token粗略估计）、图像和一半输出上限之和
+    """
+    return len(SYSTEM_PROMPT) + len(user_prompt) + image_tokens + MAX_TOKENS // 2
+
+
+def split_packed_response(text: str, count: int, truncated: bool = False) -> List[Optional[str]]:
+    """
+    按分隔标记把打包请求的响应拆回各页结果
+    
+    只接受按页序号递增出现的标记；某页的内容为该页标记到下一个被接受的标记之间的文本。
+    缺少标记、内容为空或因输出长度上限被截断的页面无法可靠拆分，对应位置为None。
+    
+    Args:
+        text: 模型的文本输出
+        count: 打包的页数
+        truncated: 输出是否因长度上限被截断（截断时最后一个出现的页面不完整）
+        
+    Returns:
+        长度为count的列表，每个元素为该页结果或None
+    """
+    markers = []
+    for match in PAGE_MARKER_PATTERN.finditer(text):
+        index = int(match.group(1))
+        if 1 <= index <= count and (not markers or index > markers[-1][0]):
+            markers.append((index, match.start(), match.end()))
+
+    results = [None] * count
+    for position, (index, _, end) in enumerate(markers):
+        last = position + 1 == len(markers)
+        if last and truncated:
+            break
+        content = text[end:len(text) if last else markers[position + 1][1]].strip()
+        if content:
+            results[index - 1] = content
+    return results
+
+
+def process_pdf_page(image: ImageInput, api_key: Optional[str] = None) -> str:
+    """
+    使用OpenAI视觉模型处理图像（PDF页面或其他图像格式）
+    
+    同步接口，在共享的后台事件循环中运行process_pdf_page_async，两者共用同一套请求、重试和限速逻辑。
+    多个线程的调用共用同一个HTTP客户端和keep-alive连接；已在事件循环中时请直接使用process_pdf_page_async，
+    避免阻塞当前事件循环。
+    
+    Args:
+        image: 图像文件路径、内存中的图像字节，或可读取的二进制文件对象
+        api_key: OpenAI API密钥，如果为None则从环境变量获取
+        
+    Returns:
+        视觉模型的文本输出
+        
+    Raises:
+        RetryableAPIError: 限流、服务端错误、网络问题或输出退化，可以稍后重试
+        FatalAPIError: 认证失败、请求无效等无法通过重试解决的错误
+    """
+    return run_shared(process_pdf_page_async(image, api_key))
+
+
+async def post_chat_completion_async(body: dict, api_key: Optional[str] = None, estimated_tokens: Optional[int] = None) -> dict:
+    """
+    通过共享的异步客户端发送一次chat-completions请求，计入该API密钥的限速预算
+    
+    开启流式输出时边接收边检查输出，出现连续重复或乱码立即关闭连接，结果与非流式响应结构相同。
+    
+    Args:
+        body: 请求体
+        api_key: OpenAI API密钥，如果为None则从环境变量获取
+        estimated_tokens: 预估的token数，如果为None则按单页请求估计
+        
+    Returns:
+        解析后的响应JSON
+        
+    Raises:
+        RetryableAPIError: 限流、服务端错误、网络问题或输出退化，可以稍后重试
+        FatalAPIError: 认证失败、请求无效等无法通过重试解决的错误
+    """
+    # 设置API密钥
+    api_key = api_key or os.environ.get("OPENAI_API_KEY")
+        
+    if not api_key:
+        raise ValueError("OpenAI API密钥未提供，请通过参数传入或设置OPENAI_API_KEY环境变量")
+    
+    # 同一API密钥的所有请求共享一份限速预算
+    limiter = get_rate_limiter(api_key)
+    if estimated_tokens is None:
+        estimated_tokens = estimate_request_tokens()
+    metrics = get_run_metrics()
+    acquired = False
+    status_code = None
+    usage = None
+    headers_at = None
+    completion = StreamedCompletion()
+    
+    try:
+        client = get_async_client(api_key)
+        
+        # 调用ZhipuAI视觉模型API
+        with metrics.stage("queue"):
+            await limiter.acquire_async(estimated_tokens)
+        acquired = True
+        sent_at = time.perf_counter()
+        if stream_enabled():
+            # 退出上下文时关闭连接：提前中止后服务端随之停止生成
+            async with client.stream("POST", "chat/completions", json={**body, "stream": True}) as response:
+                headers_at = time.perf_counter()
+                metrics.record("request", headers_at - sent_at)
+                status_code = response.status_code
+                if response.is_error:
+                    await response.aread()
+                    response.raise_for_status()
+                if response.headers.get("Content-Type", "").startswith("text/event-stream"):
+                    async for line in response.aiter_lines():
+                        if not line.startswith("data:"):
+                            continue
+                        data = line[len("data:"):].strip()
+                        if data == "[DONE]":
+                            # 继续读到响应结束，连接才能放回连接池复用
+                            continue
+                        chunk = json.loads(data)
+                        if chunk.get("error"):
+                            raise RetryableAPIError(f"处理图像时出错: 流式响应中断 {chunk['error']}")
+                        choice = (chunk.get("choices") or [{}])[0]
+                        completion.add((choice.get("delta") or {}).get("content"), choice.get("finish_reason"), chunk.get("usage"))
+                    usage = completion.final_usage(estimated_tokens)
+                    return completion.result()
+                # 不支持流式输出的网关直接返回完整响应
+                await response.aread()
+        else:
+            response = await client.post("chat/completions", json=body)
+            metrics.record("request", time.perf_counter() - sent_at)
+            status_code = response.status_code
+            response.raise_for_status()
+        result = response.json()
+        usage = result.get("usage")
+        # 提前检查响应格式，缺少字段时按可重试错误处理
+        result["choices"][0]["message"]["content"]
+        return result
+    
+    except Exception as e:
+        error = classify_error(e)
+        if isinstance(error, DegenerateOutputError):
+            usage = completion.final_usage(estimated_tokens)
+        raise error from e
+    
+    finally:
+        if headers_at is not None:
+            completion.record_timings(headers_at)
+        if acquired:
+            metrics.add_usage(usage)
+            limiter.release(status_code, estimated_tokens, (usage or {}).get("total_tokens"))
+
+
+async def process_pdf_page_async(image: ImageInput, api_key: Optional[str] = None) -> str:
+    """
+    使用OpenAI视觉模型处理图像，等待响应期间不占用线程
+    
+    流式请求时边接收边检查输出，出现连续重复或乱码立即中止，并改用采样参数重新请求一次。
+    
+    Args:
+        image: 图像文件路径、内存中的图像字节，或可读取的二进制文件对象
+        api_key: OpenAI API密钥，如果为None则从环境变量获取
+        
+    Returns:
+        视觉模型的文本输出
         
-        # 提取并返回模型的回答
-        return response.choices[0].message.content
+    Raises:
+        RetryableAPIError: 限流、服务端错误、网络问题或输出退化，可以稍后重试
+        FatalAPIError: 认证失败、请求无效等无法通过重试解决的错误
+    """
+    try:
+        with get_run_metrics().stage("encode"):
+            base64_image = encode_image(image)
+    except Exception as e:
+        raise classify_error(e) from e
+    try:
+        result = await post_chat_completion_async(build_request_body(base64_image), api_key)
+    except DegenerateOutputError:
+        # 确定性解码重新请求会得到同样的退化输出，改用采样参数立即重新请求一次
+        result = await post_chat_completion_async(build_request_body(base64_image, resample=True), api_key)
+    
+    # 提取并返回模型的回答
+    return result["choices"][0]["message"]["content"]
+
+
+async def process_packed_pages_async(images: List[ImageInput], page_count: int, api_key: Optional[str] = None, image_tokens: Optional[int] = None) -> List[Optional[str]]:
+    """
+    在一次请求中处理多页，按分隔标记拆回各页结果
+    
+    Args:
+        images: 每页一张的图像列表；只有一张图像而page_count大于1时视为多页拼接成的图像
+        page_count: 打包的页数
+        api_key: OpenAI API密钥，如果为None则从环境变量获取
+        image_tokens: 所有图像的预估token数，如果为None则按每张图像ESTIMATED_IMAGE_TOKENS估计
+        
+    Returns:
+        长度为page_count的列表，每个元素为该页结果，无法拆分的页面为None
+        
+    Raises:
+        RetryableAPIError: 限流、服务端错误或网络问题，可以稍后重试
+        FatalAPIError: 认证失败、请求无效等无法通过重试解决的错误
+    """
+    prompt = TILED_USER_PROMPT if len(images) == 1 else BUNDLED_USER_PROMPT
+    prompt = prompt.format(count=page_count)
+    if image_tokens is None:
+        image_tokens = ESTIMATED_IMAGE_TOKENS * len(images)
     
+    try:
+        with get_run_metrics().stage("encode"):
+            base64_images = [encode_image(image) for image in images]
     except Exception as e:
-        return f"处理图像时出错: {str(e)}"
+        raise classify_error(e) from e
+    result = await post_chat_completion_async(
+        build_request_body(base64_images, prompt),
+        api_key,
+        estimate_request_tokens(image_tokens, prompt)
+    )
+    
+    choice = result["choices"][0]
+    return split_packed_response(choice["message"]["content"] or "", page_count, choice.get("finish_reason") == "length")
 
 def handle_text_content(text: str) -> str:
     """
@@ -168,9 +766,10 @@ def handle_text_content(text: str) -> str:
     # 1. 替换所有的\[ \] \( \)为$ $
     text = text.replace("\\[", "$$").replace("\\]", "$$")
     text = text.replace("\\(", "$").replace("\\)", "$")
-    # 2. 检查是否有重复的文字内容
-    if has_repeated_substring(text):
-        raise Translate_Error("检测到文本中存在重复的子字符串（重复5次以上）")
+    # 2. 检查是否有重复的文字内容（短字符单元、整句或整段重复）
+    repetition = find_repetition(text)
+    if repetition is not None:
+        raise Translate_Error(f"检测到文本中存在重复内容: {repetition}")
     
     return text
 
@@ -185,15 +784,25 @@ def has_repeated_substring(text: str, min_repeats: int = 5) -> bool:
     Returns:
         如果有重复次数达到min_repeats的子字符串返回True，否则返回False
     """
-    import re
-    
-    # 检测连续重复的子字符串（1-20个字符）
-    # 使用回溯引用 \1 来匹配重复内容
-    pattern = r'(.{1,20})\1{' + str(min_repeats - 1) + r',}'
-    
-    return bool(re.search(pattern, text))
+    # 检测连续重复的子字符串（1-20个字符，不跨行），与正则 (.{1,20})\1{4,} 的结果一致，
+    # 但按周期逐位比较，耗时与文本长度成线性关系
+    return find_repetition(text, min_repeats, long_repeats=None, line_repeats=None,
+                           min_chars=0, ignore_structural=False) is not None
 
 def process_single_image(image_data):
+    """
+    处理单个图像文件（同步接口，在共享的后台事件循环中运行process_single_image_async）
+    
+    Args:
+        image_data: 包含图像处理所需数据的字典
+        
+    Returns:
+        包含图像索引和处理结果的元组
+    """
+    return run_shared(process_single_image_async(image_data))
+
+
+async def process_single_image_async(image_data):
     """
     处理单个图像文件
     
@@ -202,6 +811,9 @@ def process_single_image(image_data):
         
     Returns:
         包含图像索引和处理结果的元组
+
+    Raises:
+        DegenerateOutputError: 模型输出存在重复内容，可以重试
     """
     image_index = image_data['image_index']
     image_path = image_data['image_path']
@@ -210,69 +822,109 @@ def process_single_image(image_data):
     
     print(f"处理图像 {image_index + 1}/{total_images}: {image_path}")
     
-    # 调用OpenAI视觉模型处理图像
-    image_text = process_pdf_page(image_path, api_key)
+    # 开启打包时与其他图像合并为一次请求，无法拆分出本图结果时改为单独请求
+    image_text = None
+    packer = image_data.get('packer')
+    if packer is not None:
+        with open(image_path, "rb") as image_file:
+            image_text = await packer.process(image_file.read())
+    if image_text is None:
+        # 调用OpenAI视觉模型处理图像
+        image_text = await process_pdf_page_async(image_path, api_key)
     
-    # 中间层，对返回的内容进行处理。
+    # 中间层，对返回的内容进行处理；输出重复时按可重试的错误交给调度器重试，不把错误信息当作图像内容
     try:
         image_text = handle_text_content(image_text)
     except Translate_Error as e:
-        print(f"处理图像 {image_index + 1}/{total_images} 时出错: {str(e)}")
-        return image_index, f"大模型输出错误: {str(e)}"
+        raise DegenerateOutputError(f"处理图像 {image_index + 1}/{total_images} 时出错: {str(e)}") from e
     
     # 返回图像索引和处理结果
     return image_index, image_text
 
 
-def process_images(image_paths: List[str], api_key: Optional[str] = None, max_workers: Optional[int] = None) -> List[str]:
+async def process_images_async(image_paths: List[str], api_key: Optional[str] = None, max_workers: Optional[int] = None, pack_pages: Optional[int] = None) -> Tuple[List[Optional[str]], list]:
     """
-    并发处理多个图像文件
+    并发处理多个图像文件（异步版本，可在已有的事件循环中调用）
     
     Args:
         image_paths: 图像文件路径列表
         api_key: OpenAI API密钥，如果为None则从环境变量获取
-        max_workers: 最大并发线程数，如果为None则从环境变量获取
+        max_workers: 最大并发请求数，如果为None则从环境变量获取
+        pack_pages: 每次请求最多打包的图像数，如果为None则从环境变量PACK_PAGES获取（1表示不打包）
         
     Returns:
-        处理结果列表，按原始顺序排列
+        (处理结果列表, 失败列表) 元组：处理结果与image_paths一一对应，文件不存在或重试耗尽的图像为None；
+        失败列表的每项为 (图像路径, 异常, 尝试次数)，文件不存在时尝试次数为0
     """
+    from page_packer import get_page_packer
+    
     # 如果未指定max_workers，则从环境变量获取，默认为5
     if max_workers is None:
         max_workers = int(os.environ.get("MAX_WORKERS", 5))
     
-    # 准备图像处理任务
+    # 准备图像处理任务，较小的图像可以合并为一次请求
     total_images = len(image_paths)
+    packer = get_page_packer(api_key, pack_pages)
     image_tasks = []
+    results = [None] * total_images
+    failures = []
     
     for image_index, image_path in enumerate(image_paths):
         # 检查图像文件是否存在
         if not os.path.exists(image_path):
             print(f"错误：图像文件 '{image_path}' 不存在")
+            failures.append((image_path, FileNotFoundError(f"图像文件不存在: {image_path}"), 0))
             continue
             
         image_tasks.append({
             'image_index': image_index,
             'image_path': image_path,
             'api_key': api_key,
-            'total_images': total_images
+            'total_images': total_images,
+            'packer': packer
         })
     
-    # 使用线程池并发处理图像
-    results = []
-    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
-        # 提交所有任务并获取Future对象
-        future_to_image = {executor.submit(process_single_image, task): task for task in image_tasks}
+    # 每张图像作为一页计入运行统计
+    metrics = get_run_metrics()
+    
+    async def handle(task):
+        with metrics.page(task['image_path'], 1):
+            return await process_single_image_async(task)
+    
+    def on_error(task, e, delay):
+        metrics.record_retry(task['image_path'], 1, delay)
+        print(f"{str(e)}，{delay:.1f}秒后重试图像 {task['image_path']}")
+    
+    def on_failure(task, e, attempts):
+        metrics.record_failure(task['image_path'], 1)
+        failures.append((task['image_path'], e, attempts))
+        print(f"处理图像 '{task['image_path']}' 失败（共尝试{attempts}次）: {str(e)}")
+    
+    # 使用调度器并发处理图像，可恢复的错误按重试策略重试，最终失败的图像在结果中为None
+    scheduler = RequestScheduler(max_workers)
+    for image_index, content in await scheduler.map(image_tasks, handle, on_error=on_error, on_failure=on_failure):
+        results[image_index] = content
+    
+    pack_summary = packer and packer.summary()
+    if pack_summary:
+        print(pack_summary)
+    if failures:
+        print(f"有 {len(failures)}/{total_images} 张图像处理失败: " + "，".join(os.path.basename(path) for path, _, _ in failures))
+    
+    return results, failures
+
+
+def process_images(image_paths: List[str], api_key: Optional[str] = None, max_workers: Optional[int] = None, pack_pages: Optional[int] = None) -> Tuple[List[Optional[str]], list]:
+    """
+    并发处理多个图像文件
+    
+    Args:
+        image_paths: 图像文件路径列表
+        api_key: OpenAI API密钥，如果为None则从环境变量获取
+        max_workers: 最大并发数，如果为None则从环境变量获取
+        pack_pages: 每次请求最多打包的图像数，如果为None则从环境变量PACK_PAGES获取（1表示不打包）
         
-        # 获取结果
-        for future in concurrent.futures.as_completed(future_to_image):
-            try:
-                image_index, image_content = future.result()
-                results.append((image_index, image_content))
-            except Exception as e:
-                print(f"处理图像时出错: {str(e)}")
-    
-    # 按原始顺序排序结果
-    results.sort(key=lambda x: x[0])
-    
-    # 返回处理结果列表
-    return [content for _, content in results]
\ No newline at end of file
+    Returns:
+        (处理结果列表, 失败列表) 元组，含义同process_images_async
+    """
+    return run_shared(process_images_async(image_paths, api_key, max_workers, pack_pages))